@@ -1,19 +1,34 @@
 from enum import Enum
 import argparse
 import logging
+import math
 import uuid
 import os
 
+from collections import defaultdict
 from pydantic import BaseModel
 from shutil import rmtree
+from typing import Dict, List
 
 from app.common.bbox import BBOX
 
 from app.common.http_retriever import check_exists
+from app.common.tile_validation import check_exists_locally, write_missing_summary
+from app.common.trace import span, trace_run
 from app.profiles import xyz, topo, xyzsummer, xyzwinter, xyzhunting, ates
-from app.record.run_recorder import record_run, has_prior_run
+from app.common.xyz import TILE_SIZE
+from app.record.run_recorder import (
+    record_run,
+    has_prior_run,
+    is_covered,
+    get_uncovered,
+)
 
-from app.sources.xyz_service import build_exists_check_requests as xyz_check_builder
+from app.sources.common.estimate import SourceEstimate
+from app.sources.xyz_service import (
+    build_exists_check_requests as xyz_check_builder,
+    count_tiles,
+)
 from app.common.util import (
     get_result_path,
     get_run_data_path,
@@ -27,6 +42,8 @@ class ProvisionArg(BaseModel):
     profile_name: str
     xyz_url: str = None
     skippable: bool
+    # re-rendering tiles whose inputs changed, which earlier runs cover by definition
+    stale: bool = False
 
 
 class ProvisionResult(Enum):
@@ -34,10 +51,17 @@ class ProvisionResult(Enum):
     SUCCESS = 1
 
 
+class ProvisionEstimate(BaseModel):
+    arg: ProvisionArg
+    skipped: bool
+    tiles: Dict[int, int]
+    sources: List[SourceEstimate]
+
+
 def provision(arg: ProvisionArg) -> ProvisionResult:
     bbox, profile_name, xyz_url = arg.bbox, arg.profile_name, arg.xyz_url
-    bbox_exists = has_prior_run(get_result_path((profile_name,)), bbox)
-    if bbox_exists and arg.skippable:
+    result_dir = get_result_path((profile_name,))
+    if _is_skipped(arg, result_dir):
         logging.info(
             f"Skipping {profile_name} {bbox.min_x},{bbox.min_y} {bbox.max_x},{bbox.max_y} as it already exists"
         )
@@ -46,22 +70,30 @@ def provision(arg: ProvisionArg) -> ProvisionResult:
         logging.info(
             f"Provisioning {profile_name} {bbox.min_x},{bbox.min_y} {bbox.max_x},{bbox.max_y}"
         )
+    render_bboxes = _get_render_bboxes(arg, result_dir)
+    if len(render_bboxes) == 0:
+        logging.info("Skipping as earlier runs already cover it")
+        return ProvisionResult.SKIPPED
+    if len(render_bboxes) > 1 or render_bboxes[0] != bbox:
+        logging.info(f"Rendering the {len(render_bboxes)} part(s) not yet covered")
 
     run_id = str(uuid.uuid4())
-    profiles = {
-        profile.NAME: {
-            "execute": profile.execute,
-            "zoom_min": profile.ZOOM_MIN,
-            "zoom_max": profile.ZOOM_MAX,
-            "format": profile.OUTPUT_FORMAT,
-        }
-        for profile in [xyz, topo, xyzsummer, xyzwinter, xyzhunting, ates]
-    }
-    profiles[profile_name]["execute"](bbox, run_id, {"xyz_url": xyz_url})
-    if int(os.environ.get("BVSAR_HEAD_VALIDATE", 0)) == 1:
-        logging.info("Validating result")
-        check_exists(
-            xyz_check_builder(
+    # each rendered part gets its own intermediaries
+    part_run_ids = [run_id] + [f"{run_id}-{i}" for i in range(1, len(render_bboxes))]
+    with trace_run(run_id), span(
+        "provision", profile=profile_name, bbox=bbox.get_wkt()
+    ):
+        profiles = _get_profiles()
+        with span("execute", parts=len(render_bboxes)):
+            for render_bbox, part_run_id in zip(render_bboxes, part_run_ids):
+                profiles[profile_name]["execute"](
+                    render_bbox, part_run_id, {"xyz_url": xyz_url}
+                )
+        head_validate = int(os.environ.get("BVSAR_HEAD_VALIDATE", 0)) == 1
+        local_validate = int(os.environ.get("BVSAR_LOCAL_VALIDATE", 0)) == 1
+        if head_validate or local_validate:
+            logging.info("Validating result")
+            check_requests = xyz_check_builder(
                 bbox,
                 "{0}/{1}/{{z}}/{{x}}/{{y}}.png".format(
                     os.environ.get("HTTP_URL", "http://rpi/tile/file"), profile_name,
@@ -70,19 +102,99 @@ def provision(arg: ProvisionArg) -> ProvisionResult:
                 profiles[profile_name]["zoom_max"],
                 "image/{0}".format(profiles[profile_name]["format"]),
             )
-        )
-    record_run(get_result_path((profile_name,)), bbox)
-    if remove_intermediaries():
-        run_dir = get_run_data_path(run_id, None)
-        result_temp_dir = get_result_path((run_id,))
-        if os.path.exists(run_dir):
-            rmtree(run_dir)
-        if os.path.exists(result_temp_dir):
-            rmtree(result_temp_dir)
+            with span("validate", local=local_validate) as validate_span:
+                validate_span.add(items=len(check_requests))
+                if local_validate:
+                    missing = check_exists_locally(
+                        check_requests, result_dir, profile_name
+                    )
+                else:
+                    missing = check_exists(check_requests)
+            if len(missing) > 0:
+                write_missing_summary(missing, profile_name, run_id)
+        with span("record_run"):
+            record_run(result_dir, bbox)
+        if remove_intermediaries():
+            for part_run_id in part_run_ids:
+                run_dir = get_run_data_path(part_run_id, None)
+                result_temp_dir = get_result_path((part_run_id,))
+                if os.path.exists(run_dir):
+                    rmtree(run_dir)
+                if os.path.exists(result_temp_dir):
+                    rmtree(result_temp_dir)
     logging.info("Finished")
     return ProvisionResult.SUCCESS
 
 
+def estimate(arg: ProvisionArg) -> ProvisionEstimate:
+    """
+    The work provision would do for arg, without doing it.
+    """
+    profile = _get_profiles()[arg.profile_name]
+    result_dir = get_result_path((arg.profile_name,))
+    render_bboxes = (
+        list() if _is_skipped(arg, result_dir) else _get_render_bboxes(arg, result_dir)
+    )
+    if len(render_bboxes) == 0:
+        return ProvisionEstimate(arg=arg, skipped=True, tiles=dict(), sources=list())
+    tiles, sources = defaultdict(int), list()
+    for render_bbox in render_bboxes:
+        for zoom, count in count_tiles(
+            render_bbox, profile["zoom_min"], profile["zoom_max"]
+        ).items():
+            tiles[zoom] += count
+        sources += profile["estimate"](render_bbox, {"xyz_url": arg.xyz_url})
+    return ProvisionEstimate(arg=arg, skipped=False, tiles=dict(tiles), sources=sources)
+
+
+def _is_skipped(arg: ProvisionArg, result_dir: str) -> bool:
+    if not arg.skippable:
+        return False
+    if int(os.environ.get("BVSAR_SKIP_IF_COVERED", 0)) == 1:
+        # also skip bboxes covered by the union of earlier, differently-shaped runs
+        return is_covered(result_dir, arg.bbox)
+    return has_prior_run(result_dir, arg.bbox)
+
+
+def _get_render_bboxes(arg: ProvisionArg, result_dir: str) -> List[BBOX]:
+    """
+    The bbox, or with BVSAR_RENDER_REMAINDER only the parts of it no earlier run covered.
+    Parts are rendered, clipped and stitched over existing tiles like any bbox,
+    so tiles along their edges keep the earlier runs' pixels outside the part.
+    """
+    if arg.stale or int(os.environ.get("BVSAR_RENDER_REMAINDER", 0)) != 1:
+        return [arg.bbox]
+    # slivers thinner than a pixel at the profile's deepest zoom would render nothing visible
+    zoom_max = _get_profiles()[arg.profile_name]["zoom_max"]
+    min_width = 360 / (TILE_SIZE * pow(2, zoom_max))
+    min_height = min_width * math.cos(
+        math.radians((arg.bbox.min_y + arg.bbox.max_y) / 2)
+    )
+    return [
+        part
+        for part in get_uncovered(result_dir, arg.bbox)
+        if part.max_x - part.min_x >= min_width
+        and part.max_y - part.min_y >= min_height
+    ]
+
+
+def get_profile_names() -> List[str]:
+    return list(_get_profiles().keys())
+
+
+def _get_profiles() -> Dict[str, Dict[str, object]]:
+    return {
+        profile.NAME: {
+            "execute": profile.execute,
+            "estimate": profile.estimate,
+            "zoom_min": profile.ZOOM_MIN,
+            "zoom_max": profile.ZOOM_MAX,
+            "format": profile.OUTPUT_FORMAT,
+        }
+        for profile in [xyz, topo, xyzsummer, xyzwinter, xyzhunting, ates]
+    }
+
+
 if __name__ == "__main__":
     # has been directly invoked, likely debugging
     configure_logging()
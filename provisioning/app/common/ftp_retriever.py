@@ -9,7 +9,7 @@ from ftplib import FTP
 from typing import Final
 from sys import stdout
 
-from app.common.util import get_cache_path
+from app.common.util import get_cache_path, get_named_lock
 
 
 MAX_ITERATIONS: Final = 3
@@ -71,13 +71,18 @@ def fetch(file_name: str, domain: str, path: str, destination_path: str = None):
 
     if destination_path is None:
         destination_path = _cache_path(domain, path, file_name)
-    if not os.path.exists(destination_path):
-        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
-        wget.download(
-            download_src, out=destination_path, bar=bar_progress,
-        )
+    with get_named_lock(destination_path):
+        if not os.path.exists(destination_path):
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            wget.download(
+                download_src, out=destination_path, bar=bar_progress,
+            )
     return destination_path
 
+def get_fetch_path(file_name: str, domain: str, path: str) -> str:
+    return _cache_path(domain, path, file_name)
+
+
 def _cache_path(domain: str, path: str, file_name: str) -> str:
     return os.path.join(get_cache_path(
         (re.sub(r"[^a-z0-9\.]", "", f"{domain}{path}", flags=re.IGNORECASE),)
@@ -4,14 +4,21 @@ from osgeo import ogr, osr
 from typing import Final
 
 from app.common.bbox import BBOX
+from app.common.util import get_named_lock
 
 BBOX_LAYER_NAME: Final = "bbox"
 BBOX_GPKG_NAME: Final = "bbox.gpkg"
 
 
 def get_datasource_from_bbox(bbox: BBOX, output_dir: str) -> None:
-    driver = ogr.GetDriverByName("GPKG")
     gpkg_path = os.path.join(output_dir, BBOX_GPKG_NAME)
+    # sources provisioned concurrently for one run share this file
+    with get_named_lock(gpkg_path):
+        return _get_datasource_from_bbox(bbox, gpkg_path)
+
+
+def _get_datasource_from_bbox(bbox: BBOX, gpkg_path: str) -> str:
+    driver = ogr.GetDriverByName("GPKG")
     datasource = driver.Open(gpkg_path)
     if not datasource:
         datasource = driver.CreateDataSource(gpkg_path)
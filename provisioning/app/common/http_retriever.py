@@ -2,19 +2,22 @@ import re
 import os
 import random
 import math
-import requests
 import time
 import logging
 
-from aiohttp import request as aiorequest
-from asyncio import get_event_loop, Lock
+from aiohttp import ClientSession, TCPConnector, request as aiorequest
+from asyncio import Lock
 from pydantic import BaseModel
 from typing import List, Final
 
-from app.common.util import asyncio_with_concurrency
+from app.common.trace import span
+from app.common.util import asyncio_with_concurrency, get_thread_event_loop
 
 
 MAX_REQUEST_ITERATION: Final = 3
+HEAD_CONCURRENCY: Final = int(os.environ.get("BVSAR_HEAD_CONCURRENCY", 32))
+# the rpi API answers missing tiles with a blank tile and this header rather than a 404
+MISSING_TILE_HEADER: Final = "X-404-tile-response"
 
 
 class RetrievalRequest(BaseModel):
@@ -25,17 +28,53 @@ class RetrievalRequest(BaseModel):
 
 class ExistsCheckRequest(BaseModel):
     url: str
+    z: int = None
+    x: int = None
+    y: int = None
 
 
-def check_exists(check_requests: List[ExistsCheckRequest]) -> None:
+def check_exists(
+    check_requests: List[ExistsCheckRequest], max_concurrency: int = HEAD_CONCURRENCY
+) -> List[ExistsCheckRequest]:
+    """
+    Issues HEAD requests over a pooled keep-alive session, returning the requests for resources that do not exist.
+    """
     logging.info(f"Issuing {len(check_requests)} HEAD requests...")
     log_format = "... {0}"
-    for i, request in enumerate(check_requests):
-        if i > 0 and i % 1000 == 0:
-            logging.info(log_format.format(i))
-        if requests.head(request.url).status_code != 200:
+    missing = list()
+    checked = 0
+
+    async def check(session: ClientSession, request: ExistsCheckRequest) -> None:
+        nonlocal checked
+        try:
+            async with session.head(request.url) as response:
+                exists = (
+                    response.status == 200
+                    and MISSING_TILE_HEADER not in response.headers
+                )
+        except Exception as ex:
+            logging.debug(f"Error checking {request.url}: {ex}")
+            exists = False
+        if not exists:
             logging.warn(f"{request.url} does not exist")
+            missing.append(request)
+        checked += 1
+        if checked % 1000 == 0:
+            logging.info(log_format.format(checked))
+
+    async def check_all() -> None:
+        async with ClientSession(
+            connector=TCPConnector(limit=max_concurrency)
+        ) as session:
+            await asyncio_with_concurrency(
+                max_concurrency, [check(session, request) for request in check_requests]
+            )
+
+    with span("http.check_exists", concurrency=max_concurrency) as check_span:
+        get_thread_event_loop().run_until_complete(check_all())
+        check_span.add(items=len(check_requests))
     logging.info(log_format.format(len(check_requests)))
+    return missing
 
 
 def retrieve(
@@ -43,14 +82,16 @@ def retrieve(
 ) -> None:
     if len(retrieval_requests) == 0:
         return
+    event_loop = get_thread_event_loop()
     requests_remaining = retrieval_requests.copy()
     requests_failed = list()
     iteration = 0
     requests_executed = 0
     requests_executed_lock = Lock()
+    bytes_retrieved = 0
 
     async def execute(request: RetrievalRequest) -> None:
-        nonlocal requests_executed
+        nonlocal requests_executed, bytes_retrieved
         url = request.url
         filePath = request.path
         os.makedirs(os.path.dirname(filePath), exist_ok=True)
@@ -78,9 +119,14 @@ def retrieve(
                 else:
                     if is_expected_type:
                         logging.debug(f"Response is of expected type for {url}")
-                        out = open(filePath, "wb")
-                        out.write(await response.read())
+                        # write then rename so concurrent runs sharing a cache never read a partial file
+                        partial_path = f"{filePath}.{os.getpid()}.{id(request)}.part"
+                        content = await response.read()
+                        bytes_retrieved += len(content)
+                        out = open(partial_path, "wb")
+                        out.write(content)
                         out.close()
+                        os.replace(partial_path, filePath)
                     else:
                         raise ValueError(f"Response for {url} is not the expected type")
         except Exception as ex:
@@ -90,31 +136,33 @@ def retrieve(
             async with requests_executed_lock:
                 requests_executed += 1
 
-    while iteration < MAX_REQUEST_ITERATION:
-        requests_executed = 0
-        logging.info(
-            f"Requesting {len(requests_remaining)} resource(s) over HTTP in iteration {iteration + 1} of {MAX_REQUEST_ITERATION}"
-        )
-        if iteration > 0:
-            delay = math.pow(1000, iteration) / 1000
+    with span("http.retrieve", concurrency=max_concurrency) as retrieve_span:
+        while iteration < MAX_REQUEST_ITERATION:
+            requests_executed = 0
             logging.info(
-                f"Iteration {iteration + 1} for failing HTTP requests, sleep for {delay}s before retry..."
+                f"Requesting {len(requests_remaining)} resource(s) over HTTP in iteration {iteration + 1} of {MAX_REQUEST_ITERATION}"
             )
-            time.sleep(delay)
-            logging.info("...resuming")
-        async_requests = [execute(each) for each in requests_remaining]
-        get_event_loop().run_until_complete(
-            asyncio_with_concurrency(max_concurrency, async_requests)
-        )
-        if len(requests_failed) > 0:
-            logging.info(
-                f"{len(requests_failed)} of {len(retrieval_requests)} requests failed in iteration {iteration + 1}"
+            if iteration > 0:
+                delay = math.pow(1000, iteration) / 1000
+                logging.info(
+                    f"Iteration {iteration + 1} for failing HTTP requests, sleep for {delay}s before retry..."
+                )
+                time.sleep(delay)
+                logging.info("...resuming")
+            async_requests = [execute(each) for each in requests_remaining]
+            event_loop.run_until_complete(
+                asyncio_with_concurrency(max_concurrency, async_requests)
             )
-            requests_remaining = requests_failed.copy()
-            requests_failed.clear()
-            iteration += 1
-        else:
-            return
+            if len(requests_failed) > 0:
+                logging.info(
+                    f"{len(requests_failed)} of {len(retrieval_requests)} requests failed in iteration {iteration + 1}"
+                )
+                requests_remaining = requests_failed.copy()
+                requests_failed.clear()
+                iteration += 1
+            else:
+                break
+        retrieve_span.add(items=len(retrieval_requests), size=bytes_retrieved)
 
 
 def is_expected_response_type(response, expected_types: List[str]) -> bool:
@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import os
+import sqlite3
+
+from typing import Dict, Final, Iterable, Iterator, Tuple
+
+from app.common.bbox import BBOX
+
+RESULT_FORMATS: Final = ("files", "mbtiles")
+MBTILES_BATCH_SIZE: Final = 500
+# identical tiles are stored once in images and referenced from map, the tiles view is what readers query
+SCHEMA: Final = (
+    "CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT, PRIMARY KEY (zoom_level, tile_column, tile_row))",
+    "CREATE INDEX IF NOT EXISTS map_tile_id ON map (tile_id)",
+    "CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB)",
+    "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)",
+    "CREATE VIEW IF NOT EXISTS tiles AS SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, map.tile_row AS tile_row, images.tile_data AS tile_data FROM map JOIN images ON images.tile_id = map.tile_id",
+)
+
+
+def get_result_format() -> str:
+    result_format = os.environ.get("BVSAR_RESULT_FORMAT", "files")
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(
+            f"BVSAR_RESULT_FORMAT must be one of {', '.join(RESULT_FORMATS)}, not {result_format}"
+        )
+    return result_format
+
+
+def get_mbtiles_path(result_dir: str) -> str:
+    # the rpi API opens <profile>/<profile>.mbtiles
+    profile_name = os.path.basename(os.path.normpath(result_dir))
+    return os.path.join(result_dir, f"{profile_name}.mbtiles")
+
+
+class MBTiles:
+    """
+    Read-write access to a result mbtiles.
+    Rows are stored as XYZ y, not flipped to TMS, as that is how the rpi API and local validation query them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # readers such as the rpi API are not blocked while a provisioning run writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            # DDL does not begin a transaction implicitly, a migration must not be left half done
+            self.connection.execute("BEGIN")
+            unmigrated = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tiles'"
+            ).fetchone()
+            if unmigrated:
+                # packaged by mb-util from a z/x/y tree, a tiles view cannot be created over the table
+                self.connection.execute("ALTER TABLE tiles RENAME TO tiles_unmigrated")
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            if unmigrated:
+                self._migrate_tiles_table()
+
+    def __enter__(self) -> "MBTiles":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get_tile(self, z: int, x: int, y: int) -> bytes:
+        row = self.connection.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, y),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_tiles(self, tiles: Iterable[Tuple[int, int, int, bytes]]) -> int:
+        """Inserts or replaces tiles in transactions of MBTILES_BATCH_SIZE, returning the number written"""
+        written = 0
+        batch = list()
+        for tile in tiles:
+            batch.append(tile)
+            if len(batch) == MBTILES_BATCH_SIZE:
+                written += self._put_batch(batch)
+                batch = list()
+        if batch:
+            written += self._put_batch(batch)
+        return written
+
+    def get_metadata(self) -> Dict[str, str]:
+        return dict(
+            self.connection.execute("SELECT name, value FROM metadata").fetchall()
+        )
+
+    def update_metadata(
+        self, name: str, bbox: BBOX, zoom_min: int, zoom_max: int
+    ) -> None:
+        """Extends bounds and zooms to include bbox so readers need not scan the tiles"""
+        metadata = self.get_metadata()
+        bounds = (bbox.min_x, bbox.min_y, bbox.max_x, bbox.max_y)
+        if "bounds" in metadata:
+            existing = [float(value) for value in metadata["bounds"].split(",")]
+            bounds = (
+                min(existing[0], bounds[0]),
+                min(existing[1], bounds[1]),
+                max(existing[2], bounds[2]),
+                max(existing[3], bounds[3]),
+            )
+        zoom_min = min(int(metadata.get("minzoom", zoom_min)), zoom_min)
+        zoom_max = max(int(metadata.get("maxzoom", zoom_max)), zoom_max)
+        values = (
+            ("name", name),
+            ("format", "png"),
+            ("scheme", "xyz"),
+            ("bounds", ",".join([str(value) for value in bounds])),
+            (
+                "center",
+                f"{(bounds[0] + bounds[2]) / 2},{(bounds[1] + bounds[3]) / 2},{zoom_min}",
+            ),
+            ("minzoom", str(zoom_min)),
+            ("maxzoom", str(zoom_max)),
+        )
+        with self.connection:
+            # metadata tables created by mb-util have no key on name to replace by
+            self.connection.execute(
+                f"DELETE FROM metadata WHERE name IN ({', '.join(['?'] * len(values))})",
+                [key for key, _ in values],
+            )
+            self.connection.executemany(
+                "INSERT INTO metadata (name, value) VALUES (?, ?)", values
+            )
+
+    def _migrate_tiles_table(self) -> None:
+        logging.info(f"Migrating tiles of {self.path} to deduplicated tables")
+        migrated = 0
+        rows = self.connection.execute(
+            "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles_unmigrated"
+        )
+        # rows are kept as numbered, the rpi API already reads them that way
+        while batch := rows.fetchmany(MBTILES_BATCH_SIZE):
+            self._write_batch(batch)
+            migrated += len(batch)
+        self.connection.execute("DROP TABLE tiles_unmigrated")
+        logging.info(f"Migrated {migrated} tile(s)")
+
+    def _put_batch(self, batch: Iterable[Tuple[int, int, int, bytes]]) -> int:
+        with self.connection:
+            self._write_batch(batch)
+        return len(batch)
+
+    def _write_batch(self, batch: Iterable[Tuple[int, int, int, bytes]]) -> None:
+        replaced = set()
+        for z, x, y, tile_data in batch:
+            tile_id = hashlib.sha1(tile_data).hexdigest()
+            previous = self.connection.execute(
+                "SELECT tile_id FROM map WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, y),
+            ).fetchone()
+            if previous and previous[0] != tile_id:
+                replaced.add(previous[0])
+            self.connection.execute(
+                "INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)",
+                (tile_id, tile_data),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+                (z, x, y, tile_id),
+            )
+        # images no tile refers to any more
+        self.connection.executemany(
+            "DELETE FROM images WHERE tile_id = ? AND NOT EXISTS (SELECT 1 FROM map WHERE map.tile_id = ?)",
+            [(tile_id, tile_id) for tile_id in replaced],
+        )
+
+
+def read_tile_dir(tile_dir: str) -> Iterator[Tuple[int, int, int, bytes]]:
+    """Yields z, x, y and bytes of each z/x/y.png in tile_dir"""
+    for dirpath, _, filenames in os.walk(tile_dir):
+        for filename in filenames:
+            if not filename.endswith(".png"):
+                continue
+            z, x = os.path.relpath(dirpath, tile_dir).split(os.sep)
+            with open(os.path.join(dirpath, filename), "rb") as f:
+                yield int(z), int(x), int(filename[: -len(".png")]), f.read()
@@ -0,0 +1,64 @@
+import logging
+import os
+
+import numpy as np
+from PIL import Image, features
+from typing import Final
+
+QUANTIZE_METHODS: Final = ("octree", "exact", "libimagequant", "none")
+PALETTE_SIZE: Final = 256
+
+_libimagequant_available: bool = None
+
+
+def get_quantize_method() -> str:
+    method = os.environ.get("BVSAR_QUANTIZE_METHOD", "octree")
+    if method not in QUANTIZE_METHODS:
+        raise ValueError(
+            f"BVSAR_QUANTIZE_METHOD must be one of {', '.join(QUANTIZE_METHODS)}, not {method}"
+        )
+    return method
+
+
+def quantize_tile(tile: np.ndarray, method: str = None) -> Image.Image:
+    """
+    Reduces an RGBA tile array to an image ready to save, using BVSAR_QUANTIZE_METHOD when method is not given.
+    octree: Pillow's fast octree, the historical behaviour
+    exact: a lossless palette when the tile has at most 256 colours, otherwise octree
+    libimagequant: better palettes than octree at some cost, octree when Pillow was built without it
+    none: no quantization, the tile is saved as RGBA
+    """
+    method = method or get_quantize_method()
+    if method == "none":
+        return Image.fromarray(tile, "RGBA")
+    if method == "exact":
+        image = _exact_palette(tile)
+        if image is not None:
+            return image
+    if method == "libimagequant" and _has_libimagequant():
+        return Image.fromarray(tile, "RGBA").quantize(method=Image.LIBIMAGEQUANT)
+    return Image.fromarray(tile, "RGBA").quantize(method=Image.FASTOCTREE)
+
+
+def _exact_palette(tile: np.ndarray) -> Image.Image:
+    # fully transparent pixels look the same whatever their colour, so they share one palette entry
+    rgba = np.where(tile[..., 3:] == 0, 0, tile).astype(np.uint8)
+    colours, indexes = np.unique(
+        np.ascontiguousarray(rgba).view(np.uint32).ravel(), return_inverse=True
+    )
+    if len(colours) > PALETTE_SIZE:
+        return None
+    image = Image.fromarray(indexes.reshape(tile.shape[:2]).astype(np.uint8), "P")
+    image.putpalette(colours.view(np.uint8).tobytes(), "RGBA")
+    return image
+
+
+def _has_libimagequant() -> bool:
+    global _libimagequant_available
+    if _libimagequant_available is None:
+        _libimagequant_available = features.check("libimagequant")
+        if not _libimagequant_available:
+            logging.warning(
+                "Pillow was built without libimagequant, quantizing with octree instead"
+            )
+    return _libimagequant_available
@@ -0,0 +1,80 @@
+import errno
+import hashlib
+import logging
+import os
+import threading
+
+from typing import Final, Iterable
+
+from app.common.trace import span
+from app.common.util import get_result_path
+
+BLOB_DIR_NAME: Final = ".blobs"
+
+
+def deduplicate_enabled() -> bool:
+    return int(os.environ.get("BVSAR_DEDUPLICATE_RESULTS", 0)) == 1
+
+
+def get_blob_path(digest: str) -> str:
+    # shared by every profile so identical tiles across zooms and profiles are stored once
+    return get_result_path((BLOB_DIR_NAME, digest[:2], f"{digest}.png"))
+
+
+def deduplicate_tiles(result_dir: str, tile_paths: Iterable[str]) -> int:
+    """
+    Replaces each tile, z/x/y.png relative to result_dir, with a hard link to the blob holding its bytes.
+    Tiles that do not exist are ignored. Returns the number of tiles that now share a blob with another tile.
+    """
+    shared = 0
+    with span("deduplicate") as deduplicate_span:
+        for tile_path in tile_paths:
+            path = os.path.join(result_dir, tile_path)
+            try:
+                with open(path, "rb") as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()
+            except FileNotFoundError:
+                continue
+            shared += 1 if _link_to_blob(path, get_blob_path(digest)) else 0
+            deduplicate_span.add(items=1)
+        deduplicate_span.attributes["shared"] = shared
+    return shared
+
+
+def prune_blobs() -> int:
+    """Removes blobs no tile links to any more, returning the number removed"""
+    removed = 0
+    for dirpath, _, filenames in os.walk(get_result_path((BLOB_DIR_NAME,))):
+        for filename in filenames:
+            blob_path = os.path.join(dirpath, filename)
+            if os.stat(blob_path).st_nlink == 1:
+                os.remove(blob_path)
+                removed += 1
+    logging.info(f"Removed {removed} unreferenced tile blob(s)")
+    return removed
+
+
+def _link_to_blob(path: str, blob_path: str) -> bool:
+    if not os.path.exists(blob_path):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(path, blob_path)
+            return False
+        except FileExistsError:
+            # another profile stored the same bytes first
+            pass
+    blob_stat, path_stat = os.stat(blob_path), os.stat(path)
+    if blob_stat.st_ino == path_stat.st_ino:
+        return True
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        os.link(blob_path, tmp_path)
+    except OSError as e:
+        if e.errno != errno.EMLINK:
+            raise
+        # the blob is at the filesystem's link limit, this tile's copy becomes the blob for later tiles
+        os.link(path, tmp_path)
+        os.replace(tmp_path, blob_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
@@ -0,0 +1,56 @@
+import logging
+import os
+import sqlite3
+
+from typing import List
+
+from app.common.http_retriever import ExistsCheckRequest
+from app.common.util import get_validation_path
+
+
+def check_exists_locally(
+    check_requests: List[ExistsCheckRequest], result_dir: str, profile_name: str
+) -> List[ExistsCheckRequest]:
+    """
+    Checks tiles against the profile's result without HTTP, returning the requests for tiles that do not exist.
+    The profile's mbtiles is read the way the rpi API reads it, falling back to the z/x/y tile files.
+    """
+    logging.info(f"Checking {len(check_requests)} tiles in {result_dir}...")
+    mbtiles_path = os.path.join(result_dir, f"{profile_name}.mbtiles")
+    connection = sqlite3.connect(mbtiles_path) if os.path.exists(mbtiles_path) else None
+    missing = list()
+    try:
+        for request in check_requests:
+            if connection:
+                exists = (
+                    connection.execute(
+                        "select 1 from tiles where zoom_level = ? and tile_column = ? and tile_row = ?",
+                        (request.z, request.x, request.y),
+                    ).fetchone()
+                    is not None
+                )
+            else:
+                exists = os.path.exists(
+                    os.path.join(
+                        result_dir, str(request.z), str(request.x), f"{request.y}.png"
+                    )
+                )
+            if not exists:
+                logging.warn(f"{request.z}/{request.x}/{request.y} does not exist")
+                missing.append(request)
+    finally:
+        if connection:
+            connection.close()
+    return missing
+
+
+def write_missing_summary(
+    missing: List[ExistsCheckRequest], profile_name: str, run_id: str
+) -> str:
+    summary_path = get_validation_path((f"{profile_name}-{run_id}.txt",))
+    os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+    with open(summary_path, "w") as f:
+        for request in missing:
+            f.write(f"{request.z}/{request.x}/{request.y} {request.url}\n")
+    logging.warn(f"{len(missing)} missing tile(s) written to {summary_path}")
+    return summary_path
@@ -0,0 +1,197 @@
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Dict, Final, Iterator, Set
+
+from app.common.util import get_base_path
+
+TRACE_DIR_NAME: Final = "trace"
+RSS_SAMPLE_INTERVAL: Final = 0.1
+_PAGE_SIZE_KB: Final = os.sysconf("SC_PAGE_SIZE") // 1024
+
+_run_id: ContextVar[str] = ContextVar("trace_run_id", default=None)
+_span_id: ContextVar[str] = ContextVar("trace_span_id", default=None)
+_write_lock = threading.Lock()
+# spans being timed, the sampler raises each one's peak memory while it is open
+_open_spans: Set["Span"] = set()
+_open_spans_lock = threading.Lock()
+_sampler: threading.Thread = None
+
+
+def trace_enabled() -> bool:
+    return int(os.environ.get("BVSAR_TRACE", 0)) == 1
+
+
+def get_trace_path(path_parts: tuple = None) -> str:
+    return os.path.join(
+        *(get_base_path(), TRACE_DIR_NAME, *(path_parts if path_parts else list()))
+    )
+
+
+def get_trace_file_path(run_id: str) -> str:
+    return get_trace_path((f"{run_id}.jsonl",))
+
+
+class Span:
+    """
+    Counters for one traced stage, callers add the items processed and bytes moved as they go.
+    """
+
+    def __init__(self, name: str, attributes: Dict[str, object]):
+        self.name = name
+        self.attributes = attributes
+        self.items = 0
+        self.bytes = 0
+        self.start_rss_kb = None
+        self.peak_rss_kb = None
+
+    def add(self, items: int = 0, size: int = 0) -> None:
+        self.items += items
+        self.bytes += size
+
+
+@contextmanager
+def trace_run(run_id: str) -> Iterator[None]:
+    """Spans opened within this context, including in propagated threads, are written to run_id's trace file"""
+    token = _run_id.set(run_id)
+    try:
+        yield
+    finally:
+        _run_id.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    current = Span(name, attributes)
+    run_id = _run_id.get()
+    if run_id is None or not trace_enabled():
+        yield current
+        return
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _span_id.get()
+    token = _span_id.set(span_id)
+    _open(current)
+    start = time.time()
+    error = None
+    try:
+        yield current
+    except BaseException as ex:
+        error = repr(ex)
+        raise
+    finally:
+        _span_id.reset(token)
+        _close(current)
+        _write(
+            run_id,
+            {
+                "run_id": run_id,
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "name": name,
+                "start": start,
+                "duration": time.time() - start,
+                "items": current.items,
+                "bytes": current.bytes,
+                "start_rss_kb": current.start_rss_kb,
+                "peak_rss_kb": current.peak_rss_kb,
+                "thread": threading.current_thread().name,
+                "error": error,
+                "attributes": current.attributes,
+            },
+        )
+
+
+def propagate(func: Callable) -> Callable:
+    """
+    Wraps func so it runs with the caller's trace context when submitted to a thread pool.
+    Each call gets its own copy as one context cannot be entered by several threads at once.
+    """
+    context = copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+def get_dir_size(directory: str) -> int:
+    total = 0
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total
+
+
+def _get_rss_kb() -> int:
+    """
+    Resident memory of this process and every process beneath it, such as pool workers and mb-util, None without /proc.
+    Pages shared between processes are counted once for each of them.
+    """
+    if not os.path.exists("/proc/self/statm"):
+        return None
+    total, pids = 0, [os.getpid()]
+    while len(pids) > 0:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                total += int(f.read().split()[1]) * _PAGE_SIZE_KB
+            for children_path in glob.glob(f"/proc/{pid}/task/*/children"):
+                with open(children_path, "r") as f:
+                    pids += [int(child_pid) for child_pid in f.read().split()]
+        except (OSError, ValueError):
+            # exited while being read
+            continue
+    return total
+
+
+def _raise_peak(current: Span, rss_kb: int) -> None:
+    if rss_kb is not None:
+        current.peak_rss_kb = max(current.peak_rss_kb or 0, rss_kb)
+
+
+def _open(current: Span) -> None:
+    global _sampler
+    current.start_rss_kb = _get_rss_kb()
+    _raise_peak(current, current.start_rss_kb)
+    with _open_spans_lock:
+        _open_spans.add(current)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample, name="trace-rss", daemon=True)
+            _sampler.start()
+
+
+def _close(current: Span) -> None:
+    with _open_spans_lock:
+        _open_spans.discard(current)
+    _raise_peak(current, _get_rss_kb())
+
+
+def _sample() -> None:
+    # a span's start and end alone would miss memory that is freed before it closes
+    while True:
+        time.sleep(RSS_SAMPLE_INTERVAL)
+        with _open_spans_lock:
+            if len(_open_spans) == 0:
+                continue
+        rss_kb = _get_rss_kb()
+        with _open_spans_lock:
+            for current in _open_spans:
+                _raise_peak(current, rss_kb)
+
+
+def _write(run_id: str, record: Dict[str, object]) -> None:
+    trace_file_path = get_trace_file_path(run_id)
+    line = json.dumps(record, default=str)
+    with _write_lock:
+        os.makedirs(os.path.dirname(trace_file_path), exist_ok=True)
+        with open(trace_file_path, "a") as f:
+            f.write(line + "\n")
@@ -1,18 +1,37 @@
 import asyncio
+import atexit
 import errno
+import json
 import logging
+import math
 import multiprocessing
 import os
 import re
 import shutil
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
 from osgeo.gdal import ConfigurePythonLogging, UseExceptions
-from typing import Final, Tuple
+from multiprocessing.pool import Pool
+from threading import Lock, get_ident
+from typing import Callable, Dict, Final, List, Sequence, Tuple
 
 TILEMILL_DATA_LOCATION: Final = "/tiledata"
 OVERWRITE_EXISTING: Final = int(os.environ.get("OVERWRITE_EXISTING", 0)) == 0
 
+MERGE_CONCURRENCY: Final = 8
+MERGE_BATCH_SIZE: Final = 256
+MERGE_JOURNAL_NAME: Final = ".merge-journal.json"
+GENERATIONS_DIR_NAME: Final = ".generations"
+# a link is not possible across filesystems, past the link limit or on a filesystem without hard links
+LINK_FALLBACK_ERRNOS: Final = (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP)
+
+_named_locks: Dict[str, Lock] = dict()
+_named_locks_lock = Lock()
+_process_pool: Pool = None
+_process_pool_size: int = None
+_process_pool_lock = Lock()
+
 
 def get_base_path() -> str:
     return os.environ.get("DATA_LOCATION", TILEMILL_DATA_LOCATION)
@@ -60,6 +79,12 @@ def get_result_path(path_parts: Tuple[str] = None) -> str:
     )
 
 
+def get_validation_path(path_parts: Tuple[str] = None) -> str:
+    return os.path.join(
+        *(get_base_path(), "validation", *(path_parts if path_parts else list()))
+    )
+
+
 def delete_directory_contents(directory: str) -> str:
     for filename in os.listdir(directory):
         file_path = os.path.join(directory, filename)
@@ -82,17 +107,297 @@ def silent_delete(path: str) -> None:
             raise  # re-raise exception if a different error occurred
 
 
-# https://unix.stackexchange.com/a/510724/328901
+def link_or_copy(source_path: str, dest_path: str) -> bool:
+    """
+    Stages source_path at dest_path as a hard link, copying only when a link is not possible.
+    dest_path is replaced rather than written in place so an existing file and anything linked to it are untouched.
+    Tiles staged this way must only ever be replaced, never modified in place. Returns True when linked.
+    """
+    tmp_path = f"{dest_path}.{os.getpid()}-{get_ident()}.tmp"
+    try:
+        os.link(source_path, tmp_path)
+        linked = True
+    except OSError as e:
+        if e.errno not in LINK_FALLBACK_ERRNOS:
+            raise
+        shutil.copyfile(source_path, tmp_path)
+        linked = False
+    os.replace(tmp_path, dest_path)
+    return linked
+
+
 def merge_dirs(source_root: str, dest_root: str) -> None:
-    for path, dirs, files in os.walk(source_root, topdown=False):
-        dest_dir = os.path.join(dest_root, os.path.relpath(path, source_root))
-        if not os.path.exists(dest_dir):
-            os.makedirs(dest_dir)
-        for filename in files:
-            shutil.move(os.path.join(path, filename), os.path.join(dest_dir, filename))
-        for dirname in dirs:
-            os.rmdir(os.path.join(path, dirname))
+    """
+    Publishes every file under source_root at the same relative path under dest_root, replacing existing files, then removes source_root.
+    dest_root is a symlink to a generation directory under GENERATIONS_DIR_NAME beside it. The merge builds the next generation
+    and swaps the symlink in one rename, so readers following dest_root see all of the merge or none of it.
+    A generation links the z/x columns it shares with the one before, so a merge relinks only the tiles of the columns it touches.
+    A dest_root that is still a plain directory is moved into its generations first, the one moment readers can miss it.
+    """
+    dest_root = os.path.normpath(dest_root)
+    _complete_merge(dest_root)
+    _publish(source_root, dest_root)
+
+
+def complete_interrupted_merges(root: str) -> None:
+    """
+    Completes merges into any directory of root that were interrupted by a crash, publishing them again from their source.
+    Readers keep seeing the generation from before the merge until this runs, normally when the runner next starts.
+    """
+    generations_root = os.path.join(root, GENERATIONS_DIR_NAME)
+    if not os.path.isdir(generations_root):
+        return
+    for entry_name in os.listdir(generations_root):
+        if os.path.exists(
+            os.path.join(generations_root, entry_name, MERGE_JOURNAL_NAME)
+        ):
+            dest_root = os.path.join(root, entry_name)
+            with get_named_lock(dest_root):
+                _complete_merge(dest_root)
+
+
+def _get_generations_root(dest_root: str) -> str:
+    return os.path.join(
+        os.path.dirname(dest_root), GENERATIONS_DIR_NAME, os.path.basename(dest_root)
+    )
+
+
+def _complete_merge(dest_root: str) -> None:
+    journal_path = os.path.join(_get_generations_root(dest_root), MERGE_JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, "r") as f:
+        journal = json.load(f)
+    source_root = journal["source"]
+    if os.path.isdir(source_root):
+        if _get_current_generation(dest_root) != journal["generation"]:
+            logging.warning(
+                f"Completing interrupted merge of {source_root} into {dest_root}"
+            )
+            _publish(source_root, dest_root)
+            return
+        # published, only removing the source was interrupted
+        shutil.rmtree(source_root)
+    os.remove(journal_path)
+
+
+def _publish(source_root: str, dest_root: str) -> None:
+    generations_root = _get_generations_root(dest_root)
+    os.makedirs(generations_root, exist_ok=True)
+    current = _get_current_generation(dest_root)
+    generation = _get_next_generation(generations_root)
+    journal_path = os.path.join(generations_root, MERGE_JOURNAL_NAME)
+    tmp_path = f"{journal_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"source": os.path.abspath(source_root), "generation": generation}, f)
+    os.replace(tmp_path, journal_path)
+    # source tiles are linked rather than moved so an interrupted merge can be published again
+    _build_generation(
+        source_root,
+        os.path.join(generations_root, current) if current else None,
+        os.path.join(generations_root, generation),
+    )
+    _point_to_generation(dest_root, generation)
     shutil.rmtree(source_root)
+    os.remove(journal_path)
+    # readers that resolved dest_root just before the swap may still be reading the previous generation
+    _remove_unused_generations(generations_root, [current, generation])
+
+
+def _get_current_generation(dest_root: str) -> str:
+    if os.path.islink(dest_root):
+        return os.path.basename(os.readlink(dest_root))
+    if not os.path.isdir(dest_root):
+        return None
+    generation = _get_next_generation(_get_generations_root(dest_root))
+    logging.info(f"Moving {dest_root} into generation {generation}")
+    os.rename(dest_root, os.path.join(_get_generations_root(dest_root), generation))
+    _point_to_generation(dest_root, generation)
+    return generation
+
+
+def _get_next_generation(generations_root: str) -> str:
+    return str(
+        max(
+            [int(name) for name in os.listdir(generations_root) if name.isdigit()],
+            default=0,
+        )
+        + 1
+    )
+
+
+def _point_to_generation(dest_root: str, generation: str) -> None:
+    generations_root = _get_generations_root(dest_root)
+    # relative so the link resolves wherever the directories are mounted
+    target = os.path.relpath(
+        os.path.join(generations_root, generation), os.path.dirname(dest_root)
+    )
+    tmp_path = os.path.join(generations_root, f"{generation}.link.tmp")
+    silent_delete(tmp_path)
+    os.symlink(target, tmp_path)
+    os.replace(tmp_path, dest_root)
+
+
+def _is_zoom_dir(path: str) -> bool:
+    return (
+        os.path.basename(path).isdigit()
+        and os.path.isdir(path)
+        and not os.path.islink(path)
+    )
+
+
+def _build_generation(source_root: str, current_dir: str, generation_dir: str) -> None:
+    # left by a merge interrupted while building it
+    shutil.rmtree(generation_dir, ignore_errors=True)
+    source_paths = [
+        os.path.relpath(os.path.join(path, filename), source_root)
+        for path, _, filenames in os.walk(source_root)
+        for filename in filenames
+    ]
+    touched_columns = {
+        tuple(parts[:2])
+        for parts in [source_path.split(os.sep) for source_path in source_paths]
+        if len(parts) > 2
+    }
+    dirs, links, symlinks, copied_dirs = {generation_dir}, dict(), list(), list()
+    for name in os.listdir(current_dir) if current_dir else list():
+        path = os.path.join(current_dir, name)
+        if name == MERGE_JOURNAL_NAME:
+            continue
+        if not _is_zoom_dir(path):
+            if os.path.isdir(path) and not os.path.islink(path):
+                copied_dirs.append((path, os.path.join(generation_dir, name)))
+            else:
+                links[os.path.join(generation_dir, name)] = path
+            continue
+        dirs.add(os.path.join(generation_dir, name))
+        for column in os.listdir(path):
+            column_path = os.path.join(path, column)
+            dest_path = os.path.join(generation_dir, name, column)
+            if not os.path.isdir(column_path):
+                links[dest_path] = column_path
+            elif (name, column) in touched_columns:
+                # a new column holding the existing tiles, those the merge replaces are overridden below
+                dirs.add(dest_path)
+                for tile_name in os.listdir(column_path):
+                    links[os.path.join(dest_path, tile_name)] = os.path.join(
+                        column_path, tile_name
+                    )
+            elif os.path.islink(column_path):
+                # generations are siblings so a column link resolves the same from each
+                symlinks.append((os.readlink(column_path), dest_path))
+            else:
+                symlinks.append(
+                    (
+                        os.path.join(
+                            os.pardir,
+                            os.pardir,
+                            os.path.basename(current_dir),
+                            name,
+                            column,
+                        ),
+                        dest_path,
+                    )
+                )
+    for source_path in source_paths:
+        dest_path = os.path.join(generation_dir, source_path)
+        dirs.add(os.path.dirname(dest_path))
+        links[dest_path] = os.path.join(source_root, source_path)
+    # parents sort before their children
+    for dest_dir in sorted(dirs):
+        os.makedirs(dest_dir, exist_ok=True)
+    for path, dest_path in copied_dirs:
+        shutil.copytree(path, dest_path, symlinks=True, copy_function=_link_file)
+    # links are system calls that release the GIL so threads overlap their filesystem waits
+    links = [(path, dest_path) for dest_path, path in links.items()]
+    with ThreadPoolExecutor(
+        max_workers=MERGE_CONCURRENCY, thread_name_prefix="merge"
+    ) as executor:
+        list(
+            executor.map(
+                _link_files,
+                [
+                    links[i : i + MERGE_BATCH_SIZE]
+                    for i in range(0, len(links), MERGE_BATCH_SIZE)
+                ],
+            )
+        )
+        list(
+            executor.map(
+                _symlink_files,
+                [
+                    symlinks[i : i + MERGE_BATCH_SIZE]
+                    for i in range(0, len(symlinks), MERGE_BATCH_SIZE)
+                ],
+            )
+        )
+
+
+def _link_file(source_path: str, dest_path: str) -> None:
+    try:
+        os.link(source_path, dest_path)
+    except OSError as e:
+        if e.errno not in LINK_FALLBACK_ERRNOS:
+            raise
+        shutil.copyfile(source_path, dest_path)
+
+
+def _link_files(links: List[Tuple[str, str]]) -> None:
+    for source_path, dest_path in links:
+        _link_file(source_path, dest_path)
+
+
+def _symlink_files(symlinks: List[Tuple[str, str]]) -> None:
+    for target, dest_path in symlinks:
+        os.symlink(target, dest_path)
+
+
+def _remove_unused_generations(generations_root: str, live: List[str]) -> None:
+    """Removes generations other than live, including any left by an interrupted merge, keeping the columns live ones link to"""
+    live = [generation for generation in live if generation is not None]
+    used_columns = set()
+    for generation in live:
+        generation_dir = os.path.join(generations_root, generation)
+        for name in os.listdir(generation_dir):
+            zoom_dir = os.path.join(generation_dir, name)
+            if _is_zoom_dir(zoom_dir):
+                for column in os.listdir(zoom_dir):
+                    column_path = os.path.join(zoom_dir, column)
+                    if os.path.islink(column_path):
+                        column_path = os.path.join(zoom_dir, os.readlink(column_path))
+                    used_columns.add(os.path.normpath(column_path))
+    for generation in os.listdir(generations_root):
+        generation_dir = os.path.join(generations_root, generation)
+        if generation in live or generation == MERGE_JOURNAL_NAME:
+            continue
+        if not generation.isdigit() or os.path.islink(generation_dir):
+            _remove_path(generation_dir)
+            continue
+        for name in os.listdir(generation_dir):
+            path = os.path.join(generation_dir, name)
+            if not _is_zoom_dir(path):
+                _remove_path(path)
+                continue
+            for column in os.listdir(path):
+                if os.path.join(path, column) not in used_columns:
+                    _remove_path(os.path.join(path, column))
+            _remove_empty_dir(path)
+        _remove_empty_dir(generation_dir)
+
+
+def _remove_path(path: str) -> None:
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        silent_delete(path)
+
+
+def _remove_empty_dir(path: str) -> None:
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+            raise
 
 
 def configure_logging():
@@ -151,9 +456,33 @@ async def asyncio_with_concurrency(n: int, tasks) -> None:
     await asyncio.gather(*[asyncio.ensure_future(sem_task(task)) for task in tasks])
 
 
+def get_thread_event_loop() -> asyncio.AbstractEventLoop:
+    # worker threads do not have an event loop by default, only the main thread does
+    try:
+        return asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop
+
+
+def get_named_lock(name: str) -> Lock:
+    # locks are per-process, they coordinate threads sharing a resource identified by name (e.g. a result directory)
+    with _named_locks_lock:
+        if name not in _named_locks:
+            _named_locks[name] = Lock()
+        return _named_locks[name]
+
+
+def get_cell_concurrency() -> int:
+    return max(1, int(os.environ.get("BVSAR_CELL_CONCURRENCY", 1)))
+
+
 def get_process_pool_count() -> int:
     if int(os.environ.get("PERMIT_MULTIPROCESSING", 1)) == 1:
-        pool_count = max(1, multiprocessing.cpu_count() - 1)
+        pool_count = int(
+            os.environ.get("BVSAR_POOL_SIZE", max(1, multiprocessing.cpu_count() - 1))
+        )
         logging.info(f"Multiprocessing: up to {pool_count} process(es) may be used")
         return pool_count
     else:
@@ -161,6 +490,49 @@ def get_process_pool_count() -> int:
         return 1
 
 
+def get_process_pool() -> Pool:
+    """
+    Pool shared by all CPU-bound tile work in this process, created on first use and kept until exit.
+    None when only one process may be used, work then runs in the calling process.
+    Create it before starting other threads so workers are not forked while those threads hold locks.
+    """
+    global _process_pool, _process_pool_size
+    with _process_pool_lock:
+        if _process_pool_size is None:
+            _process_pool_size = get_process_pool_count()
+            if _process_pool_size > 1:
+                _process_pool = multiprocessing.Pool(processes=_process_pool_size)
+                atexit.register(close_process_pool)
+        return _process_pool
+
+
+def process_map(
+    func: Callable, tasks: Sequence[object], chunksize: int = None
+) -> List[object]:
+    """
+    Maps a module-level function over tasks using the shared pool. Tasks should be small as each is pickled.
+    By default each worker receives a few chunks so per-task IPC stays low while work remains balanced.
+    """
+    if len(tasks) == 0:
+        return list()
+    pool = get_process_pool()
+    if pool is None:
+        return [func(task) for task in tasks]
+    if chunksize is None:
+        chunksize = max(1, math.ceil(len(tasks) / (_process_pool_size * 4)))
+    return pool.map(func, tasks, chunksize)
+
+
+def close_process_pool() -> None:
+    """Waits for the shared pool's work to finish and its workers to exit, later work runs in this process"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.close()
+            _process_pool.join()
+            _process_pool = None
+
+
 def gdal_window_intersection(
     window1: Tuple[float], window2: Tuple[float]
 ) -> Tuple[float]:
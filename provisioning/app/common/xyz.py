@@ -1,14 +1,21 @@
+import hashlib
+import io
 import logging
 import math
-import multiprocessing
 import os
 import re
+import sqlite3
+import threading
 
+import numpy as np
+from collections import OrderedDict
 from PIL import Image
-from typing import Final, List, Tuple
+from typing import Callable, Dict, Final, List, Tuple, Union
 
 from app.common.bbox import BBOX
-from app.common.util import get_process_pool_count
+from app.common.quantize import quantize_tile
+from app.common.trace import span
+from app.common.util import link_or_copy, process_map
 
 
 EXTENT_LIMIT: Final = 20037508.3427892
@@ -21,64 +28,77 @@ PIXELS_AT_ZOOM: Final = [
 ]
 METRES_PER_PIXEL: Final = [(EXTENT_LIMIT * 2) / pixels for pixels in PIXELS_AT_ZOOM]
 METRES_PER_TILE: Final = [per_pixel * TILE_SIZE for per_pixel in METRES_PER_PIXEL]
+MERGE_BATCH_SIZE: Final = 16
+# recently written tiles each worker process remembers for deduplication
+DEDUPLICATE_CACHE_SIZE: Final = 1024
 
+_written_tiles: "OrderedDict[bytes, Tuple[str, int]]" = OrderedDict()
 
-def get_edge_tiles(tile_dir: str) -> List[str]:
+
+def identify_tiles(
+    bbox: BBOX, zoom_min: int, zoom_max: int
+) -> Dict[int, Dict[int, List[int]]]:
+    tiles = dict()
+    for zoom in range(zoom_min, zoom_max + 1):
+        tiles[zoom] = dict()
+        ll_tile_x, ll_tile_y = deg_to_num(bbox.min_y, bbox.min_x, zoom)
+        ur_tile_x, ur_tile_y = deg_to_num(bbox.max_y, bbox.max_x, zoom)
+        for x in range(ll_tile_x, ur_tile_x + 1):
+            tiles[zoom][x] = list(range(ll_tile_y, ur_tile_y - 1, -1))
+    return tiles
+
+
+# https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+def deg_to_num(lat_deg: float, lon_deg: float, zoom: int) -> Tuple[int, int]:
+    lat_rad = math.radians(lat_deg)
+    n = pow(2.0, zoom)
+    xtile = int((lon_deg + 180.0) / 360.0 * n)
+    ytile = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return (xtile, ytile)
+
+
+def get_render_zoom_min(zoom_min: int, zoom_max: int) -> int:
+    """
+    The lowest zoom a profile renders or fetches, with BVSAR_PYRAMID_ZOOM set the zooms below it are built by build_pyramid.
+    """
+    pyramid_zoom = int(os.environ.get("BVSAR_PYRAMID_ZOOM", 0))
+    return min(max(zoom_min, pyramid_zoom), zoom_max)
+
+
+def get_edge_tiles(
+    bbox: BBOX, zoom_min: int, zoom_max: int, tile_dir: str = None
+) -> List[str]:
+    """
+    z/x/y.png paths of the tiles on the boundary of bbox at each zoom, the only tiles that can extend beyond it.
+    When tile_dir is given only tiles present in it are returned.
+    """
+    with span("get_edge_tiles") as edge_span:
+        edge_tiles = [
+            os.path.join(str(z), str(x), f"{y}.png")
+            for z, x, y in _get_edge_tiles(bbox, zoom_min, zoom_max)
+        ]
+        if tile_dir is not None:
+            edge_tiles = [
+                edge_tile
+                for edge_tile in edge_tiles
+                if os.path.exists(os.path.join(tile_dir, edge_tile))
+            ]
+        edge_span.add(items=len(edge_tiles))
+    return edge_tiles
+
+
+def _get_edge_tiles(
+    bbox: BBOX, zoom_min: int, zoom_max: int
+) -> List[Tuple[int, int, int]]:
     edge_tiles = list()
-    for zoom_dir in [
-        entry_name
-        for entry_name in os.listdir(tile_dir)
-        if os.path.isdir(os.path.join(tile_dir, entry_name))
-    ]:
-        x_dirs = list(
-            map(
-                lambda x_dir: str(x_dir),
-                sorted(
-                    [
-                        int(z_entry)
-                        for z_entry in os.listdir(os.path.join(tile_dir, zoom_dir))
-                    ]
-                ),
-            )
-        )
-        edge_tiles += list(
-            map(
-                lambda y_file: os.path.join(zoom_dir, x_dirs[0], y_file),
-                os.listdir(os.path.join(tile_dir, zoom_dir, x_dirs[0])),
-            )
-        )
-        if len(x_dirs) > 1:
-            edge_tiles += list(
-                map(
-                    lambda y_file: os.path.join(zoom_dir, x_dirs[-1], y_file),
-                    os.listdir(os.path.join(tile_dir, zoom_dir, x_dirs[-1])),
-                )
-            )
-            if len(x_dirs) > 2:
-                for x_mid_dir in list(
-                    map(
-                        lambda x_dir_num: str(x_dir_num),
-                        range(int(x_dirs[1]), int(x_dirs[-1])),
-                    )
-                ):
-                    if os.path.exists(x_mid_dir):
-                        y_file_nums = sorted(
-                            [
-                                int(re.sub(r"\.png", "", y_file_name))
-                                for y_file_name in os.listdir(
-                                    os.path.join(tile_dir, zoom_dir, x_mid_dir)
-                                )
-                            ]
-                        )
-                        edge_tiles.append(
-                            os.path.join(zoom_dir, x_mid_dir, f"{y_file_nums[0]}.png")
-                        )
-                        if len(y_file_nums) > 1:
-                            edge_tiles.append(
-                                os.path.join(
-                                    zoom_dir, x_mid_dir, f"{y_file_nums[-1]}.png"
-                                )
-                            )
+    for zoom in range(zoom_min, zoom_max + 1):
+        min_x, max_y = deg_to_num(bbox.min_y, bbox.min_x, zoom)
+        max_x, min_y = deg_to_num(bbox.max_y, bbox.max_x, zoom)
+        for x in range(min_x, max_x + 1):
+            if x == min_x or x == max_x:
+                edge_tiles += [(zoom, x, y) for y in range(min_y, max_y + 1)]
+            else:
+                edge_tiles += [(zoom, x, y) for y in sorted(set((min_y, max_y)))]
     return edge_tiles
 
 
@@ -87,141 +107,393 @@ def transparent_clip_to_bbox(
 ) -> None:
     logging.info("Clipping edge tiles to bbox")
     min_x, max_x, min_y, max_y = bbox.transform_as_geom("EPSG:3857").GetEnvelope()
-    _transparent_clip_to_bbox_executor(
-        min_x, min_y, max_x, max_y, tile_paths, quantize
-    ).parallel(get_process_pool_count())
-
-
-class _transparent_clip_to_bbox_executor:
-    def __init__(
-        self,
-        min_x: float,
-        min_y: float,
-        max_x: float,
-        max_y: float,
-        tile_paths: List[str],
-        quantize: bool,
+    with span("transparent_clip_to_bbox", quantize=quantize) as clip_span:
+        # offsets are cheap to compute here, so only tiles with pixels to clear are sent to workers
+        tasks = list()
+        for tile_path in tile_paths:
+            match_groups = re.match(r".+/(\d+)/(\d+)/(\d+)\.png$", tile_path)
+            offsets = _get_clip_offsets(
+                int(match_groups.group(1)),
+                int(match_groups.group(2)),
+                int(match_groups.group(3)),
+                (min_x, min_y, max_x, max_y),
+            )
+            if offsets is not None:
+                tasks.append((tile_path, offsets, quantize))
+        process_map(_clip_tile, tasks)
+        clip_span.add(items=len(tasks))
+
+
+def _get_clip_offsets(
+    z: int, x: int, y: int, envelope: Tuple[float, float, float, float]
+) -> Tuple[int, int, int, int]:
+    """
+    Pixels to clear at the left, bottom, right and top of a tile, or None when the tile is entirely inside or outside the
+    EPSG:3857 min x, min y, max x, max y envelope.
+    """
+    min_x, min_y, max_x, max_y = envelope
+    tile_min_x = EXTENT_LIMIT * -1 + METRES_PER_TILE[z] * x
+    tile_max_x = tile_min_x + METRES_PER_TILE[z]
+    tile_min_y = EXTENT_LIMIT - METRES_PER_TILE[z] * (y + 1)
+    tile_max_y = tile_min_y + METRES_PER_TILE[z]
+    if (
+        tile_min_x >= max_x
+        or tile_max_x <= min_x
+        or tile_min_y >= max_y
+        or tile_max_y <= min_y
     ):
-        self.min_x = min_x
-        self.min_y = min_y
-        self.max_x = max_x
-        self.max_y = max_y
-        self.tile_paths = tile_paths
-        self.quantize = quantize
-
-    def __call__(self, tile_path: str):
-        match_groups = re.match(r".+/(\d+)/(\d+)/(\d+)\.png$", tile_path)
-        z, x, y = (
-            int(match_groups.group(1)),
-            int(match_groups.group(2)),
-            int(match_groups.group(3)),
+        return None
+    offsets = (
+        math.floor((min_x - tile_min_x) / METRES_PER_PIXEL[z])
+        if min_x > tile_min_x
+        else 0,
+        math.floor((min_y - tile_min_y) / METRES_PER_PIXEL[z])
+        if min_y > tile_min_y
+        else 0,
+        math.floor((tile_max_x - max_x) / METRES_PER_PIXEL[z])
+        if tile_max_x > max_x
+        else 0,
+        math.floor((tile_max_y - max_y) / METRES_PER_PIXEL[z])
+        if tile_max_y > max_y
+        else 0,
+    )
+    # entirely within the bbox so there is nothing to clear
+    return None if offsets == (0, 0, 0, 0) else offsets
+
+
+def _clip_tile(task: Tuple[str, Tuple[int, int, int, int], bool]) -> None:
+    tile_path, offsets, quantize = task
+    logging.debug(f"{tile_path} needs clipping by {offsets}")
+    tile = clear_outside(np.array(Image.open(tile_path).convert("RGBA")), *offsets)
+    _save_tile(tile, tile_path, quantize)
+
+
+def clear_outside(
+    tile: np.ndarray, left: int, bottom: int, right: int, top: int
+) -> np.ndarray:
+    """
+    Makes the given number of pixel columns and rows at each edge of an RGBA tile array fully transparent, in place.
+    """
+    tile[:, :left] = 0
+    tile[:, tile.shape[1] - right :] = 0
+    tile[:top] = 0
+    tile[tile.shape[0] - bottom :] = 0
+    return tile
+
+
+def merge_tiles(paths: List[Tuple[str]], quantize: bool = True) -> None:
+    with span("merge_tiles", quantize=quantize) as merge_span:
+        counts = process_map(
+            _merge_batch,
+            [
+                (paths[i : i + MERGE_BATCH_SIZE], quantize)
+                for i in range(0, len(paths), MERGE_BATCH_SIZE)
+            ],
+            1,
         )
-        tile_min_x = EXTENT_LIMIT * -1 + METRES_PER_TILE[z] * x
-        tile_max_x = tile_min_x + METRES_PER_TILE[z]
-        tile_min_y = EXTENT_LIMIT - METRES_PER_TILE[z] * (y + 1)
-        tile_max_y = tile_min_y + METRES_PER_TILE[z]
-        if not (
-            tile_min_x >= self.max_x
-            or tile_max_x <= self.min_x
-            or tile_min_y >= self.max_y
-            or tile_max_y <= self.min_y
-        ):
-            left_pixels = (
-                math.floor((self.min_x - tile_min_x) / METRES_PER_PIXEL[z])
-                if self.min_x > tile_min_x
-                else 0
-            )
-            bottom_pixels = (
-                math.floor((self.min_y - tile_min_y) / METRES_PER_PIXEL[z])
-                if self.min_y > tile_min_y
-                else 0
-            )
-            right_pixels = (
-                math.floor((tile_max_x - self.max_x) / METRES_PER_PIXEL[z])
-                if tile_max_x > self.max_x
-                else 0
-            )
-            top_pixels = (
-                math.floor((tile_max_y - self.max_y) / METRES_PER_PIXEL[z])
-                if tile_max_y > self.max_y
-                else 0
-            )
-            logging.debug(
-                f"{tile_path} needs clipping by {left_pixels},{bottom_pixels} {right_pixels},{top_pixels}"
+        merge_span.add(items=len(paths))
+        merge_span.attributes["transparent"] = sum([count[0] for count in counts])
+        merge_span.attributes["deduplicated"] = sum([count[1] for count in counts])
+
+
+def composite_over(base: np.ndarray, overlay: np.ndarray) -> np.ndarray:
+    """
+    Composites RGBA overlay pixels onto RGBA base pixels, uint8 arrays of any matching (..., 4) shape so one call can cover a batch of tiles.
+    Colour is blended on overlay alpha alone and alpha is the union of both, truncated to integers,
+    which are the results the per-pixel formula from https://stackoverflow.com/a/52993128/519575 produced.
+    Where overlay alpha is 0 the formula leaves the base pixel unchanged.
+    """
+    base_values = base.astype(np.uint32)
+    overlay_values = overlay.astype(np.uint32)
+    overlay_alpha = overlay_values[..., 3:]
+    inverse_alpha = 255 - overlay_alpha
+    colour = (
+        base_values[..., :3] * inverse_alpha + overlay_values[..., :3] * overlay_alpha
+    ) // 255
+    # truncating 255 - n / 255 is 255 - ceil(n / 255)
+    alpha = 255 - ((255 - base_values[..., 3:]) * inverse_alpha + 254) // 255
+    return np.concatenate((colour, alpha), axis=-1).astype(np.uint8)
+
+
+def _merge_batch(task: Tuple[List[Tuple[str]], bool]) -> Tuple[int, int]:
+    batch, quantize = task
+    bases, overlays, output_paths = list(), list(), list()
+    transparent, deduplicated = 0, 0
+    for base_path, overlay_path, output_path in batch:
+        overlay = np.asarray(Image.open(overlay_path).convert("RGBA"))
+        if not overlay[..., 3].any():
+            # compositing nothing over the base leaves it unchanged, so its bytes can be used as they are
+            transparent += 1
+            if output_path != base_path:
+                link_or_copy(base_path, output_path)
+            continue
+        bases.append(np.asarray(Image.open(base_path).convert("RGBA")))
+        overlays.append(overlay)
+        output_paths.append(output_path)
+    if len(bases) == 0:
+        return transparent, deduplicated
+    if len(set([base.shape for base in bases + overlays])) == 1:
+        merged = composite_over(np.stack(bases), np.stack(overlays))
+    else:
+        merged = [
+            composite_over(base, overlay) for base, overlay in zip(bases, overlays)
+        ]
+    for merged_tile, output_path in zip(merged, output_paths):
+        deduplicated += 1 if _save_tile(merged_tile, output_path, quantize) else 0
+    return transparent, deduplicated
+
+
+def composite_mbtiles(
+    mbtiles_path: str,
+    base_dir: str,
+    result_dir: str,
+    bbox: BBOX,
+    zoom_min: int,
+    zoom_max: int,
+    quantize: bool = True,
+) -> int:
+    """
+    Writes every tile of bbox to result_dir once, compositing the rendered mbtiles tile over the z/x/y.png base tile.
+    Edge tiles are clipped to bbox and stitched over any existing result tile.
+    Returns the number of tiles written.
+    """
+    min_x, max_x, min_y, max_y = bbox.transform_as_geom("EPSG:3857").GetEnvelope()
+    edge_tiles = set(_get_edge_tiles(bbox, zoom_min, zoom_max))
+    tiles = list()
+    for z, xs in identify_tiles(bbox, zoom_min, zoom_max).items():
+        for x, ys in xs.items():
+            for y in ys:
+                tiles.append(
+                    (
+                        z,
+                        x,
+                        y,
+                        (z, x, y) in edge_tiles,
+                        _get_clip_offsets(z, x, y, (min_x, min_y, max_x, max_y))
+                        if (z, x, y) in edge_tiles
+                        else None,
+                    )
+                )
+    with span("composite_mbtiles", quantize=quantize) as composite_span:
+        counts = process_map(
+            _composite_batch,
+            [
+                (
+                    tiles[i : i + MERGE_BATCH_SIZE],
+                    mbtiles_path,
+                    base_dir,
+                    result_dir,
+                    quantize,
+                )
+                for i in range(0, len(tiles), MERGE_BATCH_SIZE)
+            ],
+        )
+        written = sum([count[0] for count in counts])
+        composite_span.add(items=written)
+        composite_span.attributes["transparent"] = sum([count[1] for count in counts])
+        composite_span.attributes["deduplicated"] = sum([count[2] for count in counts])
+    return written
+
+
+def _composite_batch(
+    task: Tuple[
+        List[Tuple[int, int, int, bool, Tuple[int, int, int, int]]], str, str, str, bool
+    ]
+) -> Tuple[int, int, int]:
+    batch, mbtiles_path, base_dir, result_dir, quantize = task
+    written, transparent, deduplicated = 0, 0, 0
+    # TileMill stores repeated tiles such as blank overlay once, so decoded payloads are worth reusing
+    overlays: Dict[bytes, np.ndarray] = dict()
+    connection = sqlite3.connect(f"file:{mbtiles_path}?mode=ro", uri=True)
+    try:
+        for z, x, y, is_edge, offsets in batch:
+            tile_path = os.path.join(str(z), str(x), f"{y}.png")
+            base_path = os.path.join(base_dir, tile_path)
+            output_path = os.path.join(result_dir, tile_path)
+            # mbtiles rows count up from the bottom of the map
+            row = connection.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, pow(2, z) - 1 - y),
+            ).fetchone()
+            overlay = None
+            if row is not None:
+                digest = hashlib.blake2b(row[0], digest_size=16).digest()
+                if digest not in overlays:
+                    decoded = np.asarray(Image.open(io.BytesIO(row[0])).convert("RGBA"))
+                    overlays[digest] = decoded if decoded[..., 3].any() else None
+                overlay = overlays[digest]
+                transparent += 1 if overlay is None else 0
+            base_exists = os.path.exists(base_path)
+            if overlay is None and not base_exists:
+                continue
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            if overlay is None and not is_edge:
+                # nothing to composite, clip or stitch so the base is the result as it is
+                link_or_copy(base_path, output_path)
+                written += 1
+                continue
+            tile = (
+                np.array(Image.open(base_path).convert("RGBA"))
+                if base_exists
+                else np.zeros((TILE_SIZE, TILE_SIZE, 4), np.uint8)
             )
-            tile_src = Image.open(tile_path)
-            tile = tile_src.convert("RGBA")
-            for i in range(TILE_SIZE):
-                for j in range(TILE_SIZE):
-                    coord = (i, j)
-                    if (
-                        i < left_pixels
-                        or i >= (TILE_SIZE - right_pixels)
-                        or j < top_pixels
-                        or j >= (TILE_SIZE - bottom_pixels)
-                    ):
-                        new_values = (0, 0, 0, 0)
-                        tile.putpixel(coord, new_values)
-            if self.quantize:
-                tile.quantize(method=2).save(tile_path)
-            else:
-                tile.save(tile_path)
+            if overlay is not None:
+                tile = composite_over(tile, overlay)
+            if offsets is not None:
+                tile = clear_outside(tile, *offsets)
+            if is_edge and os.path.exists(output_path):
+                tile = composite_over(
+                    np.asarray(Image.open(output_path).convert("RGBA")), tile
+                )
+            deduplicated += 1 if _save_tile(tile, output_path, quantize) else 0
+            written += 1
+    finally:
+        connection.close()
+    return written, transparent, deduplicated
 
-    def parallel(self, pool_size: int):
-        pool = multiprocessing.Pool(processes=pool_size)
-        pool.map(self, self.tile_paths)
-        pool.close()
 
+def downsample(quads: np.ndarray) -> np.ndarray:
+    """
+    Halves RGBA uint8 pixels of any (..., height, width, 4) shape so one call can cover a batch of 2x2 tile quads.
+    Colour is averaged weighted by alpha, as premultiplied pixels would be, so transparent pixels do not darken their neighbours.
+    """
+    values = quads.astype(np.uint32)
+    blocks = quads.shape[:-3] + (quads.shape[-3] // 2, 2, quads.shape[-2] // 2, 2)
+    alpha = values[..., 3].reshape(blocks).sum(axis=(-3, -1))[..., np.newaxis]
+    weighted = (
+        (values[..., :3] * values[..., 3:]).reshape(blocks + (3,)).sum(axis=(-4, -2))
+    )
+    colour = (weighted + alpha // 2) // np.maximum(alpha, 1)
+    return np.concatenate((colour, (alpha + 2) // 4), axis=-1).astype(np.uint8)
 
-def merge_tiles(paths: List[Tuple[str]], quantize: bool = True) -> None:
-    _merge_tiles_executor(paths, quantize).parallel(get_process_pool_count())
-
-
-class _merge_tiles_executor:
-    def __init__(self, paths: List[Tuple[str]], quantize: bool):
-        self.paths = paths
-        self.quantize = quantize
-
-    def __call__(self, paths: Tuple[str]):
-        base_path, overlay_path, output_path = paths
-        overlay_image_src = overlay_image = Image.open(overlay_path)
-        base_image_src = Image.open(base_path)
-        overlay_image = overlay_image_src.convert("RGBA")
-        base_image = base_image_src.convert("RGBA")
-        for i in range(TILE_SIZE):
-            for j in range(TILE_SIZE):
-                coord = (i, j)
-                overlay_values = overlay_image.getpixel(coord)
-                if len(overlay_values) == 3:
-                    overlay_values += (255,)
-                if overlay_values[3] > 0:
-                    base_image.putpixel(
-                        coord,
-                        _combine_pixels(
-                            base_image.getpixel(coord) + (255,), overlay_values
-                        ),
+
+def build_pyramid(
+    tile_dir: str,
+    bbox: BBOX,
+    zoom_min: int,
+    render_zoom_min: int,
+    quantize: bool = True,
+    get_existing: Callable[[int, int, int], Union[str, bytes]] = None,
+) -> int:
+    """
+    Writes the tiles of bbox from render_zoom_min - 1 down to zoom_min to tile_dir, each downsampled from the 2x2 quad of tiles a zoom deeper.
+    Only quads bbox touches are built. A quad tile missing from tile_dir is taken from get_existing, a path or bytes or None,
+    so parents of tiles along bbox's edges include the neighbouring cells already in the result.
+    Returns the number of tiles written.
+    """
+    written, deduplicated = 0, 0
+    with span("build_pyramid", quantize=quantize) as pyramid_span:
+        for z in range(render_zoom_min - 1, zoom_min - 1, -1):
+            tasks = list()
+            for x, ys in identify_tiles(bbox, z, z)[z].items():
+                for y in ys:
+                    quad = tuple(
+                        _get_quad_tile(
+                            tile_dir, z + 1, x * 2 + dx, y * 2 + dy, get_existing
+                        )
+                        for dy in (0, 1)
+                        for dx in (0, 1)
                     )
-        if self.quantize:
-            base_image.quantize(method=2).save(output_path)
-        else:
-            base_image.save(output_path)
-
-    def parallel(self, pool_size: int):
-        pool = multiprocessing.Pool(processes=pool_size)
-        pool.map(self, self.paths)
-        pool.close()
-
-
-# https://stackoverflow.com/a/52993128/519575
-def _combine_pixels(base_rgba, overlay_rgba):
-    alpha = 255 - ((255 - base_rgba[3]) * (255 - overlay_rgba[3]) / 255)
-    red = (
-        base_rgba[0] * (255 - overlay_rgba[3]) + overlay_rgba[0] * overlay_rgba[3]
-    ) / 255
-    green = (
-        base_rgba[1] * (255 - overlay_rgba[3]) + overlay_rgba[1] * overlay_rgba[3]
-    ) / 255
-    blue = (
-        base_rgba[2] * (255 - overlay_rgba[3]) + overlay_rgba[2] * overlay_rgba[3]
-    ) / 255
-    return (int(red), int(green), int(blue), int(alpha))
+                    if any([child is not None for child in quad]):
+                        tasks.append(
+                            (os.path.join(tile_dir, str(z), str(x), f"{y}.png"), quad)
+                        )
+            # each zoom is built from the one below it, so zooms are processed in turn
+            deduplicated += sum(
+                process_map(
+                    _pyramid_batch,
+                    [
+                        (tasks[i : i + MERGE_BATCH_SIZE], quantize)
+                        for i in range(0, len(tasks), MERGE_BATCH_SIZE)
+                    ],
+                )
+            )
+            written += len(tasks)
+        pyramid_span.add(items=written)
+        pyramid_span.attributes["deduplicated"] = deduplicated
+    return written
+
+
+def _get_quad_tile(
+    tile_dir: str,
+    z: int,
+    x: int,
+    y: int,
+    get_existing: Callable[[int, int, int], Union[str, bytes]],
+) -> Union[str, bytes]:
+    tile_path = os.path.join(tile_dir, str(z), str(x), f"{y}.png")
+    if os.path.exists(tile_path):
+        return tile_path
+    return get_existing(z, x, y) if get_existing else None
+
+
+def _pyramid_batch(
+    task: Tuple[List[Tuple[str, Tuple[Union[str, bytes], ...]]], bool]
+) -> int:
+    batch, quantize = task
+    quads = np.zeros((len(batch), TILE_SIZE * 2, TILE_SIZE * 2, 4), np.uint8)
+    for i, (_, quad) in enumerate(batch):
+        for j, child in enumerate(quad):
+            if child is None:
+                continue
+            image = Image.open(
+                child if isinstance(child, str) else io.BytesIO(child)
+            ).convert("RGBA")
+            if image.size != (TILE_SIZE, TILE_SIZE):
+                image = image.resize((TILE_SIZE, TILE_SIZE))
+            top, left = (j // 2) * TILE_SIZE, (j % 2) * TILE_SIZE
+            quads[i, top : top + TILE_SIZE, left : left + TILE_SIZE] = np.asarray(image)
+    deduplicated = 0
+    for tile, (output_path, _) in zip(downsample(quads), batch):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        deduplicated += 1 if _save_tile(tile, output_path, quantize) else 0
+    return deduplicated
+
+
+def _save_tile(tile: np.ndarray, tile_path: str, quantize: bool) -> bool:
+    """
+    Writes a tile, hard linking to an identical tile this process already wrote instead of encoding it again.
+    Returns True when the tile was linked.
+    """
+    digest = hashlib.blake2b(
+        tile.tobytes() + bytes((int(quantize),)), digest_size=16
+    ).digest()
+    written = _written_tiles.get(digest)
+    if written is not None and _link_tile(*written, tile_path):
+        _written_tiles.move_to_end(digest)
+        return True
+    encoded = io.BytesIO()
+    (quantize_tile(tile) if quantize else Image.fromarray(tile, "RGBA")).save(
+        encoded, "PNG"
+    )
+    _write_tile(encoded.getvalue(), tile_path)
+    _written_tiles[digest] = (tile_path, os.stat(tile_path).st_ino)
+    if len(_written_tiles) > DEDUPLICATE_CACHE_SIZE:
+        _written_tiles.popitem(last=False)
+    return False
+
+
+def _link_tile(source_path: str, inode: int, tile_path: str) -> bool:
+    # tiles are only ever replaced, never rewritten in place, so a matching inode still holds the same bytes
+    tmp_path = _get_tmp_path(tile_path)
+    try:
+        if os.stat(source_path).st_ino != inode:
+            return False
+        os.link(source_path, tmp_path)
+    except OSError:
+        # moved, deleted, on another filesystem or at the link limit
+        return False
+    os.replace(tmp_path, tile_path)
+    return True
+
+
+def _write_tile(data: bytes, tile_path: str) -> None:
+    # replacing rather than truncating keeps readers and hard linked copies of the old tile intact
+    tmp_path = _get_tmp_path(tile_path)
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, tile_path)
+
+
+def _get_tmp_path(tile_path: str) -> str:
+    return f"{tile_path}.{os.getpid()}-{threading.get_ident()}.tmp"
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+
+from collections import defaultdict
+from typing import Dict, Final, List
+
+from app.bbox_provisioner import estimate, ProvisionArg, ProvisionEstimate
+from app.common.util import get_base_path
+
+ESTIMATE_FILE_NAME: Final = "estimate.json"
+
+
+def estimate_plan(provision_args: List[ProvisionArg]) -> List[ProvisionEstimate]:
+    estimates = list()
+    for i, provision_arg in enumerate(provision_args):
+        if i > 0 and i % 100 == 0:
+            logging.info(f"Estimated {i} of {len(provision_args)}")
+        estimates.append(estimate(provision_arg))
+    return estimates
+
+
+def summarise(estimates: List[ProvisionEstimate]) -> Dict[str, object]:
+    tiles_by_zoom = defaultdict(int)
+    tiles_by_profile = defaultdict(int)
+    sources = defaultdict(lambda: {"total": 0, "cached": 0, "missing": 0})
+    for provision_estimate in [each for each in estimates if not each.skipped]:
+        for zoom, count in provision_estimate.tiles.items():
+            tiles_by_zoom[zoom] += count
+            tiles_by_profile[provision_estimate.arg.profile_name] += count
+        for source_estimate in provision_estimate.sources:
+            source = sources[f"{source_estimate.source} ({source_estimate.unit})"]
+            source["total"] += source_estimate.total
+            source["cached"] += source_estimate.cached
+            source["missing"] += source_estimate.missing
+    provisioned = len([each for each in estimates if not each.skipped])
+    return {
+        "bboxes": len(estimates),
+        "skipped": len(estimates) - provisioned,
+        "tiles": sum(tiles_by_zoom.values()),
+        "tiles_per_bbox": sum(tiles_by_zoom.values()) / provisioned
+        if provisioned
+        else 0,
+        "tiles_by_zoom": dict(sorted(tiles_by_zoom.items())),
+        "tiles_by_profile": dict(tiles_by_profile),
+        "sources": dict(sources),
+    }
+
+
+def log_estimates(estimates: List[ProvisionEstimate]) -> None:
+    for provision_estimate in estimates:
+        bbox = provision_estimate.arg.bbox
+        description = f"{provision_estimate.arg.profile_name} {bbox.min_x},{bbox.min_y} {bbox.max_x},{bbox.max_y}"
+        if provision_estimate.skipped:
+            logging.info(f"{description}: skipped as it already exists")
+            continue
+        sources = ", ".join(
+            [
+                f"{source_estimate.source} {source_estimate.missing}/{source_estimate.total} {source_estimate.unit}"
+                for source_estimate in provision_estimate.sources
+            ]
+        )
+        logging.info(
+            f"{description}: {sum(provision_estimate.tiles.values())} tiles; {sources}"
+        )
+    summary = summarise(estimates)
+    logging.info(
+        f"{summary['bboxes']} bbox(es), {summary['skipped']} to skip, {summary['tiles']} tiles ({summary['tiles_per_bbox']:.0f} per bbox)"
+    )
+    for zoom, count in summary["tiles_by_zoom"].items():
+        logging.info(f"z{zoom}: {count} tiles")
+    for profile_name, count in summary["tiles_by_profile"].items():
+        logging.info(f"{profile_name}: {count} tiles")
+    for source, counts in summary["sources"].items():
+        logging.info(
+            f"{source}: {counts['missing']} to fetch or generate, {counts['cached']} cached, {counts['total']} total"
+        )
+
+
+def write_estimates(estimates: List[ProvisionEstimate], path: str = None) -> str:
+    estimate_path = path or os.path.join(get_base_path(), ESTIMATE_FILE_NAME)
+    with open(estimate_path, "w") as f:
+        json.dump(
+            {
+                "summary": summarise(estimates),
+                "estimates": [
+                    json.loads(provision_estimate.json())
+                    for provision_estimate in estimates
+                ],
+            },
+            f,
+            indent=2,
+        )
+    logging.info(f"Estimate written to {estimate_path}")
+    return estimate_path
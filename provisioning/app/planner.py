@@ -0,0 +1,208 @@
+import logging
+import os
+
+from bisect import bisect_left, bisect_right
+from osgeo import ogr, osr
+from typing import Final, List, Tuple
+
+from app.common.bbox import BBOX
+from app.common.util import get_result_path
+from app.bbox_provisioner import ProvisionArg, get_profile_names
+from app.record.provenance import Provenance, XYZ_INPUT, get_provenance_path
+from app.run_strategy import RunStrategy
+
+# loose bbox for BC with some buffering
+GRID_MIN_X: Final = -140
+GRID_MIN_Y: Final = 47
+GRID_MAX_X: Final = -113
+GRID_MAX_Y: Final = 61
+
+
+def get_bbox_division() -> float:
+    return float(os.environ.get("BBOX_DIVISION", 0.5))
+
+
+def get_gridded_bbox_increment() -> float:
+    return float(os.environ.get("GRIDDED_BBOX_INCREMENT", 0.1))
+
+
+def plan(area_layer: ogr.Layer) -> List[ProvisionArg]:
+    provision_args = list()
+    grid_x_axis, grid_y_axis = _build_grid_axes(get_gridded_bbox_increment())
+    area_layer.SetAttributeFilter(f"strategy = '{RunStrategy.GRIDDED.value}'")
+    while area_feature := area_layer.GetNextFeature():
+        provision_args.extend(_plan_gridded(area_feature, grid_x_axis, grid_y_axis))
+    area_layer.SetAttributeFilter(f"strategy = '{RunStrategy.ENVELOPE.value}'")
+    while area_feature := area_layer.GetNextFeature():
+        provision_args.extend(_plan_envelope(area_feature, get_bbox_division()))
+    area_layer.SetAttributeFilter(None)
+    logging.info(f"Planned {len(provision_args)} bbox(es)")
+    return provision_args
+
+
+def plan_stale() -> List[ProvisionArg]:
+    """
+    The bboxes of earlier runs that still own tiles rendered from a stylesheet or source version that has since changed.
+    Each is re-rendered in full, so the tiles it owns are replaced and recorded against the new run.
+    """
+    provision_args = list()
+    for profile_name in get_profile_names():
+        provenance_path = get_provenance_path(get_result_path((profile_name,)))
+        if not os.path.exists(provenance_path):
+            continue
+        with Provenance(provenance_path) as provenance:
+            stale_runs = provenance.get_stale_runs()
+        for stale_run in stale_runs:
+            logging.info(
+                f"{profile_name} run {stale_run.run_id} has {stale_run.tiles} stale tile(s), changed: {', '.join(stale_run.changed)}"
+            )
+            provision_args.append(
+                ProvisionArg(
+                    bbox=stale_run.bbox,
+                    profile_name=profile_name,
+                    xyz_url=stale_run.inputs.get(XYZ_INPUT),
+                    skippable=False,
+                    stale=True,
+                )
+            )
+    logging.info(f"Planned {len(provision_args)} stale bbox(es)")
+    return provision_args
+
+
+def get_profile_names_for_feature(feature: ogr.Feature) -> List[str]:
+    return list(
+        map(
+            lambda profile_names_part: profile_names_part.strip(),
+            feature.GetFieldAsString("profile").split(","),
+        )
+    )
+
+
+def get_xyz_url_for_feature(feature: ogr.Feature) -> str:
+    return feature.GetFieldAsString("xyz_url")
+
+
+def _round_for_increment(value: float, increment: float) -> float:
+    precision_mulplier = max(int(1 / increment), 0)
+    return int(value * precision_mulplier) / precision_mulplier
+
+
+def _build_grid_axis(axis_min: float, axis_max: float, increment: float) -> List[float]:
+    # cell edges are accumulated exactly as they always have been so bboxes match those already recorded
+    edges = [axis_min]
+    while edges[-1] < axis_max:
+        edges.append(_round_for_increment(edges[-1] + increment, increment))
+    return edges
+
+
+def _build_grid_axes(increment: float) -> Tuple[List[float], List[float]]:
+    return (
+        _build_grid_axis(GRID_MIN_X, GRID_MAX_X, increment),
+        _build_grid_axis(GRID_MIN_Y, GRID_MAX_Y, increment),
+    )
+
+
+def _get_cell_range(edges: List[float], range_min: float, range_max: float) -> range:
+    # cells touching the range are included, matching a non-empty OGR Intersection
+    first = max(0, bisect_left(edges, range_min) - 1)
+    last = min(len(edges) - 2, bisect_right(edges, range_max) - 1)
+    return range(first, last + 1)
+
+
+def _build_rect_geom(
+    min_x: float, min_y: float, max_x: float, max_y: float, srs: osr.SpatialReference
+) -> ogr.Geometry:
+    geom = ogr.CreateGeometryFromWkt(
+        f"POLYGON (({min_x} {min_y}, {max_x} {min_y}, {max_x} {max_y}, {min_x} {max_y}, {min_x} {min_y}))"
+    )
+    geom.AssignSpatialReference(srs)
+    return geom
+
+
+def _plan_gridded(
+    area_feature: ogr.Feature, grid_x_axis: List[float], grid_y_axis: List[float]
+) -> List[ProvisionArg]:
+    grid_srs = osr.SpatialReference()
+    grid_srs.SetFromUserInput("EPSG:4326")
+    area_geom = area_feature.GetGeometryRef()
+    area_min_x, area_max_x, area_min_y, area_max_y = area_geom.GetEnvelope()
+    x_range = _get_cell_range(grid_x_axis, area_min_x, area_max_x)
+    y_range = _get_cell_range(grid_y_axis, area_min_y, area_max_y)
+    if len(x_range) == 0 or len(y_range) == 0:
+        return list()
+    profile_names = get_profile_names_for_feature(area_feature)
+    xyz_url = get_xyz_url_for_feature(area_feature)
+    skippable = int(os.environ.get("GRIDDED_REPEAT_IF_EXISTS", 0)) != 1
+    provision_args = list()
+    for i in x_range:
+        cell_x_min, cell_x_max = grid_x_axis[i], grid_x_axis[i + 1]
+        # clip the area to one column of cells so each cell test runs against a small geometry
+        column_geom = area_geom.Intersection(
+            _build_rect_geom(
+                cell_x_min,
+                grid_y_axis[y_range[0]],
+                cell_x_max,
+                grid_y_axis[y_range[-1] + 1],
+                grid_srs,
+            )
+        )
+        if column_geom is None or column_geom.IsEmpty():
+            continue
+        _, _, column_min_y, column_max_y = column_geom.GetEnvelope()
+        for j in _get_cell_range(grid_y_axis, column_min_y, column_max_y):
+            cell_y_min, cell_y_max = grid_y_axis[j], grid_y_axis[j + 1]
+            if not column_geom.Intersects(
+                _build_rect_geom(
+                    cell_x_min, cell_y_min, cell_x_max, cell_y_max, grid_srs
+                )
+            ):
+                continue
+            provision_args.extend(
+                [
+                    ProvisionArg(
+                        bbox=BBOX(
+                            min_x=cell_x_min,
+                            min_y=cell_y_min,
+                            max_x=cell_x_max,
+                            max_y=cell_y_max,
+                        ),
+                        profile_name=profile_name,
+                        xyz_url=xyz_url,
+                        skippable=skippable,
+                    )
+                    for profile_name in profile_names
+                ]
+            )
+    return provision_args
+
+
+def _plan_envelope(area_feature: ogr.Feature, division: float) -> List[ProvisionArg]:
+    provision_args = list()
+    min_x, max_x, min_y, max_y = area_feature.GetGeometryRef().GetEnvelope()
+    reset_y = min_y
+    while min_x < max_x:
+        increment_x = min(division, max_x - min_x)
+        min_y = reset_y
+        while min_y < max_y:
+            increment_y = min(division, max_y - min_y)
+            this_max_x = min_x + increment_x
+            this_max_y = min_y + increment_y
+            provision_args.extend(
+                [
+                    ProvisionArg(
+                        bbox=BBOX(
+                            min_x=min_x,
+                            min_y=min_y,
+                            max_x=this_max_x,
+                            max_y=this_max_y,
+                        ),
+                        profile_name=profile_name,
+                        xyz_url=get_xyz_url_for_feature(area_feature),
+                        skippable=False,
+                    )
+                    for profile_name in get_profile_names_for_feature(area_feature)
+                ]
+            )
+            min_y += increment_y
+        min_x += increment_x
+    return provision_args
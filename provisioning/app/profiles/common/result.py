@@ -1,15 +1,84 @@
 import logging
 import os
+import shutil
 
-from app.common.util import merge_dirs
-from app.common.xyz import get_edge_tiles, merge_tiles
+from functools import partial
+from typing import Callable, Dict, Union
 
+from app.common.bbox import BBOX
+from app.common.mbtiles import (
+    MBTiles,
+    get_mbtiles_path,
+    get_result_format,
+    read_tile_dir,
+)
+from app.common.tile_store import deduplicate_enabled, deduplicate_tiles
+from app.common.trace import get_dir_size, span, trace_enabled
+from app.common.util import get_named_lock, merge_dirs
+from app.common.xyz import (
+    build_pyramid,
+    get_edge_tiles,
+    get_render_zoom_min,
+    merge_tiles,
+)
+from app.record.provenance import provenance_enabled, record_provenance
 
-def add_or_update(source_dir: str, dest_dir: str, quantize: bool = True):
+
+def add_or_update(
+    source_dir: str,
+    dest_dir: str,
+    bbox: BBOX,
+    zoom_min: int,
+    zoom_max: int,
+    quantize: bool = True,
+    run_id: str = None,
+    inputs: Dict[str, str] = dict(),
+):
+    """
+    Stitches the tiles in source_dir over those in dest_dir and moves them there.
+    source_dir need only hold the zooms from get_render_zoom_min, those below are built from them.
+    With provenance enabled and a run_id the tiles are recorded as rendered by that run from inputs.
+    """
+    with span("add_or_update"):
+        with get_named_lock(dest_dir):
+            if get_result_format() == "mbtiles":
+                _add_or_update_mbtiles(
+                    source_dir,
+                    dest_dir,
+                    bbox,
+                    zoom_min,
+                    zoom_max,
+                    quantize,
+                    run_id,
+                    inputs,
+                )
+            else:
+                _add_or_update(
+                    source_dir,
+                    dest_dir,
+                    bbox,
+                    zoom_min,
+                    zoom_max,
+                    quantize,
+                    run_id,
+                    inputs,
+                )
+
+
+def _add_or_update(
+    source_dir: str,
+    dest_dir: str,
+    bbox: BBOX,
+    zoom_min: int,
+    zoom_max: int,
+    quantize: bool,
+    run_id: str,
+    inputs: Dict[str, str],
+):
     logging.info(
         "Searching existing tiles for edge overlaps and stitching if necessary"
     )
-    edge_tiles = get_edge_tiles(source_dir)
+    edge_tiles = get_edge_tiles(bbox, zoom_min, zoom_max, source_dir)
     existing_edge_tiles = [
         edge_tile
         for edge_tile in edge_tiles
@@ -26,6 +95,111 @@ def add_or_update(source_dir: str, dest_dir: str, quantize: bool = True):
             for edge_tile in existing_edge_tiles
         ]
         merge_tiles(path_tuples, quantize)
+    _build_pyramid(
+        source_dir,
+        bbox,
+        zoom_min,
+        zoom_max,
+        quantize,
+        partial(_get_existing_path, dest_dir),
+    )
+    _record_provenance(source_dir, dest_dir, bbox, run_id, inputs)
 
+    tile_paths = (
+        [
+            os.path.relpath(os.path.join(dirpath, filename), source_dir)
+            for dirpath, _, filenames in os.walk(source_dir)
+            for filename in filenames
+        ]
+        if deduplicate_enabled()
+        else list()
+    )
     logging.info("Updating result directories with latest export")
-    merge_dirs(source_dir, dest_dir)
+    with span("merge_dirs") as merge_span:
+        if trace_enabled():
+            merge_span.add(size=get_dir_size(source_dir))
+        merge_dirs(source_dir, dest_dir)
+    if deduplicate_enabled():
+        deduplicate_tiles(dest_dir, tile_paths)
+
+
+def _add_or_update_mbtiles(
+    source_dir: str,
+    dest_dir: str,
+    bbox: BBOX,
+    zoom_min: int,
+    zoom_max: int,
+    quantize: bool,
+    run_id: str,
+    inputs: Dict[str, str],
+):
+    os.makedirs(dest_dir, exist_ok=True)
+    with MBTiles(get_mbtiles_path(dest_dir)) as mbtiles:
+        logging.info(
+            "Searching existing tiles for edge overlaps and stitching if necessary"
+        )
+        # existing edge tiles are written out beside the export so they can be merged like result files
+        existing_dir = f"{os.path.normpath(source_dir)}-existing"
+        path_tuples = list()
+        for edge_tile in get_edge_tiles(bbox, zoom_min, zoom_max, source_dir):
+            z, x, y_file = edge_tile.split(os.sep)
+            tile_data = mbtiles.get_tile(int(z), int(x), int(y_file[: -len(".png")]))
+            if tile_data is None:
+                continue
+            existing_path = os.path.join(existing_dir, edge_tile)
+            os.makedirs(os.path.dirname(existing_path), exist_ok=True)
+            with open(existing_path, "wb") as f:
+                f.write(tile_data)
+            path_tuples.append(
+                (
+                    existing_path,
+                    os.path.join(source_dir, edge_tile),
+                    os.path.join(source_dir, edge_tile),
+                )
+            )
+        if len(path_tuples) > 0:
+            logging.info(f"Stitching {len(path_tuples)} tile(s)")
+            merge_tiles(path_tuples, quantize)
+        shutil.rmtree(existing_dir, ignore_errors=True)
+        _build_pyramid(source_dir, bbox, zoom_min, zoom_max, quantize, mbtiles.get_tile)
+        _record_provenance(source_dir, dest_dir, bbox, run_id, inputs)
+
+        logging.info(f"Writing latest export to {mbtiles.path}")
+        with span("mbtiles.upsert") as upsert_span:
+            upsert_span.add(items=mbtiles.put_tiles(read_tile_dir(source_dir)))
+        mbtiles.update_metadata(
+            os.path.basename(os.path.normpath(dest_dir)), bbox, zoom_min, zoom_max
+        )
+    shutil.rmtree(source_dir)
+
+
+def _build_pyramid(
+    source_dir: str,
+    bbox: BBOX,
+    zoom_min: int,
+    zoom_max: int,
+    quantize: bool,
+    get_existing: Callable[[int, int, int], Union[str, bytes]],
+) -> None:
+    # built from the stitched tiles, and existing tiles beside them, so parents need no stitching of their own
+    render_zoom_min = get_render_zoom_min(zoom_min, zoom_max)
+    if render_zoom_min > zoom_min:
+        logging.info(
+            f"Building zooms {zoom_min}-{render_zoom_min - 1} from {render_zoom_min}"
+        )
+        build_pyramid(
+            source_dir, bbox, zoom_min, render_zoom_min, quantize, get_existing
+        )
+
+
+def _get_existing_path(dest_dir: str, z: int, x: int, y: int) -> str:
+    path = os.path.join(dest_dir, str(z), str(x), f"{y}.png")
+    return path if os.path.exists(path) else None
+
+
+def _record_provenance(
+    source_dir: str, dest_dir: str, bbox: BBOX, run_id: str, inputs: Dict[str, str]
+) -> None:
+    # after stitching, so content hashes are of the tiles as they are written
+    if run_id is not None and provenance_enabled():
+        record_provenance(dest_dir, run_id, bbox, inputs, source_dir)
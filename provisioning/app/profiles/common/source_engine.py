@@ -0,0 +1,66 @@
+import logging
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Sequence, Tuple
+
+from app.common.bbox import BBOX
+from app.common.trace import propagate, span
+from app.tilemill.ProjectLayer import ProjectLayer
+
+
+LayerProvider = Callable[[BBOX, str], List[ProjectLayer]]
+
+
+def get_source_concurrency() -> int:
+    return max(1, int(os.environ.get("BVSAR_SOURCE_CONCURRENCY", 4)))
+
+
+def get_provider_name(provider: LayerProvider) -> str:
+    # providers needing extra arguments are supplied as functools.partial
+    return getattr(provider, "func", provider).__name__
+
+
+def provision_layers(
+    bbox: BBOX, run_id: str, providers: Sequence[LayerProvider]
+) -> List[ProjectLayer]:
+    """
+    Provision each source concurrently, returning their layers in the order the providers were given
+    as that is the order in which TileMill draws them.
+    """
+    concurrency = min(get_source_concurrency(), len(providers))
+    logging.info(
+        f"Provisioning {len(providers)} source(s) with {concurrency} concurrency"
+    )
+    start = time.time()
+    if concurrency <= 1:
+        results = [_timed(provider, bbox, run_id) for provider in providers]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix=f"sources-{run_id[:8]}"
+        ) as executor:
+            results = list(
+                executor.map(
+                    propagate(lambda provider: _timed(provider, bbox, run_id)),
+                    providers,
+                )
+            )
+    layers = list()
+    for provider, (provider_layers, duration) in zip(providers, results):
+        logging.info(
+            f"Source {get_provider_name(provider)}: {len(provider_layers)} layer(s) in {duration:.1f}s"
+        )
+        layers += provider_layers
+    logging.info(f"Provisioned sources in {time.time() - start:.1f}s")
+    return layers
+
+
+def _timed(
+    provider: LayerProvider, bbox: BBOX, run_id: str
+) -> Tuple[List[ProjectLayer], float]:
+    start = time.time()
+    with span(f"source.{get_provider_name(provider)}") as source_span:
+        layers = provider(bbox, run_id)
+        source_span.add(items=len(layers))
+    return layers, time.time() - start
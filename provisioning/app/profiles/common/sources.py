@@ -1,14 +1,19 @@
-from typing import List
+from typing import Callable, Dict, Final, List, Sequence
 
 from app.common.bbox import BBOX
+from app.profiles.common.source_engine import LayerProvider, get_provider_name
 from app.tilemill.ProjectLayer import ProjectLayer
+from app.sources.common.clip_cache import is_cached, provision_cached
+from app.sources.common.estimate import SourceEstimate
 from app.sources.canvec_wms import (
     provision as canvec_wms_provisioner,
+    estimate as canvec_wms_estimate,
     OUTPUT_CRS_CODE as canvec_crs_code,
     OUTPUT_TYPE as canvec_output_type,
 )
 from app.sources.bc_hillshade import (
     provision as bc_hillshade_provisioner,
+    estimate as bc_hillshade_estimate,
     OUTPUT_CRS_CODE as bc_hillshade_crs_code,
     OUTPUT_TYPE as bc_hillshade_output_type,
 )
@@ -16,9 +21,12 @@ from app.sources.bc_resource_roads import (
     provision as bc_resource_roads_provisioner,
     OUTPUT_CRS_CODE as bc_resource_roads_crs_code,
     OUTPUT_TYPE as bc_resource_roads_output_type,
+    CACHE_DIR_NAME as bc_resource_roads_cache_dir_name,
+    get_version as bc_resource_roads_version,
 )
 from app.sources.bc_topo_20000 import (
     provision as bc_topo_20000_provisioner,
+    estimate as bc_topo_20000_estimate,
     OUTPUT_CRS_CODE as bc_topo_crs_code,
     OUTPUT_TYPE as bc_topo_output_type,
 )
@@ -26,21 +34,29 @@ from app.sources.shelters import (
     provision as shelters_provisioner,
     OUTPUT_CRS_CODE as shelters_crs_code,
     OUTPUT_TYPE as shelters_output_type,
+    CACHE_DIR_NAME as shelters_cache_dir_name,
+    get_version as shelters_version,
 )
 from app.sources.trails import (
     provision as trails_provisioner,
     OUTPUT_CRS_CODE as trails_crs_code,
     OUTPUT_TYPE as trails_output_type,
+    CACHE_DIR_NAME as trails_cache_dir_name,
+    get_version as trails_version,
 )
 from app.sources.bc_waterways import (
     provision as bc_waterways_provisioner,
     OUTPUT_CRS_CODE as bc_waterways_crs_code,
     OUTPUT_TYPE as bc_waterways_output_type,
+    CACHE_DIR_NAME as bc_waterways_cache_dir_name,
+    get_version as bc_waterways_version,
 )
 from app.sources.bc_wetlands import (
     provision as bc_wetlands_provisioner,
     OUTPUT_CRS_CODE as bc_wetlands_crs_code,
     OUTPUT_TYPE as bc_wetlands_output_type,
+    CACHE_DIR_NAME as bc_wetlands_cache_dir_name,
+    get_version as bc_wetlands_version,
 )
 from app.sources.bc_ates_zones import (
     provision as bc_ates_zones_provisioner,
@@ -78,6 +94,15 @@ from app.sources.bc_parks import (
     OUTPUT_TYPE as bc_parks_output_type,
 )
 
+# versions of the datasets clipped for each bbox by provider name, providers not listed fetch from a service for each bbox
+SOURCE_VERSIONS: Final[Dict[str, Callable[[], str]]] = {
+    "bc_resource_roads": bc_resource_roads_version,
+    "trails": trails_version,
+    "shelters": shelters_version,
+    "bc_waterways": bc_waterways_version,
+    "bc_wetlands": bc_wetlands_version,
+}
+
 
 def canvec(bbox: BBOX, run_id: str, scales: List[int]) -> List[ProjectLayer]:
     layers = list()
@@ -119,7 +144,13 @@ def bc_hillshade(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
 
 
 def bc_resource_roads(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
-    bc_resource_road_files = bc_resource_roads_provisioner(bbox, run_id)
+    bc_resource_road_files = provision_cached(
+        bc_resource_roads_provisioner,
+        bc_resource_roads_cache_dir_name,
+        bc_resource_roads_version(),
+        bbox,
+        run_id,
+    )
     return [
         ProjectLayer(
             path=bc_resource_road_files[0],
@@ -132,7 +163,9 @@ def bc_resource_roads(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
 
 
 def trails(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
-    trails_files = trails_provisioner(bbox, run_id)
+    trails_files = provision_cached(
+        trails_provisioner, trails_cache_dir_name, trails_version(), bbox, run_id
+    )
     return [
         ProjectLayer(
             path=trails_files[0],
@@ -147,7 +180,13 @@ def trails(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
 def shelters(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
     return [
         ProjectLayer(
-            path=shelters_provisioner(bbox, run_id)[0],
+            path=provision_cached(
+                shelters_provisioner,
+                shelters_cache_dir_name,
+                shelters_version(),
+                bbox,
+                run_id,
+            )[0],
             style_class="shelters",
             crs_code=shelters_crs_code,
             type=shelters_output_type,
@@ -158,7 +197,13 @@ def shelters(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
 def bc_waterways(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
     return [
         ProjectLayer(
-            path=bc_waterways_provisioner(bbox, run_id)[0],
+            path=provision_cached(
+                bc_waterways_provisioner,
+                bc_waterways_cache_dir_name,
+                bc_waterways_version(),
+                bbox,
+                run_id,
+            )[0],
             style_class="waterways",
             crs_code=bc_waterways_crs_code,
             type=bc_waterways_output_type,
@@ -169,7 +214,13 @@ def bc_waterways(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
 def bc_wetlands(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
     return [
         ProjectLayer(
-            path=bc_wetlands_provisioner(bbox, run_id)[0],
+            path=provision_cached(
+                bc_wetlands_provisioner,
+                bc_wetlands_cache_dir_name,
+                bc_wetlands_version(),
+                bbox,
+                run_id,
+            )[0],
             style_class="wetlands",
             crs_code=bc_wetlands_crs_code,
             type=bc_wetlands_output_type,
@@ -252,3 +303,49 @@ def bc_parks(bbox: BBOX, run_id: str) -> List[ProjectLayer]:
             type=bc_parks_output_type,
         )
     ]
+
+
+def estimate_sources(
+    bbox: BBOX, providers: Sequence[LayerProvider]
+) -> List[SourceEstimate]:
+    """
+    What each provider would fetch or generate for bbox, without doing any of the work.
+    Sources that only clip local data count one clip.
+    """
+    estimates = list()
+    for provider in providers:
+        estimator = _ESTIMATORS.get(getattr(provider, "func", provider))
+        if estimator:
+            estimates.append(estimator(bbox, **getattr(provider, "keywords", dict())))
+        else:
+            estimates.append(
+                SourceEstimate(
+                    source=get_provider_name(provider), unit="clips", total=1
+                )
+            )
+    return estimates
+
+
+def _estimate_clip(
+    cache_dir_name: str, version: Callable[[], str]
+) -> Callable[[BBOX], SourceEstimate]:
+    return lambda bbox: SourceEstimate(
+        source=cache_dir_name,
+        unit="clips",
+        total=1,
+        cached=1 if is_cached(cache_dir_name, version(), bbox) else 0,
+    )
+
+
+_ESTIMATORS: Dict[Callable, Callable[..., SourceEstimate]] = {
+    canvec: lambda bbox, scales: canvec_wms_estimate(bbox, scales),
+    bc_topo: bc_topo_20000_estimate,
+    bc_hillshade: bc_hillshade_estimate,
+    bc_resource_roads: _estimate_clip(
+        bc_resource_roads_cache_dir_name, bc_resource_roads_version
+    ),
+    trails: _estimate_clip(trails_cache_dir_name, trails_version),
+    shelters: _estimate_clip(shelters_cache_dir_name, shelters_version),
+    bc_waterways: _estimate_clip(bc_waterways_cache_dir_name, bc_waterways_version),
+    bc_wetlands: _estimate_clip(bc_wetlands_cache_dir_name, bc_wetlands_version),
+}
@@ -7,12 +7,14 @@ from typing import List
 from pydantic import BaseModel
 
 from app.common.bbox import BBOX
+from app.common.trace import span
 from app.common.util import (
     get_style_path,
     get_result_path,
     get_export_path,
-    delete_directory_contents,
+    get_named_lock,
     remove_intermediaries,
+    silent_delete,
 )
 from app.tilemill.api_client import create_or_update_project, request_export
 from app.tilemill.ProjectLayer import ProjectLayer
@@ -21,8 +23,9 @@ from app.tilemill.ProjectProperties import ProjectProperties
 
 
 class GenerateResult(BaseModel):
-    tile_dir: str
-    tile_paths: List[str]
+    tile_dir: str = None
+    tile_paths: List[str] = list()
+    mbtiles_path: str = None
 
 
 def generate_tiles(
@@ -33,7 +36,12 @@ def generate_tiles(
     zoom_min: int,
     zoom_max: int,
     run_id: str,
+    extract: bool = True,
 ) -> GenerateResult:
+    """
+    Renders tiles with TileMill. By default they are extracted by mb-util to a z/x/y.png tree,
+    with extract False the export is left for the caller to read and remove.
+    """
     logging.info("Generating tiles from source data")
     stylesheet_content = list()
     for stylesheet in stylesheets:
@@ -47,31 +55,42 @@ def generate_tiles(
             layers=layers, mss=stylesheet_content, **dict(project_properties)
         )
         tilemill_url = os.environ.get("TILEMILL_URL", "http://tilemill:20009")
-        create_or_update_project(tilemill_url, project_creation_properties)
-        export_file = request_export(tilemill_url, project_properties)
+        # the TileMill project is identified by profile name so concurrent cells of one profile must take turns
+        with get_named_lock(f"tilemill-{profile_name}"):
+            with span("tilemill.project", layers=len(layers)):
+                create_or_update_project(tilemill_url, project_creation_properties)
+            # includes the time spent polling TileMill until the export is complete
+            with span("tilemill.export") as export_span:
+                export_file = request_export(tilemill_url, project_properties)
+                export_span.add(size=os.path.getsize(get_export_path((export_file,))))
+        if not extract:
+            return GenerateResult(mbtiles_path=get_export_path((export_file,)))
         result_dir_temp = get_result_path((run_id,))
         logging.info("Calling mb-util")
-        _, stderr = subprocess.Popen(
-            [
-                os.environ["MBUTIL_LOCATION"],
-                get_export_path((export_file,)),
-                result_dir_temp,
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        ).communicate()
+        with span("mbutil") as mbutil_span:
+            _, stderr = subprocess.Popen(
+                [
+                    os.environ["MBUTIL_LOCATION"],
+                    get_export_path((export_file,)),
+                    result_dir_temp,
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            ).communicate()
+            tile_paths = [
+                filename
+                for filename in glob.iglob(
+                    os.path.join(result_dir_temp, "**", "*.png"), recursive=True
+                )
+            ]
+            mbutil_span.add(
+                items=len(tile_paths),
+                size=os.path.getsize(get_export_path((export_file,))),
+            )
         if stderr:
             for line in stderr.decode("ascii").split(os.linesep):
                 logging.warn(line)
         logging.info("mb-util complete")
         if remove_intermediaries():
-            delete_directory_contents(get_export_path())
-        return GenerateResult(
-            tile_dir=result_dir_temp,
-            tile_paths=[
-                filename
-                for filename in glob.iglob(
-                    os.path.join(result_dir_temp, "**", "*.png"), recursive=True
-                )
-            ],
-        )
+            silent_delete(get_export_path((export_file,)))
+        return GenerateResult(tile_dir=result_dir_temp, tile_paths=tile_paths)
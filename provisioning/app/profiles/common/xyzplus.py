@@ -1,17 +1,22 @@
-import os
 import logging
 
-from typing import Final, List
-from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Final, List, Sequence
 
 from app.common.bbox import BBOX
-from app.common.util import get_result_path
-from app.common.xyz import merge_tiles, get_edge_tiles
-from app.tilemill.ProjectLayer import ProjectLayer
-from app.profiles.common.tilemill import generate_tiles
-from app.sources.xyz_service import provision as xyz_provisioner
+from app.common.trace import propagate
+from app.common.util import get_result_path, remove_intermediaries, silent_delete
+from app.common.xyz import composite_mbtiles, get_render_zoom_min
 from app.profiles.common.result import add_or_update
-from app.common.xyz import transparent_clip_to_bbox
+from app.profiles.common.source_engine import LayerProvider, provision_layers
+from app.profiles.common.sources import estimate_sources
+from app.sources.common.estimate import SourceEstimate
+from app.profiles.common.tilemill import generate_tiles
+from app.record.provenance import get_inputs
+from app.sources.xyz_service import (
+    provision as xyz_provisioner,
+    estimate as xyz_estimate,
+)
 
 
 ZOOM_MIN: Final = 0
@@ -26,54 +31,76 @@ def execute(
     profile_name: str,
     profile_zoom_max: int,
     profile_zoom_min: int,
-    layers: List[ProjectLayer],
+    sources: Sequence[LayerProvider],
     extra_styles: List[str] = list(),
 ) -> None:
-    xyz_result = xyz_provisioner(
-        bbox,
-        xyz_url,
-        profile_zoom_min,
-        profile_zoom_max,
-        ["image/png", "image/jpeg"],
-        OUTPUT_FORMAT,
-    )
+    # only the top zooms are rendered and fetched, those below are built from them
+    render_zoom_min = get_render_zoom_min(profile_zoom_min, profile_zoom_max)
+    # the xyz base is network-bound so fetch it while the overlay sources are provisioned
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="xyz") as executor:
+        xyz_future = executor.submit(
+            propagate(xyz_provisioner),
+            bbox,
+            xyz_url,
+            render_zoom_min,
+            profile_zoom_max,
+            ["image/png", "image/jpeg"],
+            OUTPUT_FORMAT,
+        )
+        layers = provision_layers(bbox, run_id, sources)
+        xyz_result = xyz_future.result()
+    stylesheets = ["common", profile_name] + extra_styles
     generate_result = generate_tiles(
         layers,
-        ["common", profile_name] + extra_styles,
+        stylesheets,
         bbox,
         profile_name,
-        profile_zoom_min,
+        render_zoom_min,
         profile_zoom_max,
         run_id,
+        False,
     )
-    xyz_tiles_merged = list()
-    logging.info(
-        f"Merging {len(generate_result.tile_paths)} generated tile(s) to xyz base"
+    result_dir = get_result_path((profile_name,))
+    inputs = get_inputs(stylesheets, sources, xyz_url)
+    # composited without stitching into a staging directory, add_or_update stitches against the result
+    # and publishes through the merge journal so a crash mid-publish is rolled forward on the next start
+    staging_dir = get_result_path((run_id,))
+    logging.info("Compositing generated tiles over xyz base")
+    written = composite_mbtiles(
+        generate_result.mbtiles_path,
+        xyz_result.tile_dir,
+        staging_dir,
+        bbox,
+        render_zoom_min,
+        profile_zoom_max,
     )
-    path_tuples = [
-        (
-            data_tile.replace(generate_result.tile_dir, xyz_result.tile_dir),
-            data_tile,
-            data_tile,
-        )
-        for data_tile in generate_result.tile_paths
-    ]
-    merge_tiles(path_tuples)
-    xyz_tiles_merged = [path_tuple[0] for path_tuple in path_tuples]
-    logging.info("Collecting non-generated xyz tiles")
-    for xyz_tile in xyz_result.tile_paths:
-        if xyz_tile not in xyz_tiles_merged:
-            xyz_copy_path = xyz_tile.replace(
-                xyz_result.tile_dir, generate_result.tile_dir
-            )
-            os.makedirs(os.path.dirname(xyz_copy_path), exist_ok=True)
-            copyfile(xyz_tile, xyz_copy_path)
-    transparent_clip_to_bbox(
-        [
-            os.path.join(generate_result.tile_dir, tile_path)
-            for tile_path in get_edge_tiles(generate_result.tile_dir)
-        ],
+    logging.info(f"{written} tile(s) composited")
+    add_or_update(
+        staging_dir,
+        result_dir,
         bbox,
+        profile_zoom_min,
+        profile_zoom_max,
+        run_id=run_id,
+        inputs=inputs,
     )
-    logging.info("Transferring combined tile set to result directory")
-    add_or_update(generate_result.tile_dir, get_result_path((profile_name,)))
+    if remove_intermediaries():
+        silent_delete(generate_result.mbtiles_path)
+
+
+def estimate(
+    bbox: BBOX,
+    xyz_url: str,
+    profile_zoom_max: int,
+    profile_zoom_min: int,
+    sources: Sequence[LayerProvider],
+) -> List[SourceEstimate]:
+    return [
+        xyz_estimate(
+            bbox,
+            xyz_url,
+            get_render_zoom_min(profile_zoom_min, profile_zoom_max),
+            profile_zoom_max,
+            OUTPUT_FORMAT,
+        )
+    ] + estimate_sources(bbox, sources)
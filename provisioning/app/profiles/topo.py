@@ -1,12 +1,16 @@
 import os
 import logging
 
-from typing import Dict, Final
+from functools import partial
+from typing import Dict, Final, List
 
 from app.common.bbox import BBOX
 from app.common.util import get_result_path
 from app.profiles.common.result import add_or_update
+from app.record.provenance import get_inputs
+from app.sources.common.estimate import SourceEstimate
 from app.profiles.common.sources import (
+    estimate_sources,
     canvec,
     bc_topo,
     bc_hillshade,
@@ -14,40 +18,76 @@ from app.profiles.common.sources import (
     trails,
     shelters,
 )
+from app.profiles.common.source_engine import provision_layers
 from app.profiles.common.tilemill import generate_tiles
-from app.common.xyz import transparent_clip_to_bbox, get_edge_tiles
+from app.common.xyz import (
+    transparent_clip_to_bbox,
+    get_edge_tiles,
+    get_render_zoom_min,
+)
 
 
 NAME: Final = "topo"
 ZOOM_MIN: Final = 0
 ZOOM_MAX: Final = 15
 OUTPUT_FORMAT: Final = "png"
+STYLESHEETS: Final = ("common", "topo")
+# scales taken from https://www.maptiler.com/google-maps-coordinates-tile-bounds-projection/
+CANVEC_SCALES: Final = (
+    9244667,
+    4622334,
+    2311167,
+    1155583,
+    577792,
+    288896,
+    144448,
+    72224,
+    36112,
+)
+SOURCES: Final = (
+    partial(canvec, scales=CANVEC_SCALES),
+    bc_topo,
+    bc_hillshade,
+    bc_resource_roads,
+    trails,
+    shelters,
+)
 
 
-# scales taken from https://www.maptiler.com/google-maps-coordinates-tile-bounds-projection/
 def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
-    layers = (
-        canvec(
-            bbox,
-            run_id,
-            (9244667, 4622334, 2311167, 1155583, 577792, 288896, 144448, 72224, 36112),
-        )
-        + bc_topo(bbox, run_id)
-        + bc_hillshade(bbox, run_id)
-        + bc_resource_roads(bbox, run_id)
-        + trails(bbox, run_id)
-        + shelters(bbox, run_id)
-    )
+    layers = provision_layers(bbox, run_id, SOURCES)
+    # zooms below the rendered band are built from it by add_or_update
     generate_result = generate_tiles(
-        layers, ["common", "topo"], bbox, NAME, ZOOM_MIN, ZOOM_MAX, run_id
+        layers,
+        list(STYLESHEETS),
+        bbox,
+        NAME,
+        get_render_zoom_min(ZOOM_MIN, ZOOM_MAX),
+        ZOOM_MAX,
+        run_id,
     )
     transparent_clip_to_bbox(
         [
             os.path.join(generate_result.tile_dir, tile_path)
-            for tile_path in get_edge_tiles(generate_result.tile_dir)
+            for tile_path in get_edge_tiles(
+                bbox, ZOOM_MIN, ZOOM_MAX, generate_result.tile_dir
+            )
         ],
         bbox,
         False,
     )
     logging.info("Transferring generated tile set to result directory")
-    add_or_update(generate_result.tile_dir, get_result_path((NAME,)), False)
+    add_or_update(
+        generate_result.tile_dir,
+        get_result_path((NAME,)),
+        bbox,
+        ZOOM_MIN,
+        ZOOM_MAX,
+        False,
+        run_id,
+        get_inputs(STYLESHEETS, SOURCES),
+    )
+
+
+def estimate(bbox: BBOX, args: Dict[str, object] = dict()) -> List[SourceEstimate]:
+    return estimate_sources(bbox, SOURCES)
@@ -1,14 +1,23 @@
 import logging
 import os
 
-from shutil import copyfile
-from typing import Dict, Final
+from typing import Dict, Final, List
 
 from app.common.bbox import BBOX
-from app.common.util import get_result_path, get_run_data_path
-from app.common.xyz import get_edge_tiles, transparent_clip_to_bbox
+from app.common.trace import span
+from app.common.util import get_result_path, get_run_data_path, link_or_copy
+from app.common.xyz import (
+    get_edge_tiles,
+    get_render_zoom_min,
+    transparent_clip_to_bbox,
+)
 from app.profiles.common.result import add_or_update
-from app.sources.xyz_service import provision as xyz_provisioner
+from app.record.provenance import get_inputs
+from app.sources.common.estimate import SourceEstimate
+from app.sources.xyz_service import (
+    provision as xyz_provisioner,
+    estimate as xyz_estimate,
+)
 
 
 NAME: Final = "xyz"
@@ -18,26 +27,51 @@ OUTPUT_FORMAT: Final = "png"
 
 
 def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
+    # zooms below the fetched band are built from it by add_or_update
     xyz_result = xyz_provisioner(
         bbox,
         args["xyz_url"],
-        ZOOM_MIN,
+        get_render_zoom_min(ZOOM_MIN, ZOOM_MAX),
         ZOOM_MAX,
         ["image/png", "image/jpeg"],
         OUTPUT_FORMAT,
     )
     tmp_dir = get_run_data_path(run_id, (NAME,))
-    tmp_tile_paths = list()
     logging.info(
-        f"Copying {len(xyz_result.tile_paths)} {NAME} tiles to tmp dir for edge clipping"
+        f"Staging {len(xyz_result.tile_paths)} {NAME} tiles in tmp dir for edge clipping"
     )
-    for tile_path in xyz_result.tile_paths:
-        tmp_tile_path = tile_path.replace(xyz_result.tile_dir, tmp_dir)
-        tmp_tile_paths.append(tmp_tile_path)
-        os.makedirs(os.path.dirname(tmp_tile_path), exist_ok=True)
-        copyfile(tile_path, tmp_tile_path)
+    # cached tiles are linked, clipping replaces the edge tiles it modifies so the cache is never changed
+    with span("xyz.copy") as copy_span:
+        for tile_path in xyz_result.tile_paths:
+            tmp_tile_path = tile_path.replace(xyz_result.tile_dir, tmp_dir)
+            os.makedirs(os.path.dirname(tmp_tile_path), exist_ok=True)
+            linked = link_or_copy(tile_path, tmp_tile_path)
+            copy_span.add(items=1, size=0 if linked else os.path.getsize(tmp_tile_path))
     transparent_clip_to_bbox(
-        [os.path.join(tmp_dir, tile_path) for tile_path in get_edge_tiles(tmp_dir)],
+        [
+            os.path.join(tmp_dir, tile_path)
+            for tile_path in get_edge_tiles(bbox, ZOOM_MIN, ZOOM_MAX, tmp_dir)
+        ],
         bbox,
     )
-    add_or_update(tmp_dir, get_result_path((NAME,)))
+    add_or_update(
+        tmp_dir,
+        get_result_path((NAME,)),
+        bbox,
+        ZOOM_MIN,
+        ZOOM_MAX,
+        run_id=run_id,
+        inputs=get_inputs(xyz_url=args["xyz_url"]),
+    )
+
+
+def estimate(bbox: BBOX, args: Dict[str, object] = dict()) -> List[SourceEstimate]:
+    return [
+        xyz_estimate(
+            bbox,
+            args["xyz_url"],
+            get_render_zoom_min(ZOOM_MIN, ZOOM_MAX),
+            ZOOM_MAX,
+            OUTPUT_FORMAT,
+        )
+    ]
@@ -1,11 +1,13 @@
-from typing import Dict, Final
+from typing import Dict, Final, List
 
 from app.common.bbox import BBOX
 from app.profiles.common.xyzplus import (
     execute as xyzplus_execute,
+    estimate as xyzplus_estimate,
     ZOOM_MIN,
     OUTPUT_FORMAT as xyz_output_format,
 )
+from app.sources.common.estimate import SourceEstimate
 from app.profiles.common.sources import (
     bc_resource_roads,
     trails,
@@ -21,6 +23,16 @@ from app.profiles.common.sources import (
 NAME: Final = "xyzhunting"
 ZOOM_MAX: Final = 16
 OUTPUT_FORMAT: Final = xyz_output_format
+SOURCES: Final = (
+    bc_parks,
+    bc_waterways,
+    bc_wetlands,
+    bc_parcels,
+    bc_rec_sites,
+    bc_resource_roads,
+    trails,
+    shelters,
+)
 
 
 def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
@@ -31,13 +43,10 @@ def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
         NAME,
         ZOOM_MAX,
         ZOOM_MIN,
-        bc_parks(bbox, run_id)
-        + bc_waterways(bbox, run_id)
-        + bc_wetlands(bbox, run_id)
-        + bc_parcels(bbox, run_id)
-        + bc_rec_sites(bbox, run_id)
-        + bc_resource_roads(bbox, run_id)
-        + trails(bbox, run_id)
-        + shelters(bbox, run_id),
+        SOURCES,
         ["common-summer"],
     )
+
+
+def estimate(bbox: BBOX, args: Dict[str, object] = dict()) -> List[SourceEstimate]:
+    return xyzplus_estimate(bbox, args["xyz_url"], ZOOM_MAX, ZOOM_MIN, SOURCES)
@@ -1,12 +1,14 @@
-from typing import Dict, Final
+from typing import Dict, Final, List
 
 from app.common.bbox import BBOX
 from app.profiles.common.xyzplus import (
     execute as xyzplus_execute,
+    estimate as xyzplus_estimate,
     ZOOM_MAX,
     ZOOM_MIN,
     OUTPUT_FORMAT as xyz_output_format,
 )
+from app.sources.common.estimate import SourceEstimate
 from app.profiles.common.sources import (
     bc_resource_roads,
     trails,
@@ -18,6 +20,13 @@ from app.profiles.common.sources import (
 
 NAME: Final = "xyzsummer"
 OUTPUT_FORMAT: Final = xyz_output_format
+SOURCES: Final = (
+    bc_waterways,
+    bc_wetlands,
+    bc_resource_roads,
+    trails,
+    shelters,
+)
 
 
 def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
@@ -28,10 +37,10 @@ def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
         NAME,
         ZOOM_MAX,
         ZOOM_MIN,
-        bc_waterways(bbox, run_id)
-        + bc_wetlands(bbox, run_id)
-        + bc_resource_roads(bbox, run_id)
-        + trails(bbox, run_id)
-        + shelters(bbox, run_id),
+        SOURCES,
         ["common-summer"],
     )
+
+
+def estimate(bbox: BBOX, args: Dict[str, object] = dict()) -> List[SourceEstimate]:
+    return xyzplus_estimate(bbox, args["xyz_url"], ZOOM_MAX, ZOOM_MIN, SOURCES)
@@ -1,12 +1,14 @@
-from typing import Dict, Final
+from typing import Dict, Final, List
 
 from app.common.bbox import BBOX
 from app.profiles.common.xyzplus import (
     execute as xyzplus_execute,
+    estimate as xyzplus_estimate,
     ZOOM_MAX,
     ZOOM_MIN,
     OUTPUT_FORMAT as xyz_output_format,
 )
+from app.sources.common.estimate import SourceEstimate
 from app.profiles.common.sources import (
     bc_resource_roads,
     trails,
@@ -20,6 +22,15 @@ from app.profiles.common.sources import (
 
 NAME = "xyzwinter"
 OUTPUT_FORMAT: Final = xyz_output_format
+SOURCES: Final = (
+    bc_ates_zones,
+    bc_ates_avpaths,
+    bc_ates_poi,
+    bc_ates_dec_points,
+    bc_resource_roads,
+    trails,
+    shelters,
+)
 
 
 def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
@@ -30,11 +41,9 @@ def execute(bbox: BBOX, run_id: str, args: Dict[str, object] = dict()) -> None:
         NAME,
         ZOOM_MAX,
         ZOOM_MIN,
-        bc_ates_zones(bbox, run_id)
-        + bc_ates_avpaths(bbox, run_id)
-        + bc_ates_poi(bbox, run_id)
-        + bc_ates_dec_points(bbox, run_id)
-        + bc_resource_roads(bbox, run_id)
-        + trails(bbox, run_id)
-        + shelters(bbox, run_id),
+        SOURCES,
     )
+
+
+def estimate(bbox: BBOX, args: Dict[str, object] = dict()) -> List[SourceEstimate]:
+    return xyzplus_estimate(bbox, args["xyz_url"], ZOOM_MAX, ZOOM_MIN, SOURCES)
@@ -0,0 +1,177 @@
+import math
+
+from collections import defaultdict
+from typing import Dict, Final, Iterable, List, Set, Tuple
+
+from app.common.bbox import BBOX
+
+BUCKET_SIZE: Final = 1.0
+
+
+class CoverageIndex:
+    """
+    In-memory index of recorded runs for one result directory.
+    Exact matches are a set lookup, spatial queries only visit runs sharing a bucket of the bucket grid.
+    """
+
+    def __init__(self, runs: Iterable[BBOX] = list()):
+        self.runs: List[BBOX] = list()
+        self.wkts: Set[str] = set()
+        self.buckets: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for run in runs:
+            self.add(run)
+
+    def add(self, bbox: BBOX) -> None:
+        run_index = len(self.runs)
+        self.runs.append(bbox)
+        self.wkts.add(bbox.get_wkt())
+        for bucket in _get_buckets(bbox):
+            self.buckets[bucket].append(run_index)
+
+    def contains_exact(self, bbox: BBOX) -> bool:
+        return bbox.get_wkt() in self.wkts
+
+    def intersecting(self, bbox: BBOX) -> List[BBOX]:
+        """Recorded runs that share some area with bbox, runs that only touch it are excluded"""
+        run_indexes = set()
+        for bucket in _get_buckets(bbox):
+            run_indexes.update(self.buckets.get(bucket, list()))
+        return [
+            self.runs[run_index]
+            for run_index in sorted(run_indexes)
+            if _overlaps(self.runs[run_index], bbox)
+        ]
+
+    def covered_fraction(self, bbox: BBOX) -> float:
+        """Proportion of bbox's area covered by the union of recorded runs, 0 to 1"""
+        bbox_area = (bbox.max_x - bbox.min_x) * (bbox.max_y - bbox.min_y)
+        if bbox_area <= 0:
+            return 1.0 if self.contains_exact(bbox) else 0.0
+        clipped = [
+            (
+                max(run.min_x, bbox.min_x),
+                max(run.min_y, bbox.min_y),
+                min(run.max_x, bbox.max_x),
+                min(run.max_y, bbox.max_y),
+            )
+            for run in self.intersecting(bbox)
+        ]
+        return min(1.0, _union_area(clipped) / bbox_area)
+
+    def is_covered(self, bbox: BBOX) -> bool:
+        return self.contains_exact(bbox) or math.isclose(
+            self.covered_fraction(bbox), 1.0, rel_tol=1e-9
+        )
+
+    def uncovered(self, bbox: BBOX) -> List[BBOX]:
+        """
+        Rectangles that together cover the part of bbox outside every recorded run.
+        Uncovered strips of adjacent slabs with the same y extent are joined so there are few rectangles.
+        """
+        if self.contains_exact(bbox):
+            return list()
+        clipped = [
+            (
+                max(run.min_x, bbox.min_x),
+                max(run.min_y, bbox.min_y),
+                min(run.max_x, bbox.max_x),
+                min(run.max_y, bbox.max_y),
+            )
+            for run in self.intersecting(bbox)
+        ]
+        xs = sorted(
+            set(
+                [bbox.min_x, bbox.max_x]
+                + [rect[0] for rect in clipped]
+                + [rect[2] for rect in clipped]
+            )
+        )
+        remainder, open_gaps = list(), dict()
+        for slab_min_x, slab_max_x in zip(xs, xs[1:]):
+            gaps = _get_gaps(
+                [
+                    (rect[1], rect[3])
+                    for rect in clipped
+                    if rect[0] <= slab_min_x and rect[2] >= slab_max_x
+                ],
+                bbox.min_y,
+                bbox.max_y,
+            )
+            for gap in [gap for gap in open_gaps if gap not in gaps]:
+                remainder.append(
+                    BBOX(
+                        min_x=open_gaps.pop(gap),
+                        min_y=gap[0],
+                        max_x=slab_min_x,
+                        max_y=gap[1],
+                    )
+                )
+            for gap in gaps:
+                open_gaps.setdefault(gap, slab_min_x)
+        for gap, min_x in open_gaps.items():
+            remainder.append(
+                BBOX(min_x=min_x, min_y=gap[0], max_x=bbox.max_x, max_y=gap[1])
+            )
+        return remainder
+
+
+def _get_buckets(bbox: BBOX) -> List[Tuple[int, int]]:
+    return [
+        (bucket_x, bucket_y)
+        for bucket_x in range(
+            math.floor(bbox.min_x / BUCKET_SIZE),
+            math.floor(bbox.max_x / BUCKET_SIZE) + 1,
+        )
+        for bucket_y in range(
+            math.floor(bbox.min_y / BUCKET_SIZE),
+            math.floor(bbox.max_y / BUCKET_SIZE) + 1,
+        )
+    ]
+
+
+def _overlaps(a: BBOX, b: BBOX) -> bool:
+    return (
+        a.min_x < b.max_x
+        and a.max_x > b.min_x
+        and a.min_y < b.max_y
+        and a.max_y > b.min_y
+    )
+
+
+def _get_gaps(
+    intervals: List[Tuple[float, float]], min_y: float, max_y: float
+) -> List[Tuple[float, float]]:
+    gaps, current_y = list(), min_y
+    for interval_min_y, interval_max_y in sorted(intervals):
+        if interval_min_y > current_y:
+            gaps.append((current_y, interval_min_y))
+        current_y = max(current_y, interval_max_y)
+    if current_y < max_y:
+        gaps.append((current_y, max_y))
+    return gaps
+
+
+def _union_area(rects: List[Tuple[float, float, float, float]]) -> float:
+    # sweep across x, summing the merged y extent of the rectangles spanning each slab
+    xs = sorted(set([rect[0] for rect in rects] + [rect[2] for rect in rects]))
+    area = 0.0
+    for slab_min_x, slab_max_x in zip(xs, xs[1:]):
+        intervals = sorted(
+            [
+                (rect[1], rect[3])
+                for rect in rects
+                if rect[0] <= slab_min_x and rect[2] >= slab_max_x
+            ]
+        )
+        covered_y, current_min_y, current_max_y = 0.0, None, None
+        for interval_min_y, interval_max_y in intervals:
+            if current_max_y is None or interval_min_y > current_max_y:
+                if current_max_y is not None:
+                    covered_y += current_max_y - current_min_y
+                current_min_y, current_max_y = interval_min_y, interval_max_y
+            else:
+                current_max_y = max(current_max_y, interval_max_y)
+        if current_max_y is not None:
+            covered_y += current_max_y - current_min_y
+        area += covered_y * (slab_max_x - slab_min_x)
+    return area
@@ -0,0 +1,187 @@
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from enum import Enum
+from hashlib import md5
+from pydantic import BaseModel
+from typing import Dict, Final, List
+
+from app.bbox_provisioner import ProvisionArg, ProvisionResult
+from app.common.util import get_base_path
+
+JOB_QUEUE_FILE_NAME: Final = "jobs.sqlite"
+
+
+class JobState(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    job_id: int
+    arg: ProvisionArg
+
+
+def get_job_queue_path() -> str:
+    return os.environ.get(
+        "BVSAR_JOB_QUEUE_LOCATION", os.path.join(get_base_path(), JOB_QUEUE_FILE_NAME)
+    )
+
+
+def get_plan_fingerprint(areas_path: str, settings: Dict[str, object]) -> str:
+    # a plan is only reusable while the areas and the settings that shape it are unchanged
+    areas_stat = os.stat(areas_path)
+    return md5(
+        repr(
+            (
+                os.path.abspath(areas_path),
+                areas_stat.st_size,
+                areas_stat.st_mtime_ns,
+                sorted(settings.items()),
+            )
+        ).encode("UTF-8")
+    ).hexdigest()
+
+
+class JobQueue:
+    """
+    Persists a run plan so an interrupted or batch-limited run resumes where it stopped.
+    Not thread-safe, state changes are expected from the scheduling thread only.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            create table if not exists plans (
+                plan_id text primary key,
+                fingerprint text not null,
+                created_at real not null,
+                completed_at real
+            );
+            create table if not exists jobs (
+                job_id integer primary key autoincrement,
+                plan_id text not null references plans(plan_id),
+                seq integer not null,
+                arg text not null,
+                state text not null,
+                attempts integer not null default 0,
+                started_at real,
+                finished_at real,
+                duration real,
+                result text,
+                error text
+            );
+            create index if not exists jobs_plan_state on jobs (plan_id, state, seq);
+            """
+        )
+
+    def resume(self, fingerprint: str) -> str:
+        """
+        Returns the id of an incomplete plan with this fingerprint, or None if there isn't one.
+        Jobs that were running when the last run stopped, or that failed, become pending again.
+        """
+        row = self.connection.execute(
+            "select plan_id from plans where fingerprint = ? and completed_at is null order by created_at desc limit 1",
+            (fingerprint,),
+        ).fetchone()
+        if row is None:
+            return None
+        plan_id = row[0]
+        with self.connection:
+            self.connection.execute(
+                "update jobs set state = ? where plan_id = ? and state in (?, ?)",
+                (
+                    JobState.PENDING.value,
+                    plan_id,
+                    JobState.RUNNING.value,
+                    JobState.FAILED.value,
+                ),
+            )
+        counts = self.get_state_counts(plan_id)
+        logging.info(f"Resuming plan {plan_id}: {counts}")
+        return plan_id
+
+    def create(self, fingerprint: str, provision_args: List[ProvisionArg]) -> str:
+        plan_id = str(uuid.uuid4())
+        with self.connection:
+            # only the newest plan for a fingerprint is ever resumed, earlier ones are abandoned
+            self.connection.execute(
+                "update plans set completed_at = ? where fingerprint = ? and completed_at is null",
+                (time.time(), fingerprint),
+            )
+            self.connection.execute(
+                "insert into plans (plan_id, fingerprint, created_at) values (?, ?, ?)",
+                (plan_id, fingerprint, time.time()),
+            )
+            self.connection.executemany(
+                "insert into jobs (plan_id, seq, arg, state) values (?, ?, ?, ?)",
+                [
+                    (plan_id, seq, provision_arg.json(), JobState.PENDING.value)
+                    for seq, provision_arg in enumerate(provision_args)
+                ],
+            )
+        logging.info(f"Created plan {plan_id} with {len(provision_args)} job(s)")
+        return plan_id
+
+    def get_pending(self, plan_id: str) -> List[Job]:
+        return [
+            Job(job_id=job_id, arg=ProvisionArg.parse_raw(arg))
+            for job_id, arg in self.connection.execute(
+                "select job_id, arg from jobs where plan_id = ? and state = ? order by seq",
+                (plan_id, JobState.PENDING.value),
+            )
+        ]
+
+    def get_state_counts(self, plan_id: str) -> Dict[str, int]:
+        return {
+            state: count
+            for state, count in self.connection.execute(
+                "select state, count(*) from jobs where plan_id = ? group by state",
+                (plan_id,),
+            )
+        }
+
+    def mark_running(self, job_id: int) -> None:
+        with self.connection:
+            self.connection.execute(
+                "update jobs set state = ?, attempts = attempts + 1, started_at = ?, finished_at = null, duration = null, error = null where job_id = ?",
+                (JobState.RUNNING.value, time.time(), job_id),
+            )
+
+    def mark_done(self, job_id: int, result: ProvisionResult) -> None:
+        self._mark_finished(job_id, JobState.DONE, result.name, None)
+
+    def mark_failed(self, job_id: int, error: Exception) -> None:
+        self._mark_finished(job_id, JobState.FAILED, None, str(error))
+
+    def complete_if_finished(self, plan_id: str) -> bool:
+        counts = self.get_state_counts(plan_id)
+        if any(state != JobState.DONE.value for state in counts.keys()):
+            return False
+        with self.connection:
+            self.connection.execute(
+                "update plans set completed_at = ? where plan_id = ?",
+                (time.time(), plan_id),
+            )
+        logging.info(f"Plan {plan_id} complete")
+        return True
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _mark_finished(
+        self, job_id: int, state: JobState, result: str, error: str
+    ) -> None:
+        finished_at = time.time()
+        with self.connection:
+            self.connection.execute(
+                "update jobs set state = ?, finished_at = ?, duration = ? - started_at, result = ?, error = ? where job_id = ?",
+                (state.value, finished_at, finished_at, result, error, job_id),
+            )
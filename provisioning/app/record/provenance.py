@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+from pydantic import BaseModel
+from typing import Dict, Final, Iterable, Iterator, List, Sequence, Tuple
+
+from app.common.bbox import BBOX
+from app.common.trace import span
+from app.common.util import get_style_path
+from app.profiles.common.source_engine import LayerProvider, get_provider_name
+from app.profiles.common.sources import SOURCE_VERSIONS
+
+PROVENANCE_FILE_NAME: Final = "provenance.sqlite"
+STYLE_INPUT_PREFIX: Final = "style:"
+SOURCE_INPUT_PREFIX: Final = "source:"
+XYZ_INPUT: Final = "xyz"
+# sources fetched from a service for each bbox have no version to compare
+UNVERSIONED: Final = "unversioned"
+
+
+class StaleRun(BaseModel):
+    run_id: str
+    bbox: BBOX
+    tiles: int
+    inputs: Dict[str, str]
+    changed: List[str]
+
+
+def provenance_enabled() -> bool:
+    # replanning reads provenance so re-rendered tiles must record theirs, or they would stay stale
+    return (
+        int(os.environ.get("BVSAR_PROVENANCE", 0)) == 1
+        or int(os.environ.get("BVSAR_REPLAN_STALE", 0)) == 1
+    )
+
+
+def get_provenance_path(result_dir: str) -> str:
+    return os.path.join(result_dir, PROVENANCE_FILE_NAME)
+
+
+def get_stylesheet_fingerprint(stylesheet: str) -> str:
+    with open(get_style_path(f"{stylesheet}.mss"), "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def get_source_fingerprint(provider_name: str) -> str:
+    version = SOURCE_VERSIONS.get(provider_name)
+    return version() if version else UNVERSIONED
+
+
+def get_inputs(
+    stylesheets: Sequence[str] = (),
+    sources: Sequence[LayerProvider] = (),
+    xyz_url: str = None,
+) -> Dict[str, str]:
+    """Fingerprints of everything a profile renders from, as recorded against each run"""
+    inputs = {
+        f"{STYLE_INPUT_PREFIX}{stylesheet}": get_stylesheet_fingerprint(stylesheet)
+        for stylesheet in stylesheets
+    }
+    for provider in sources:
+        provider_name = get_provider_name(provider)
+        inputs[f"{SOURCE_INPUT_PREFIX}{provider_name}"] = get_source_fingerprint(
+            provider_name
+        )
+    if xyz_url:
+        inputs[XYZ_INPUT] = xyz_url
+    return inputs
+
+
+def get_current_fingerprint(name: str) -> str:
+    """The fingerprint an input would be recorded with now, None for the xyz base as it is identified by its url"""
+    if name.startswith(STYLE_INPUT_PREFIX):
+        stylesheet = name[len(STYLE_INPUT_PREFIX) :]
+        if not os.path.exists(get_style_path(f"{stylesheet}.mss")):
+            return "missing"
+        return get_stylesheet_fingerprint(stylesheet)
+    if name.startswith(SOURCE_INPUT_PREFIX):
+        return get_source_fingerprint(name[len(SOURCE_INPUT_PREFIX) :])
+    return None
+
+
+def hash_tiles(
+    tile_dir: str, tile_paths: Iterable[str]
+) -> Iterator[Tuple[int, int, int, str]]:
+    """Yields z, x, y and sha1 of each z/x/y.png, relative to tile_dir, that exists"""
+    for tile_path in tile_paths:
+        try:
+            with open(os.path.join(tile_dir, tile_path), "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+        except FileNotFoundError:
+            continue
+        z, x, y_file = tile_path.split(os.sep)
+        yield int(z), int(x), int(y_file[: -len(".png")]), digest
+
+
+def record_provenance(
+    result_dir: str,
+    run_id: str,
+    bbox: BBOX,
+    inputs: Dict[str, str],
+    tile_dir: str,
+    tile_paths: Iterable[str] = None,
+) -> int:
+    """
+    Records the tiles, z/x/y.png relative to tile_dir or every tile in it when tile_paths is None, as rendered by run_id from inputs.
+    Expected to be called holding result_dir's named lock. Returns the number of tiles recorded.
+    """
+    if tile_paths is None:
+        tile_paths = [
+            os.path.relpath(os.path.join(dirpath, filename), tile_dir)
+            for dirpath, _, filenames in os.walk(tile_dir)
+            for filename in filenames
+            if filename.endswith(".png")
+        ]
+    with span("provenance") as provenance_span:
+        os.makedirs(result_dir, exist_ok=True)
+        with Provenance(get_provenance_path(result_dir)) as provenance:
+            recorded = provenance.record(
+                run_id, bbox, inputs, hash_tiles(tile_dir, tile_paths)
+            )
+        provenance_span.add(items=recorded)
+    return recorded
+
+
+class Provenance:
+    """
+    Which run, and so which stylesheets and source versions, produced each tile of one profile, and the tile's content hash.
+    Runs no tile refers to any more are removed as tiles are recorded.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            create table if not exists runs (
+                run_id text primary key,
+                min_x real not null,
+                min_y real not null,
+                max_x real not null,
+                max_y real not null,
+                recorded_at real not null
+            );
+            create table if not exists run_inputs (
+                run_id text not null references runs(run_id),
+                name text not null,
+                fingerprint text not null,
+                primary key (run_id, name)
+            );
+            create table if not exists tiles (
+                zoom_level integer not null,
+                tile_column integer not null,
+                tile_row integer not null,
+                run_id text not null references runs(run_id),
+                content_hash text not null,
+                primary key (zoom_level, tile_column, tile_row)
+            );
+            create index if not exists tiles_run_id on tiles (run_id);
+            """
+        )
+
+    def __enter__(self) -> "Provenance":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def record(
+        self,
+        run_id: str,
+        bbox: BBOX,
+        inputs: Dict[str, str],
+        tiles: Iterable[Tuple[int, int, int, str]],
+    ) -> int:
+        with self.connection:
+            self.connection.execute(
+                "insert or replace into runs (run_id, min_x, min_y, max_x, max_y, recorded_at) values (?, ?, ?, ?, ?, ?)",
+                (run_id, bbox.min_x, bbox.min_y, bbox.max_x, bbox.max_y, time.time()),
+            )
+            self.connection.executemany(
+                "insert or replace into run_inputs (run_id, name, fingerprint) values (?, ?, ?)",
+                [(run_id, name, fingerprint) for name, fingerprint in inputs.items()],
+            )
+            rows = [(z, x, y, run_id, digest) for z, x, y, digest in tiles]
+            self.connection.executemany(
+                "insert or replace into tiles (zoom_level, tile_column, tile_row, run_id, content_hash) values (?, ?, ?, ?, ?)",
+                rows,
+            )
+            for table in ("run_inputs", "runs"):
+                self.connection.execute(
+                    f"delete from {table} where not exists (select 1 from tiles where tiles.run_id = {table}.run_id)"
+                )
+        return len(rows)
+
+    def get_stale_runs(self) -> List[StaleRun]:
+        """Runs owning at least one tile that were rendered from a stylesheet or source version that has since changed"""
+        current = dict()
+        stale_runs = list()
+        for run_id, min_x, min_y, max_x, max_y, tiles in self.connection.execute(
+            "select runs.run_id, min_x, min_y, max_x, max_y, count(*) from runs join tiles on tiles.run_id = runs.run_id group by runs.run_id order by recorded_at"
+        ).fetchall():
+            inputs = dict(
+                self.connection.execute(
+                    "select name, fingerprint from run_inputs where run_id = ?",
+                    (run_id,),
+                ).fetchall()
+            )
+            changed = list()
+            for name, fingerprint in inputs.items():
+                # fingerprints are looked up once as directory sources walk the whole dataset
+                if name not in current:
+                    current[name] = get_current_fingerprint(name)
+                if current[name] is not None and current[name] != fingerprint:
+                    changed.append(name)
+            if changed:
+                stale_runs.append(
+                    StaleRun(
+                        run_id=run_id,
+                        bbox=BBOX(min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y),
+                        tiles=tiles,
+                        inputs=inputs,
+                        changed=changed,
+                    )
+                )
+        logging.info(f"{len(stale_runs)} run(s) with stale tiles")
+        return stale_runs
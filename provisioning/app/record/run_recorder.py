@@ -1,13 +1,27 @@
+import logging
 import os
 
 from osgeo import ogr, osr
-from typing import Final, List
+from typing import Callable, Dict, Final, List
 
 from app.common.bbox import BBOX
+from app.common.util import get_named_lock
+from app.record.coverage_index import CoverageIndex
 
 
 GPKG_DRIVER: Final = ogr.GetDriverByName("GPKG")
 LAYER_NAME: Final = "areas"
+DISSOLVED_FILE_NAME: Final = "coverage-dissolved.geojson"
+# degrees, around 10m, far below the size of a run
+DISSOLVED_TOLERANCE: Final = 0.0001
+COVERAGE_EXPORT_INTERVAL: Final = int(
+    os.environ.get("BVSAR_COVERAGE_EXPORT_INTERVAL", 50)
+)
+
+# loaded once per result directory and kept current by record_run
+_coverage_indexes: Dict[str, CoverageIndex] = dict()
+# runs recorded per result directory since its coverage was last exported
+_unexported: Dict[str, int] = dict()
 
 
 def _get_gpkg_path(result_dir: str) -> str:
@@ -15,11 +29,42 @@ def _get_gpkg_path(result_dir: str) -> str:
 
 
 def has_prior_run(result_dir: str, bbox: BBOX) -> bool:
-    wkts = [prior_run.get_wkt() for prior_run in get_prior_runs(result_dir)]
-    return bbox.get_wkt() in wkts
+    with get_named_lock(result_dir):
+        return _get_coverage_index(result_dir).contains_exact(bbox)
+
+
+def is_covered(result_dir: str, bbox: BBOX) -> bool:
+    with get_named_lock(result_dir):
+        return _get_coverage_index(result_dir).is_covered(bbox)
+
+
+def get_coverage_fraction(result_dir: str, bbox: BBOX) -> float:
+    with get_named_lock(result_dir):
+        return _get_coverage_index(result_dir).covered_fraction(bbox)
+
+
+def get_uncovered(result_dir: str, bbox: BBOX) -> List[BBOX]:
+    with get_named_lock(result_dir):
+        return _get_coverage_index(result_dir).uncovered(bbox)
+
+
+def get_intersecting_runs(result_dir: str, bbox: BBOX) -> List[BBOX]:
+    with get_named_lock(result_dir):
+        return _get_coverage_index(result_dir).intersecting(bbox)
+
+
+def _get_coverage_index(result_dir: str) -> CoverageIndex:
+    if result_dir not in _coverage_indexes:
+        _coverage_indexes[result_dir] = CoverageIndex(_get_prior_runs(result_dir))
+    return _coverage_indexes[result_dir]
 
 
 def get_prior_runs(result_dir: str) -> List[BBOX]:
+    with get_named_lock(result_dir):
+        return _get_prior_runs(result_dir)
+
+
+def _get_prior_runs(result_dir: str) -> List[BBOX]:
     path = _get_gpkg_path(result_dir)
     if os.path.exists(path):
         datasource = GPKG_DRIVER.Open(path, 0)
@@ -41,6 +86,11 @@ def get_prior_runs(result_dir: str) -> List[BBOX]:
 
 
 def record_run(result_dir: str, bbox: BBOX) -> None:
+    with get_named_lock(result_dir):
+        _record_run(result_dir, bbox)
+
+
+def _record_run(result_dir: str, bbox: BBOX) -> None:
     gpkg_path = _get_gpkg_path(result_dir)
     gpkg_datasource = GPKG_DRIVER.Open(gpkg_path, 1)
     if not gpkg_datasource:
@@ -55,24 +105,75 @@ def record_run(result_dir: str, bbox: BBOX) -> None:
     feature = ogr.Feature(feature_defn)
     feature.SetGeometryDirectly(geometry)
     cumulative_layer.CreateFeature(feature)
+    if result_dir in _coverage_indexes:
+        _coverage_indexes[result_dir].add(bbox)
+    cumulative_layer, gpkg_datasource = None, None
+    # exports are rewritten from every recorded run so they are batched rather than redone per run
+    _unexported[result_dir] = _unexported.get(result_dir, 0) + 1
+    # a profile's first run is exported straight away so the rpi API lists it
+    if _unexported[result_dir] >= COVERAGE_EXPORT_INTERVAL or not os.path.exists(
+        os.path.join(result_dir, "coverage.geojson")
+    ):
+        _export_coverage(result_dir)
+
+
+def export_pending_coverage() -> None:
+    """Writes coverage exports for result directories with runs recorded since their last export"""
+    for result_dir in list(_unexported.keys()):
+        with get_named_lock(result_dir):
+            if result_dir in _unexported:
+                _export_coverage(result_dir)
+
 
-    kml_path = os.path.join(result_dir, "coverage.kml")
-    if os.path.exists(kml_path):
-        os.remove(kml_path)
-    kml_driver = ogr.GetDriverByName("KML")
-    kml_datasource = kml_driver.CreateDataSource(kml_path)
-    kml_datasource.CopyLayer(cumulative_layer, "areas")
-
-    geojson_path = os.path.join(result_dir, "coverage.geojson")
-    if os.path.exists(geojson_path):
-        os.remove(geojson_path)
-    geojson_driver = ogr.GetDriverByName("GeoJSON")
-    geojson_datasource = geojson_driver.CreateDataSource(geojson_path)
-    geojson_datasource.CopyLayer(cumulative_layer, "areas")
-
-    cumulative_layer, gpkg_datasource, kml_datasource, geojson_datasource = (
-        None,
-        None,
-        None,
-        None,
+def _export_coverage(result_dir: str) -> None:
+    logging.info(f"Exporting coverage of {result_dir}")
+    gpkg_datasource = GPKG_DRIVER.Open(_get_gpkg_path(result_dir), 0)
+    cumulative_layer = gpkg_datasource.GetLayerByName(LAYER_NAME)
+    _replace_export(
+        ogr.GetDriverByName("KML"),
+        os.path.join(result_dir, "coverage.kml"),
+        lambda datasource: datasource.CopyLayer(cumulative_layer, "areas"),
+    )
+    _replace_export(
+        ogr.GetDriverByName("GeoJSON"),
+        os.path.join(result_dir, "coverage.geojson"),
+        lambda datasource: datasource.CopyLayer(cumulative_layer, "areas"),
+    )
+    _replace_export(
+        ogr.GetDriverByName("GeoJSON"),
+        os.path.join(result_dir, DISSOLVED_FILE_NAME),
+        lambda datasource: _write_dissolved(datasource, cumulative_layer),
     )
+    cumulative_layer, gpkg_datasource = None, None
+    _unexported.pop(result_dir, None)
+
+
+def _write_dissolved(datasource: ogr.DataSource, cumulative_layer: ogr.Layer) -> None:
+    # thousands of adjoining run rectangles become a few polygons that are quick to load and draw
+    runs = ogr.Geometry(ogr.wkbMultiPolygon)
+    cumulative_layer.ResetReading()
+    while area_feature := cumulative_layer.GetNextFeature():
+        runs.AddGeometry(area_feature.GetGeometryRef())
+    dissolved_layer = datasource.CreateLayer(
+        "areas", cumulative_layer.GetSpatialRef(), ogr.wkbMultiPolygon
+    )
+    feature = ogr.Feature(dissolved_layer.GetLayerDefn())
+    feature.SetGeometry(
+        ogr.ForceToMultiPolygon(
+            runs.UnionCascaded().SimplifyPreserveTopology(DISSOLVED_TOLERANCE)
+        )
+    )
+    dissolved_layer.CreateFeature(feature)
+
+
+def _replace_export(
+    driver: ogr.Driver, path: str, write: Callable[[ogr.DataSource], None]
+) -> None:
+    # written beside the export then swapped in so the rpi API never reads a partial file
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    datasource = driver.CreateDataSource(tmp_path)
+    write(datasource)
+    datasource = None
+    os.replace(tmp_path, path)
@@ -4,141 +4,103 @@ if __name__ == "__main__":
     import logging
     import os
 
-    from osgeo import ogr, osr
-    from typing import List
+    from osgeo import ogr
 
-    from app.common.bbox import BBOX
-    from app.bbox_provisioner import provision, ProvisionArg, ProvisionResult
-    from app.common.util import configure_logging
-    from app.run_strategy import RunStrategy
+    from app.common.util import (
+        complete_interrupted_merges,
+        configure_logging,
+        get_cell_concurrency,
+        get_process_pool,
+        get_result_path,
+        remove_intermediaries,
+    )
+    from app.estimator import estimate_plan, log_estimates, write_estimates
+    from app.planner import (
+        plan,
+        plan_stale,
+        get_bbox_division,
+        get_gridded_bbox_increment,
+    )
+    from app.record.run_recorder import export_pending_coverage
+    from app.record.job_queue import JobQueue, get_job_queue_path, get_plan_fingerprint
+    from app.scheduler import schedule, jobs_from_args
     from app.settings import AREAS_PATH
+    from app.sources.common.clip_cache import clear_clip_cache
+    from app.common.tile_store import deduplicate_enabled, prune_blobs
 
     configure_logging()
 
-    BBOX_DIVISION = float(os.environ.get("BBOX_DIVISION", 0.5))
     BATCH_SIZE = int(os.environ.get("BVSAR_BATCH_SIZE", 0))
+    USE_JOB_QUEUE = int(os.environ.get("BVSAR_JOB_QUEUE", 1)) == 1
+    FORCE_REPLAN = int(os.environ.get("BVSAR_REPLAN", 0)) == 1
+    DRY_RUN = int(os.environ.get("BVSAR_DRY_RUN", 0)) == 1
+    REPLAN_STALE = int(os.environ.get("BVSAR_REPLAN_STALE", 0)) == 1
 
-    datasource = ogr.Open(AREAS_PATH)
-    if not datasource:
-        logging.error("Could not open {0}. Exiting".format(AREAS_PATH))
-        exit(1)
+    def plan_from_areas():
+        datasource = ogr.Open(AREAS_PATH)
+        if not datasource:
+            logging.error("Could not open {0}. Exiting".format(AREAS_PATH))
+            exit(1)
 
-    if datasource.GetLayerCount() != 1:
-        logging.error(
-            "Expected 1 layer but instead found {0}. Exiting".format(
-                datasource.GetLayerCount()
-            )
-        )
-        exit(1)
-
-    def get_profile_names_for_feature(feature: ogr.Feature) -> List[str]:
-        return list(
-            map(
-                lambda profile_names_part: profile_names_part.strip(),
-                feature.GetFieldAsString("profile").split(","),
+        if datasource.GetLayerCount() != 1:
+            logging.error(
+                "Expected 1 layer but instead found {0}. Exiting".format(
+                    datasource.GetLayerCount()
+                )
             )
-        )
-
-    def get_xyz_url_for_feature(feature: ogr.Feature) -> str:
-        return feature.GetFieldAsString("xyz_url")
+            exit(1)
 
-    provision_args = list()
-    area_layer = datasource.GetLayerByIndex(0)
-    area_layer.SetAttributeFilter(f"strategy = '{RunStrategy.GRIDDED.value}'")
-    while area_feature := area_layer.GetNextFeature():
+        return plan(datasource.GetLayerByIndex(0))
 
-        def round_for_increment(value: float, increment: float) -> float:
-            precision_mulplier = max(int(1 / increment), 0)
-            return int(value * precision_mulplier) / precision_mulplier
+    if DRY_RUN:
+        # estimate the full plan, bboxes that a run would skip are reported as such
+        estimates = estimate_plan(plan_stale() if REPLAN_STALE else plan_from_areas())
+        log_estimates(estimates)
+        write_estimates(estimates)
+        exit(0)
 
-        grid_min_x, grid_min_y, grid_max_x, grid_max_y = (
-            -140,
-            47,
-            -113,
-            61,
-        )  # loose bbox for BC with some buffering
-        grid_srs = osr.SpatialReference()
-        grid_srs.SetFromUserInput("EPSG:4326")
-        cell_x_min, walk_increment = (
-            grid_min_x,
-            float(os.environ.get("GRIDDED_BBOX_INCREMENT", 0.1)),
+    job_queue, plan_id = None, None
+    if REPLAN_STALE:
+        # provenance is updated as each stale bbox is re-rendered, so an interrupted replan resumes by planning again
+        jobs = jobs_from_args(plan_stale())
+    elif USE_JOB_QUEUE:
+        if not os.path.exists(AREAS_PATH):
+            logging.error("Could not open {0}. Exiting".format(AREAS_PATH))
+            exit(1)
+        job_queue = JobQueue(get_job_queue_path())
+        fingerprint = get_plan_fingerprint(
+            AREAS_PATH,
+            {
+                "BBOX_DIVISION": get_bbox_division(),
+                "GRIDDED_BBOX_INCREMENT": get_gridded_bbox_increment(),
+                "GRIDDED_REPEAT_IF_EXISTS": os.environ.get(
+                    "GRIDDED_REPEAT_IF_EXISTS", "0"
+                ),
+            },
         )
-        while cell_x_min < grid_max_x:
-            cell_x_max = round_for_increment(
-                cell_x_min + walk_increment, walk_increment
-            )
-            cell_y_min = grid_min_y
-            while cell_y_min < grid_max_y:
-                cell_y_max = round_for_increment(
-                    cell_y_min + walk_increment, walk_increment
-                )
-                next_cell_geom = ogr.CreateGeometryFromWkt(
-                    f"POLYGON (({cell_x_min} {cell_y_min}, {cell_x_max} {cell_y_min}, {cell_x_max} {cell_y_max}, {cell_x_min} {cell_y_max}, {cell_x_min} {cell_y_min}))"
-                )
-                next_cell_geom.AssignSpatialReference(grid_srs)
-                intersection_geom = area_feature.GetGeometryRef().Intersection(
-                    next_cell_geom
-                )
-                if intersection_geom is not None and not intersection_geom.IsEmpty():
-                    provision_args.extend(
-                        [
-                            ProvisionArg(
-                                bbox=BBOX(
-                                    min_x=cell_x_min,
-                                    min_y=cell_y_min,
-                                    max_x=cell_x_max,
-                                    max_y=cell_y_max,
-                                ),
-                                profile_name=profile_name,
-                                xyz_url=get_xyz_url_for_feature(area_feature),
-                                skippable=int(
-                                    os.environ.get("GRIDDED_REPEAT_IF_EXISTS", 0)
-                                )
-                                != 1,
-                            )
-                            for profile_name in get_profile_names_for_feature(
-                                area_feature
-                            )
-                        ]
-                    )
-                cell_y_min = cell_y_max
-            cell_x_min = cell_x_max
-
-    area_layer.SetAttributeFilter(f"strategy = '{RunStrategy.ENVELOPE.value}'")
-    while area_feature := area_layer.GetNextFeature():
-        min_x, max_x, min_y, max_y = area_feature.GetGeometryRef().GetEnvelope()
-        reset_y = min_y
-        while min_x < max_x:
-            increment_x = min(BBOX_DIVISION, max_x - min_x)
-            min_y = reset_y
-            while min_y < max_y:
-                increment_y = min(BBOX_DIVISION, max_y - min_y)
-                this_max_x = min_x + increment_x
-                this_max_y = min_y + increment_y
-                provision_args.extend(
-                    [
-                        ProvisionArg(
-                            bbox=BBOX(
-                                min_x=min_x,
-                                min_y=min_y,
-                                max_x=this_max_x,
-                                max_y=this_max_y,
-                            ),
-                            profile_name=profile_name,
-                            xyz_url=get_xyz_url_for_feature(area_feature),
-                            skippable=False,
-                        )
-                        for profile_name in get_profile_names_for_feature(area_feature)
-                    ]
-                )
-                min_y += increment_y
-            min_x += increment_x
+        if not FORCE_REPLAN:
+            plan_id = job_queue.resume(fingerprint)
+        if plan_id is None:
+            plan_id = job_queue.create(fingerprint, plan_from_areas())
+        jobs = job_queue.get_pending(plan_id)
+    else:
+        jobs = jobs_from_args(plan_from_areas())
 
-    batch_count = 0
-    for provision_arg in provision_args:
-        provision_result = provision(provision_arg)
-        if provision_result != ProvisionResult.SKIPPED:
-            batch_count += 1
-        if BATCH_SIZE > 0 and batch_count >= BATCH_SIZE:
-            logging.info(f"Batch complete at {batch_count}")
-            exit(0)
+    # fork tile workers now, before provisioning threads and their locks exist
+    get_process_pool()
+    # a crash mid-merge leaves a journal, finish those merges before anything reads or writes results
+    complete_interrupted_merges(get_result_path())
+    try:
+        batch_count = schedule(jobs, get_cell_concurrency(), BATCH_SIZE, job_queue)
+    finally:
+        export_pending_coverage()
+        if remove_intermediaries():
+            clear_clip_cache()
+        if deduplicate_enabled():
+            prune_blobs()
+    if job_queue:
+        job_queue.complete_if_finished(plan_id)
+        job_queue.close()
+    if BATCH_SIZE > 0 and batch_count >= BATCH_SIZE:
+        logging.info(f"Batch complete at {batch_count}")
+        exit(0)
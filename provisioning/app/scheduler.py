@@ -0,0 +1,157 @@
+import logging
+
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Tuple
+
+from app.bbox_provisioner import provision, ProvisionArg, ProvisionResult
+from app.common.bbox import BBOX
+from app.common.util import remove_intermediaries
+from app.record.job_queue import Job, JobQueue
+from app.sources.common.clip_cache import clip_cache_enabled, evict_clip_cache
+
+
+def schedule(
+    jobs: List[Job],
+    concurrency: int = 1,
+    batch_size: int = 0,
+    job_queue: JobQueue = None,
+) -> int:
+    """
+    Provision each job, up to concurrency at once, returning the number of jobs that were not skipped.
+    When batch_size is set no new work is started once that many jobs have been provisioned.
+    When job_queue is provided each job's state is recorded as it starts and finishes.
+    """
+    bbox_jobs = _BBoxJobs(jobs)
+    if concurrency <= 1:
+        return _schedule_serial(jobs, batch_size, job_queue, bbox_jobs)
+    return _schedule_parallel(jobs, concurrency, batch_size, job_queue, bbox_jobs)
+
+
+def jobs_from_args(provision_args: List[ProvisionArg]) -> List[Job]:
+    return [
+        Job(job_id=job_id, arg=provision_arg)
+        for job_id, provision_arg in enumerate(provision_args)
+    ]
+
+
+class _BBoxJobs:
+    """
+    Counts each bbox's unfinished jobs and evicts the sources clipped for a bbox once its last job finishes, as no later job reuses them.
+    Only called from the scheduling thread.
+    """
+
+    def __init__(self, jobs: List[Job]):
+        self.enabled = clip_cache_enabled() and remove_intermediaries()
+        self.remaining: Dict[Tuple, int] = defaultdict(int)
+        self.bboxes: Dict[Tuple, BBOX] = dict()
+        for job in jobs:
+            key = _get_bbox_key(job.arg.bbox)
+            self.remaining[key] += 1
+            self.bboxes[key] = job.arg.bbox
+
+    def finished(self, job: Job) -> None:
+        if not self.enabled:
+            return
+        key = _get_bbox_key(job.arg.bbox)
+        self.remaining[key] -= 1
+        if self.remaining[key] == 0:
+            del self.remaining[key]
+            # a bbox still to be provisioned may contain this one, e.g. an envelope over gridded cells
+            evict_clip_cache(
+                self.bboxes.pop(key),
+                [self.bboxes[other_key] for other_key in self.remaining],
+            )
+
+
+def _get_bbox_key(bbox: BBOX) -> Tuple:
+    return (*bbox.as_tuple(), bbox.crs_code)
+
+
+def _batch_remaining(batch_count: int, batch_size: int) -> int:
+    return batch_size - batch_count if batch_size > 0 else -1
+
+
+def _on_start(job: Job, job_queue: JobQueue) -> None:
+    if job_queue:
+        job_queue.mark_running(job.job_id)
+
+
+def _on_success(job: Job, result: ProvisionResult, job_queue: JobQueue) -> None:
+    if job_queue:
+        job_queue.mark_done(job.job_id, result)
+
+
+def _on_failure(job: Job, ex: Exception, job_queue: JobQueue) -> None:
+    bbox = job.arg.bbox
+    logging.error(
+        f"Failed provisioning {job.arg.profile_name} {bbox.min_x},{bbox.min_y} {bbox.max_x},{bbox.max_y}: {ex}"
+    )
+    if job_queue:
+        job_queue.mark_failed(job.job_id, ex)
+
+
+def _schedule_serial(
+    jobs: List[Job], batch_size: int, job_queue: JobQueue, bbox_jobs: _BBoxJobs
+) -> int:
+    batch_count = 0
+    for job in jobs:
+        if _batch_remaining(batch_count, batch_size) == 0:
+            break
+        _on_start(job, job_queue)
+        try:
+            result = provision(job.arg)
+        except Exception as ex:
+            _on_failure(job, ex, job_queue)
+            raise ex
+        _on_success(job, result, job_queue)
+        bbox_jobs.finished(job)
+        if result != ProvisionResult.SKIPPED:
+            batch_count += 1
+    return batch_count
+
+
+def _schedule_parallel(
+    jobs: List[Job],
+    concurrency: int,
+    batch_size: int,
+    job_queue: JobQueue,
+    bbox_jobs: _BBoxJobs,
+) -> int:
+    logging.info(f"Provisioning up to {concurrency} bbox(es) concurrently")
+    batch_count = 0
+    pending = iter(jobs)
+    in_flight: Dict[Future, Job] = dict()
+    failure = None
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="provision"
+    ) as executor:
+        while True:
+            # in-flight work may not be skipped so never start more than the batch has room for
+            remaining = _batch_remaining(batch_count, batch_size)
+            capacity = concurrency if remaining < 0 else min(concurrency, remaining)
+            while failure is None and len(in_flight) < capacity:
+                job = next(pending, None)
+                if job is None:
+                    break
+                _on_start(job, job_queue)
+                in_flight[executor.submit(provision, job.arg)] = job
+            if len(in_flight) == 0:
+                break
+            done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    _on_failure(job, ex, job_queue)
+                    # let work already in flight finish so no result directory is left mid-update
+                    failure = failure or ex
+                    continue
+                _on_success(job, result, job_queue)
+                bbox_jobs.finished(job)
+                if result != ProvisionResult.SKIPPED:
+                    batch_count += 1
+    if failure is not None:
+        raise failure
+    return batch_count
@@ -12,11 +12,14 @@ from app.common.get_datasource_from_bbox import (
     BBOX_LAYER_NAME,
 )
 from app.common.http_retriever import retrieve, RetrievalRequest
+from app.common.trace import span
+from app.sources.common.estimate import SourceEstimate
 from app.tilemill.ProjectLayerType import ProjectLayerType
 from app.common.util import (
     get_data_path,
     get_cache_path,
     get_run_data_path,
+    get_named_lock,
     swallow_unimportant_warp_error,
     skip_file_creation,
     remove_intermediaries,
@@ -38,6 +41,98 @@ class GenerationRequest(RetrievalRequest):
 def provision(bbox: BBOX, run_id: str) -> List[str]:
     run_directory = get_run_data_path(run_id, (CACHE_DIR_NAME,))
     os.makedirs(run_directory)
+    bbox_cells = _get_generation_requests(bbox, run_directory)
+
+    # cached cells are shared by every run, generate them one run at a time
+    with get_named_lock(CACHE_DIR_NAME):
+        to_generate = list(
+            filter(
+                lambda generation_request: not skip_file_creation(
+                    generation_request.hs_path
+                ),
+                bbox_cells,
+            )
+        )
+        retrieve(to_generate, HTTP_RETRIEVAL_CONCURRENCY)
+
+        with span("hillshade.generate") as generate_span:
+            generate_span.add(items=len(to_generate))
+            for generation_request in to_generate:
+                with zipfile.ZipFile(generation_request.path, "r") as zip_ref:
+                    zip_ref.extractall(get_cache_path((CACHE_DIR_NAME,)))
+                Warp(
+                    generation_request.prj_path,
+                    generation_request.dem_path,
+                    srcSRS="EPSG:4269",
+                    dstSRS=OUTPUT_CRS_CODE,
+                    resampleAlg="cubic",
+                )
+                DEMProcessing(
+                    generation_request.hs_path,
+                    generation_request.prj_path,
+                    "hillshade",
+                    format="GTiff",
+                    band=1,
+                    azimuth=225,
+                    altitude=45,
+                    scale=1,
+                    zFactor=1,
+                    computeEdges=True,
+                )
+                if remove_intermediaries():
+                    os.remove(generation_request.path)
+                    os.remove(generation_request.dem_path)
+                    os.remove(generation_request.prj_path)
+
+    with span("hillshade.clip") as clip_span:
+        clip_span.add(items=len(bbox_cells))
+        for generation_request in bbox_cells:
+            try:
+                Warp(
+                    generation_request.run_path,
+                    generation_request.hs_path,
+                    cutlineDSName=get_datasource_from_bbox(
+                        bbox, get_run_data_path(run_id, None)
+                    ),
+                    cutlineLayer=BBOX_LAYER_NAME,
+                    cropToCutline=False,
+                    cutlineBlend=1,
+                    dstNodata=-1,
+                )
+            except Exception as ex:
+                swallow_unimportant_warp_error(ex)
+
+    merged_output_path = os.path.join(run_directory, "merged.tif")
+    Warp(
+        merged_output_path,
+        list(
+            filter(
+                lambda run_path: os.path.exists(run_path),
+                map(lambda generation_request: generation_request.run_path, bbox_cells),
+            )
+        ),
+    )
+
+    return [merged_output_path]
+
+
+def estimate(bbox: BBOX) -> SourceEstimate:
+    bbox_cells = _get_generation_requests(bbox, get_run_data_path("estimate", None))
+    return SourceEstimate(
+        source=CACHE_DIR_NAME,
+        unit="dem cells",
+        total=len(bbox_cells),
+        cached=len(
+            [
+                generation_request
+                for generation_request in bbox_cells
+                if skip_file_creation(generation_request.hs_path)
+            ]
+        ),
+    )
+
+
+def _get_generation_requests(bbox: BBOX, run_directory: str) -> List[GenerationRequest]:
     driver = GetDriverByName("GPKG")
     grid_datasource = driver.Open(get_data_path(("grids.gpkg",)))
     grid_layer = grid_datasource.GetLayerByName("Canada-50000")
@@ -66,69 +161,4 @@ def provision(bbox: BBOX, run_id: str) -> List[str]:
                     run_path=os.path.join(run_directory, f"{cell_part_name}.tif"),
                 )
             )
-
-    to_generate = list(
-        filter(
-            lambda generation_request: not skip_file_creation(
-                generation_request.hs_path
-            ),
-            bbox_cells,
-        )
-    )
-    retrieve(to_generate, HTTP_RETRIEVAL_CONCURRENCY)
-
-    for generation_request in to_generate:
-        with zipfile.ZipFile(generation_request.path, "r") as zip_ref:
-            zip_ref.extractall(get_cache_path((CACHE_DIR_NAME,)))
-        Warp(
-            generation_request.prj_path,
-            generation_request.dem_path,
-            srcSRS="EPSG:4269",
-            dstSRS=OUTPUT_CRS_CODE,
-            resampleAlg="cubic",
-        )
-        DEMProcessing(
-            generation_request.hs_path,
-            generation_request.prj_path,
-            "hillshade",
-            format="GTiff",
-            band=1,
-            azimuth=225,
-            altitude=45,
-            scale=1,
-            zFactor=1,
-            computeEdges=True,
-        )
-        if remove_intermediaries():
-            os.remove(generation_request.path)
-            os.remove(generation_request.dem_path)
-            os.remove(generation_request.prj_path)
-
-    for generation_request in bbox_cells:
-        try:
-            Warp(
-                generation_request.run_path,
-                generation_request.hs_path,
-                cutlineDSName=get_datasource_from_bbox(
-                    bbox, get_run_data_path(run_id, None)
-                ),
-                cutlineLayer=BBOX_LAYER_NAME,
-                cropToCutline=False,
-                cutlineBlend=1,
-                dstNodata=-1,
-            )
-        except Exception as ex:
-            swallow_unimportant_warp_error(ex)
-
-    merged_output_path = os.path.join(run_directory, "merged.tif")
-    Warp(
-        merged_output_path,
-        list(
-            filter(
-                lambda run_path: os.path.exists(run_path),
-                map(lambda generation_request: generation_request.run_path, bbox_cells),
-            )
-        ),
-    )
-
-    return [merged_output_path]
+    return bbox_cells
@@ -5,17 +5,21 @@ from osgeo import ogr
 from typing import Final, List
 
 from app.common.bbox import BBOX
-from app.common.ftp_retriever import fetch
+from app.common.ftp_retriever import fetch, get_fetch_path
 from app.common.util import get_run_data_path
+from app.sources.common.clip_cache import dataset_version
 from app.sources.common.ogr_to_shp import ogr_to_provided
 from app.tilemill.ProjectLayerType import ProjectLayerType
 import zipfile
 
-from app.common.util import get_cache_path
+from app.common.util import get_cache_path, get_named_lock
 
 
 CACHE_DIR_NAME: Final = "bc-waterways"
 OUTPUT_CRS_CODE: Final = "EPSG:3857"
+FWA_FILE_NAME: Final = "FWA_BC.zip"
+FWA_DOMAIN: Final = "ftp.geobc.gov.bc.ca"
+FWA_PATH: Final = "/sections/outgoing/bmgs/FWA_Public"
 OUTPUT_TYPE: Final = ProjectLayerType.LINESTRING
 
 
@@ -23,14 +27,13 @@ def provision(bbox: BBOX, run_id: str) -> List[str]:
     logging.info(
         "Retrieving BC Freshwater Atlas - this could take a while the first time"
     )
-    zip_path = fetch(
-        "FWA_BC.zip", "ftp.geobc.gov.bc.ca", "/sections/outgoing/bmgs/FWA_Public"
-    )
+    zip_path = fetch(FWA_FILE_NAME, FWA_DOMAIN, FWA_PATH)
     fgdb_dir = os.path.dirname(zip_path)
     fgdb = os.path.join(fgdb_dir, "FWA_BC.gdb")
-    if not os.path.exists(fgdb):
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(get_cache_path((fgdb_dir,)))
+    with get_named_lock(fgdb):
+        if not os.path.exists(fgdb):
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                zip_ref.extractall(get_cache_path((fgdb_dir,)))
     logging.info("Retrieved BC Freshwater Atlas")
     run_directory = get_run_data_path(run_id, (CACHE_DIR_NAME,))
     os.makedirs(run_directory)
@@ -101,3 +104,8 @@ def provision(bbox: BBOX, run_id: str) -> List[str]:
     mem_datasource = None
     dst_datasource = None
     return [dst_path]
+
+
+def get_version() -> str:
+    # the extracted geodatabase is only refreshed with the archive
+    return dataset_version(get_fetch_path(FWA_FILE_NAME, FWA_DOMAIN, FWA_PATH))
@@ -1,8 +1,10 @@
 from typing import Dict, Final, List, Tuple
 
 from app.common.bbox import BBOX
+from app.sources.common.estimate import SourceEstimate
 from app.sources.common.wms import (
     provision as wms_provisioner,
+    estimate as wms_estimate,
     OUTPUT_TYPE as WMS_OUTPUT_TYPE,
     WmsProperties,
 )
@@ -11,19 +13,37 @@ CACHE_DIR_NAME: Final = "canvec"
 OUTPUT_CRS_CODE: Final = "EPSG:3857"
 OUTPUT_TYPE: Final = WMS_OUTPUT_TYPE
 HTTP_RETRIEVAL_CONCURRENCY: Final = 2
+BASE_URL: Final = "http://maps.geogratis.gc.ca/wms/canvec_en"
+WMS_PROPERTIES: Final = WmsProperties(max_width=4096, max_height=4096)
+LAYERS: Final = ("canvec",)
+IMAGE_FORMAT: Final = "png"
 
 
 def provision(bbox: BBOX, scales: Tuple[int], run_id: str) -> Dict[int, List[str]]:
     return wms_provisioner(
         bbox,
-        "http://maps.geogratis.gc.ca/wms/canvec_en",
-        WmsProperties(max_width=4096, max_height=4096),
+        BASE_URL,
+        WMS_PROPERTIES,
         OUTPUT_CRS_CODE,
-        ("canvec",),
+        LAYERS,
         tuple(),
         scales,
-        "png",
+        IMAGE_FORMAT,
         CACHE_DIR_NAME,
         run_id,
         HTTP_RETRIEVAL_CONCURRENCY,
     )
+
+
+def estimate(bbox: BBOX, scales: Tuple[int]) -> SourceEstimate:
+    return wms_estimate(
+        bbox,
+        BASE_URL,
+        WMS_PROPERTIES,
+        OUTPUT_CRS_CODE,
+        LAYERS,
+        tuple(),
+        scales,
+        IMAGE_FORMAT,
+        CACHE_DIR_NAME,
+    )
@@ -0,0 +1,133 @@
+import glob
+import json
+import logging
+import os
+
+from hashlib import md5
+from shutil import rmtree
+from threading import Lock
+from typing import Callable, Dict, Final, Iterable, List
+
+from app.common.bbox import BBOX
+from app.common.util import get_named_lock, get_run_data_path
+
+CLIP_CACHE_RUN_PREFIX: Final = "clip-"
+MANIFEST_FILE_NAME: Final = "manifest.json"
+
+# clip runs this process made or reused and the bbox each was clipped to, so they can be evicted by bbox
+_clip_runs: Dict[str, BBOX] = dict()
+_clip_runs_lock = Lock()
+
+
+def clip_cache_enabled() -> bool:
+    return int(os.environ.get("BVSAR_CLIP_CACHE", 1)) == 1
+
+
+def dataset_version(path: str) -> str:
+    """
+    Cheap fingerprint of a source dataset, a file or a directory such as a file geodatabase, from its size and modification time.
+    """
+    if not os.path.exists(path):
+        return "missing"
+    if os.path.isfile(path):
+        stats = [os.stat(path)]
+    else:
+        stats = [
+            os.stat(os.path.join(dirpath, filename))
+            for dirpath, _, filenames in os.walk(path)
+            for filename in filenames
+        ]
+    return "{0}-{1}-{2}".format(
+        len(stats),
+        sum([stat.st_size for stat in stats]),
+        max([stat.st_mtime_ns for stat in stats], default=0),
+    )
+
+
+def provision_cached(
+    provisioner: Callable[[BBOX, str], List[str]],
+    cache_dir_name: str,
+    version: str,
+    bbox: BBOX,
+    run_id: str,
+) -> List[str]:
+    """
+    Clipped output is keyed by (source, bbox, source version) so profiles sharing a bbox clip each source once.
+    Output is kept under the run data directory as TileMill can only read from there, until evicted once every profile of the bbox is provisioned.
+    """
+    if not clip_cache_enabled():
+        return provisioner(bbox, run_id)
+    clip_run_id = _get_clip_run_id(cache_dir_name, version, bbox)
+    with get_named_lock(clip_run_id):
+        with _clip_runs_lock:
+            _clip_runs[clip_run_id] = bbox
+        manifest_path = get_run_data_path(clip_run_id, (MANIFEST_FILE_NAME,))
+        if os.path.exists(manifest_path):
+            logging.info(f"Reusing clipped {cache_dir_name} for bbox")
+            with open(manifest_path, "r") as f:
+                return json.load(f)
+        clip_run_dir = get_run_data_path(clip_run_id, None)
+        if os.path.exists(clip_run_dir):
+            # left behind by an interrupted clip
+            rmtree(clip_run_dir)
+        paths = provisioner(bbox, clip_run_id)
+        with open(manifest_path, "w") as f:
+            json.dump(paths, f)
+        return paths
+
+
+def is_cached(cache_dir_name: str, version: str, bbox: BBOX) -> bool:
+    return clip_cache_enabled() and os.path.exists(
+        get_run_data_path(
+            _get_clip_run_id(cache_dir_name, version, bbox), (MANIFEST_FILE_NAME,)
+        )
+    )
+
+
+def evict_clip_cache(bbox: BBOX, retained: Iterable[BBOX] = ()) -> int:
+    """
+    Removes output clipped within bbox, e.g. once every profile of bbox is provisioned, unless it is also within a retained bbox still to be provisioned.
+    Returns the number of clip runs removed.
+    """
+    retained = list(retained)
+    with _clip_runs_lock:
+        evicted = [
+            clip_run_id
+            for clip_run_id, clip_bbox in _clip_runs.items()
+            if _is_within(clip_bbox, bbox)
+            and not any(_is_within(clip_bbox, other) for other in retained)
+        ]
+    for clip_run_id in evicted:
+        with get_named_lock(clip_run_id):
+            rmtree(get_run_data_path(clip_run_id, None), ignore_errors=True)
+            with _clip_runs_lock:
+                _clip_runs.pop(clip_run_id, None)
+    if len(evicted) > 0:
+        logging.info(f"Evicted {len(evicted)} clipped source(s)")
+    return len(evicted)
+
+
+def clear_clip_cache() -> None:
+    for clip_run_dir in glob.glob(get_run_data_path(f"{CLIP_CACHE_RUN_PREFIX}*", None)):
+        rmtree(clip_run_dir, ignore_errors=True)
+    with _clip_runs_lock:
+        _clip_runs.clear()
+
+
+def _get_clip_run_id(cache_dir_name: str, version: str, bbox: BBOX) -> str:
+    key = md5(
+        json.dumps([cache_dir_name, bbox.as_tuple(), bbox.crs_code, version]).encode(
+            "UTF-8"
+        )
+    ).hexdigest()
+    return f"{CLIP_CACHE_RUN_PREFIX}{key}"
+
+
+def _is_within(inner: BBOX, outer: BBOX) -> bool:
+    return (
+        inner.crs_code == outer.crs_code
+        and inner.min_x >= outer.min_x
+        and inner.min_y >= outer.min_y
+        and inner.max_x <= outer.max_x
+        and inner.max_y <= outer.max_y
+    )
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+
+
+class SourceEstimate(BaseModel):
+    """
+    Work a source would do for one bbox, total units of which cached are already in the source's cache.
+    """
+
+    source: str
+    unit: str
+    total: int
+    cached: int = 0
+
+    @property
+    def missing(self) -> int:
+        return self.total - self.cached
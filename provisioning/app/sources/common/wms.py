@@ -11,10 +11,13 @@ from typing import Dict, Final, List, Tuple
 
 from app.common.bbox import BBOX
 from app.common.http_retriever import retrieve, RetrievalRequest
+from app.common.trace import span
+from app.sources.common.estimate import SourceEstimate
 from app.tilemill.ProjectLayerType import ProjectLayerType
 from app.common.util import (
     get_run_data_path,
     get_cache_path,
+    get_named_lock,
     swallow_unimportant_warp_error,
     skip_file_creation,
     remove_intermediaries,
@@ -78,12 +81,45 @@ def provision(
         cache_directory,
         run_directory,
     )
-    grid_for_missing = _filter_grid_for_missing(grid_for_retrieval)
-    requests = _convert_grid_to_requests(grid_for_missing, image_format)
-    retrieve(requests, http_retrieval_concurrency)
-    if image_format != TARGET_FILE_FORMAT:
-        _convert_to_tif(grid_for_missing, wms_crs_code)
-    return _create_run_output(bbox, grid_for_retrieval, wms_crs_code)
+    with get_named_lock(cache_directory):
+        grid_for_missing = _filter_grid_for_missing(grid_for_retrieval)
+        requests = _convert_grid_to_requests(grid_for_missing, image_format)
+        retrieve(requests, http_retrieval_concurrency)
+        if image_format != TARGET_FILE_FORMAT:
+            with span("wms.convert", cache=cache_dir_name) as convert_span:
+                _convert_to_tif(grid_for_missing, wms_crs_code)
+                convert_span.add(items=len(grid_for_missing))
+    with span("wms.run_output", cache=cache_dir_name):
+        return _create_run_output(bbox, grid_for_retrieval, wms_crs_code)
+
+
+def estimate(
+    bbox: BBOX,
+    base_url: str,
+    wms_properties: WmsProperties,
+    wms_crs_code: str,
+    layers: Tuple[str],
+    styles: Tuple[str],
+    scales: Tuple[int],
+    image_format: str,
+    cache_dir_name: str,
+) -> SourceEstimate:
+    grid = _update_grid_for_retrieval(
+        base_url,
+        _build_grid_for_bbox(bbox, wms_crs_code, scales, wms_properties),
+        layers,
+        styles,
+        wms_crs_code,
+        image_format,
+        get_cache_path((cache_dir_name,)),
+        get_run_data_path("estimate", (cache_dir_name,)),
+    )
+    return SourceEstimate(
+        source=cache_dir_name,
+        unit="wms requests",
+        total=len(grid),
+        cached=len(grid) - len(_filter_grid_for_missing(grid)),
+    )
 
 
 def _build_grid_for_bbox(
@@ -4,6 +4,7 @@ from osgeo import ogr
 from typing import Final, List
 
 from app.common.bbox import BBOX
+from app.sources.common.clip_cache import dataset_version
 from app.sources.common.ogr_to_shp import ogr_to_shp
 from app.tilemill.ProjectLayerType import ProjectLayerType
 from app.common.util import get_run_data_path
@@ -29,3 +30,7 @@ def provision(bbox: BBOX, run_id: str) -> List[str]:
     )
     datasource = None
     return [path]
+
+
+def get_version() -> str:
+    return dataset_version(LOCAL_FEATURES_PATH)
@@ -1,6 +1,5 @@
 import os
 import re
-import math
 
 from enum import Enum
 from pydantic import BaseModel
@@ -9,7 +8,9 @@ from typing import Dict, List, Final
 
 from app.common.bbox import BBOX
 from app.common.http_retriever import retrieve, ExistsCheckRequest, RetrievalRequest
-from app.common.util import get_cache_path, skip_file_creation
+from app.common.xyz import identify_tiles
+from app.common.util import get_cache_path, skip_file_creation, OVERWRITE_EXISTING
+from app.sources.common.estimate import SourceEstimate
 
 CACHE_DIR_NAME_BASE: Final = "xyz-"
 HTTP_RETRIEVAL_CONCURRENCY: Final = 6
@@ -33,7 +34,7 @@ def provision(
     image_formats: List[str],
     file_extension: str = None,
 ) -> ProvisionResult:
-    tiles = _identify_tiles(bbox, zoom_min, zoom_max)
+    tiles = identify_tiles(bbox, zoom_min, zoom_max)
     retrieve(
         _build_retrieval_requests(tiles, url_template, image_formats, file_extension),
         HTTP_RETRIEVAL_CONCURRENCY,
@@ -44,6 +45,35 @@ def provision(
     )
 
 
+def estimate(
+    bbox: BBOX,
+    url_template: str,
+    zoom_min: int,
+    zoom_max: int,
+    file_extension: str = None,
+) -> SourceEstimate:
+    total, cached = 0, 0
+    for z, xs in identify_tiles(bbox, zoom_min, zoom_max).items():
+        for x, ys in xs.items():
+            x_dir = os.path.dirname(
+                _build_tile_path(z, x, 0, url_template, file_extension)
+            )
+            # one listing per column is far cheaper than a stat per tile over a whole plan
+            existing = set(os.listdir(x_dir)) if os.path.isdir(x_dir) else set()
+            for y in ys:
+                total += 1
+                if OVERWRITE_EXISTING and f"{y}.{file_extension}" in existing:
+                    cached += 1
+    return SourceEstimate(source="xyz", unit="tiles", total=total, cached=cached)
+
+
+def count_tiles(bbox: BBOX, zoom_min: int, zoom_max: int) -> Dict[int, int]:
+    return {
+        z: sum([len(ys) for ys in xs.values()])
+        for z, xs in identify_tiles(bbox, zoom_min, zoom_max).items()
+    }
+
+
 def build_exists_check_requests(
     bbox: BBOX,
     url_template: str,
@@ -54,12 +84,15 @@ def build_exists_check_requests(
 ) -> List[ExistsCheckRequest]:
     requests = list()
     url_format = _determine_format(url_template)
-    for z, xs in _identify_tiles(bbox, zoom_min, zoom_max).items():
+    for z, xs in identify_tiles(bbox, zoom_min, zoom_max).items():
         for x, ys in xs.items():
             for y in ys:
                 requests.append(
                     ExistsCheckRequest(
                         url=_build_tile_url(url_format, url_template, z, x, y),
+                        z=z,
+                        x=x,
+                        y=y,
                     )
                 )
     return requests
@@ -73,27 +106,6 @@ def get_output_dir(url_template: str) -> str:
     return get_cache_path((dir_name,))
 
 
-def _identify_tiles(
-    bbox: BBOX, zoom_min: int, zoom_max: int
-) -> Dict[int, Dict[int, List[int]]]:
-    tiles = dict()
-    currentZoom = zoom_min
-    while currentZoom <= zoom_max:
-        tiles[currentZoom] = dict()
-        llTileX, llTileY = _deg_to_num(bbox.min_y, bbox.min_x, currentZoom)
-        urTileX, urTileY = _deg_to_num(bbox.max_y, bbox.max_x, currentZoom)
-        currentX = llTileX
-        while currentX <= urTileX:
-            tiles[currentZoom][currentX] = list()
-            currentY = llTileY
-            while currentY >= urTileY:
-                tiles[currentZoom][currentX].append(currentY)
-                currentY -= 1
-            currentX += 1
-        currentZoom += 1
-    return tiles
-
-
 def _build_retrieval_requests(
     tiles: Dict[int, Dict[int, List[int]]],
     url_template: str,
@@ -150,15 +162,6 @@ def _build_tile_path(
     return os.path.join(x_dir, f"{y}.{file_extension}")
 
 
-# https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
-def _deg_to_num(lat_deg, lon_deg, zoom):
-    lat_rad = math.radians(lat_deg)
-    n = 2.0 ** zoom
-    xtile = int((lon_deg + 180.0) / 360.0 * n)
-    ytile = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
-    return (xtile, ytile)
-
-
 def _build_tile_url(
     url_format: UrlFormat, url_template: str, z: int, x: int, y: int
 ) -> str:
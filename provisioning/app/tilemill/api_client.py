@@ -6,7 +6,6 @@ from osgeo.ogr import GetDriverByName
 import time
 import random
 import logging
-import datetime
 import requests
 import uuid
 
@@ -17,7 +16,9 @@ from app.tilemill.ProjectLayerType import ProjectLayerType
 from app.tilemill.ProjectCreationProperties import ProjectCreationProperties
 from app.tilemill.ProjectProperties import ProjectProperties
 from pyproj import CRS, Transformer
-from typing import Dict
+from typing import Dict, Final
+
+EXPORT_POLL_INTERVAL: Final = 1
 
 
 def create_or_update_project(
@@ -61,17 +62,18 @@ def create_or_update_project(
 
 def request_export(tilemill_url: str, project_properties: ProjectProperties) -> str:
     token = _generateToken()
-    nowTs = _getNowAsEpochMs()
+    # exports of different profiles run concurrently, a timestamp id is not unique and a PUT with the same id replaces the export
+    export_id = re.sub("[^a-z0-9]", "", str(uuid.uuid4()), flags=re.IGNORECASE)
     export_filename = "{project_name}_{unique_part}.mbtiles".format(
         project_name=project_properties.name,
-        unique_part=re.sub("[^a-z0-9]", "", str(uuid.uuid4()), flags=re.IGNORECASE),
+        unique_part=export_id,
     )
     exportDefinition = {
         "progress": 0,
         "status": "waiting",
         "format": "mbtiles",
         "project": project_properties.name,
-        "id": str(nowTs),
+        "id": export_id,
         "zooms": (project_properties.zoom_min, project_properties.zoom_max),
         "metatile": 2,
         "center": (*project_properties.bbox.get_centre(), project_properties.zoom_min),
@@ -85,7 +87,7 @@ def request_export(tilemill_url: str, project_properties: ProjectProperties) ->
         "bones.token": token,
     }
     requests.put(
-        f"{tilemill_url}/api/Export/{nowTs}",
+        f"{tilemill_url}/api/Export/{export_id}",
         data=json.dumps(exportDefinition),
         headers={"Content-Type": "application/json"},
         cookies={"bones.token": token},
@@ -110,6 +112,9 @@ def request_export(tilemill_url: str, project_properties: ProjectProperties) ->
                         time.sleep(
                             min(10, sys.maxsize if remaining == 0 else remaining / 1000)
                         )
+            if remaining is None:
+                # not listed yet, wait rather than poll TileMill continuously
+                time.sleep(EXPORT_POLL_INTERVAL)
         except Exception as ex:
             logging.error(f"API rejected request for update or error processing: {ex}")
             break
@@ -157,10 +162,6 @@ def _generateToken() -> str:
     return token
 
 
-def _getNowAsEpochMs() -> int:
-    return int(datetime.datetime.now().timestamp())
-
-
 def _getExtentFromRaster(path: str, crs_code: str) -> BBOX:
     image = Open(path)
     ulx, xres, _, uly, _, yres = image.GetGeoTransform()
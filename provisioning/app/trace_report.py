@@ -0,0 +1,124 @@
+import argparse
+import glob
+import json
+import os
+
+from collections import defaultdict
+from typing import Dict, Iterator, List
+
+from app.common.trace import get_trace_file_path, get_trace_path
+
+
+def read_spans(trace_file_paths: List[str]) -> Iterator[Dict[str, object]]:
+    for trace_file_path in trace_file_paths:
+        with open(trace_file_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def aggregate(spans: Iterator[Dict[str, object]]) -> Dict[str, Dict[str, float]]:
+    stages = defaultdict(
+        lambda: {
+            "count": 0,
+            "errors": 0,
+            "duration": 0.0,
+            "duration_max": 0.0,
+            "items": 0,
+            "bytes": 0,
+            "peak_rss_kb": 0,
+            "rss_growth_kb": 0,
+        }
+    )
+    for span in spans:
+        stage = stages[span["name"]]
+        stage["count"] += 1
+        stage["errors"] += 1 if span.get("error") else 0
+        stage["duration"] += span["duration"]
+        stage["duration_max"] = max(stage["duration_max"], span["duration"])
+        stage["items"] += span.get("items", 0)
+        stage["bytes"] += span.get("bytes", 0)
+        # memory of the provisioner and its workers while the span was open, including concurrent spans' work
+        peak_rss_kb = span.get("peak_rss_kb") or 0
+        stage["peak_rss_kb"] = max(stage["peak_rss_kb"], peak_rss_kb)
+        if span.get("start_rss_kb") is not None:
+            stage["rss_growth_kb"] = max(
+                stage["rss_growth_kb"], peak_rss_kb - span["start_rss_kb"]
+            )
+    return dict(stages)
+
+
+def format_report(stages: Dict[str, Dict[str, float]]) -> str:
+    # nested stages are included in their parent's duration so the share is of provision time, not additive
+    provision_duration = stages.get("provision", dict()).get("duration", 0)
+    lines = [
+        "{:<32} {:>7} {:>11} {:>9} {:>9} {:>7} {:>10} {:>10} {:>9} {:>9} {:>9}".format(
+            "stage",
+            "count",
+            "total s",
+            "mean s",
+            "max s",
+            "share",
+            "items",
+            "items/s",
+            "MB",
+            "peak MB",
+            "growth MB",
+        )
+    ]
+    for name, stage in sorted(
+        stages.items(), key=lambda item: item[1]["duration"], reverse=True
+    ):
+        lines.append(
+            "{:<32} {:>7} {:>11.1f} {:>9.2f} {:>9.2f} {:>7} {:>10} {:>10} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                name + (f" ({stage['errors']} failed)" if stage["errors"] else ""),
+                stage["count"],
+                stage["duration"],
+                stage["duration"] / stage["count"],
+                stage["duration_max"],
+                f"{stage['duration'] / provision_duration:.0%}"
+                if provision_duration
+                else "-",
+                stage["items"],
+                f"{stage['items'] / stage['duration']:.1f}"
+                if stage["items"] and stage["duration"]
+                else "-",
+                stage["bytes"] / 1024 / 1024,
+                stage["peak_rss_kb"] / 1024,
+                stage["rss_growth_kb"] / 1024,
+            )
+        )
+    return os.linesep.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate BVSAR_TRACE spans by stage across one or more provision runs"
+    )
+    parser.add_argument(
+        "run_ids",
+        type=str,
+        nargs="*",
+        help="run ids to include, all traced runs when omitted",
+    )
+    parser.add_argument(
+        "--since",
+        type=float,
+        default=None,
+        help="only include trace files written after this epoch time",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON not a table")
+    args = parser.parse_args()
+    if args.run_ids:
+        trace_file_paths = [get_trace_file_path(run_id) for run_id in args.run_ids]
+    else:
+        trace_file_paths = sorted(glob.glob(get_trace_path(("*.jsonl",))))
+    if args.since is not None:
+        trace_file_paths = [
+            trace_file_path
+            for trace_file_path in trace_file_paths
+            if os.path.getmtime(trace_file_path) >= args.since
+        ]
+    stages = aggregate(read_spans(trace_file_paths))
+    print(f"{len(trace_file_paths)} run(s)")
+    print(json.dumps(stages, indent=2) if args.json else format_report(stages))
@@ -0,0 +1,514 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, __version__ as pillow_version
+from typing import Dict, Final, List, Tuple
+
+from app.common.quantize import QUANTIZE_METHODS
+
+CASES: Final = ("merge_tiles", "transparent_clip_to_bbox", "get_edge_tiles")
+MODES: Final = ("RGBA", "P")
+TILE_SIZE: Final = 256
+# somewhere in BC so generated trees look like real cells
+DEFAULT_LON: Final = -123.1
+DEFAULT_LAT: Final = 49.3
+
+
+class TileTree:
+    """
+    Describes a synthetic z/x/y.png tile tree of width by height tiles at one zoom.
+    """
+
+    def __init__(self, zoom: int, width: int, height: int, mode: str, seed: int):
+        self.zoom = zoom
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.seed = seed
+        self.x_min, self.y_min = _lon_lat_to_tile(DEFAULT_LON, DEFAULT_LAT, zoom)
+
+    def tiles(self) -> List[Tuple[int, int, int]]:
+        return [
+            (self.zoom, x, y)
+            for x in range(self.x_min, self.x_min + self.width)
+            for y in range(self.y_min, self.y_min + self.height)
+        ]
+
+    def inset_bbox(self) -> Tuple[float, float, float, float]:
+        """Lon/lat bbox half a tile inside the tree so every edge tile needs clipping"""
+        min_lon, max_lat = _tile_to_lon_lat(
+            self.x_min + 0.5, self.y_min + 0.5, self.zoom
+        )
+        max_lon, min_lat = _tile_to_lon_lat(
+            self.x_min + self.width - 0.5, self.y_min + self.height - 0.5, self.zoom
+        )
+        return min_lon, min_lat, max_lon, max_lat
+
+    def write(self, tile_dir: str, opaque: bool) -> List[str]:
+        rand = random.Random(f"{self.seed}-{opaque}")
+        tile_paths = list()
+        for z, x, y in self.tiles():
+            tile_path = os.path.join(tile_dir, str(z), str(x), f"{y}.png")
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            _synthetic_tile(rand, self.mode, opaque).save(tile_path)
+            tile_paths.append(tile_path)
+        return tile_paths
+
+
+def _synthetic_tile(rand: random.Random, mode: str, opaque: bool) -> Image.Image:
+    # opaque tiles stand in for an xyz base, the rest for a sparse TileMill overlay
+    background = (
+        (rand.randrange(256), rand.randrange(256), rand.randrange(256), 255)
+        if opaque
+        else (0, 0, 0, 0)
+    )
+    tile = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), background)
+    draw = ImageDraw.Draw(tile)
+    for _ in range(rand.randrange(4, 24)):
+        colour = (
+            rand.randrange(256),
+            rand.randrange(256),
+            rand.randrange(256),
+            rand.choice((64, 128, 192, 255)),
+        )
+        points = [
+            (rand.randrange(TILE_SIZE), rand.randrange(TILE_SIZE)) for _ in range(2)
+        ]
+        if rand.random() < 0.5:
+            draw.line(points, fill=colour, width=rand.randrange(1, 6))
+        else:
+            draw.rectangle(
+                [
+                    (min(points[0][0], points[1][0]), min(points[0][1], points[1][1])),
+                    (max(points[0][0], points[1][0]), max(points[0][1], points[1][1])),
+                ],
+                fill=colour,
+            )
+    return tile.quantize(method=2) if mode == "P" else tile
+
+
+def _lon_lat_to_tile(lon: float, lat: float, zoom: int) -> Tuple[int, int]:
+    n = pow(2, zoom)
+    lat_rad = math.radians(lat)
+    return (
+        int((lon + 180.0) / 360.0 * n),
+        int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n),
+    )
+
+
+def _tile_to_lon_lat(x: float, y: float, zoom: int) -> Tuple[float, float]:
+    n = pow(2, zoom)
+    return (
+        x / n * 360.0 - 180.0,
+        math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n)))),
+    )
+
+
+def run_case(
+    case: str,
+    tree: TileTree,
+    pool_size: int,
+    quantize: bool,
+    work_dir: str,
+    quantize_method: str = None,
+) -> Tuple[float, int]:
+    """
+    Times one call of the case against a freshly written tree, returning seconds and the bytes of the tiles it wrote.
+    """
+    # the pool size is read when the shared pool is created
+    os.environ["PERMIT_MULTIPROCESSING"] = "1"
+    os.environ["BVSAR_POOL_SIZE"] = str(pool_size)
+    if quantize_method:
+        os.environ["BVSAR_QUANTIZE_METHOD"] = quantize_method
+    from app.common.bbox import BBOX
+    from app.common.util import get_process_pool
+    from app.common.xyz import get_edge_tiles, merge_tiles, transparent_clip_to_bbox
+
+    # the pool lives for the whole provisioning session so its start-up is not part of each call
+    get_process_pool()
+
+    base_dir = os.path.join(work_dir, "base")
+    overlay_dir = os.path.join(work_dir, "overlay")
+    base_paths = tree.write(base_dir, True)
+    overlay_paths = tree.write(overlay_dir, False)
+    if case == "merge_tiles":
+        path_tuples = [
+            (base_path, overlay_path, overlay_path)
+            for base_path, overlay_path in zip(base_paths, overlay_paths)
+        ]
+        start = time.perf_counter()
+        merge_tiles(path_tuples, quantize)
+        written_paths = overlay_paths
+    elif case == "transparent_clip_to_bbox":
+        min_x, min_y, max_x, max_y = tree.inset_bbox()
+        bbox = BBOX(min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
+        start = time.perf_counter()
+        transparent_clip_to_bbox(base_paths, bbox, quantize)
+        written_paths = base_paths
+    elif case == "get_edge_tiles":
+        min_x, min_y, max_x, max_y = tree.inset_bbox()
+        bbox = BBOX(min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
+        start = time.perf_counter()
+        get_edge_tiles(bbox, tree.zoom, tree.zoom, base_dir)
+        written_paths = list()
+    else:
+        raise ValueError(f"Unknown case {case}")
+    seconds = time.perf_counter() - start
+    # clipping leaves tiles inside the bbox untouched, they are counted all the same
+    return seconds, sum([os.path.getsize(path) for path in written_paths])
+
+
+def verify(tile_count: int, seed: int) -> int:
+    """
+    Compares merge_tiles and edge clipping with the per-pixel implementations they replaced,
+    returning the number of tiles that differ.
+    """
+    os.environ["PERMIT_MULTIPROCESSING"] = "0"
+    from app.common.xyz import clear_outside, merge_tiles
+
+    rand = random.Random(seed)
+    mismatches = 0
+    for mode in MODES:
+        work_dir = tempfile.mkdtemp(prefix="bvsar-verify-")
+        try:
+            path_tuples, expected = list(), list()
+            for i in range(tile_count):
+                # bases are opaque like an xyz base, semi-transparent and random noise
+                base = (
+                    _noise_tile(rand)
+                    if i % 3 == 2
+                    else _synthetic_tile(rand, mode, i % 3 == 0)
+                )
+                overlay = (
+                    _noise_tile(rand)
+                    if i % 3 == 2
+                    else _synthetic_tile(rand, mode, False)
+                )
+                base_path = os.path.join(work_dir, f"base-{i}.png")
+                overlay_path = os.path.join(work_dir, f"overlay-{i}.png")
+                base.save(base_path)
+                overlay.save(overlay_path)
+                expected.append(
+                    reference_merge(Image.open(base_path), Image.open(overlay_path))
+                )
+                path_tuples.append((base_path, overlay_path, overlay_path))
+            merge_tiles(path_tuples, False)
+            for (_, _, output_path), expected_tile in zip(path_tuples, expected):
+                if not np.array_equal(
+                    np.asarray(Image.open(output_path).convert("RGBA")),
+                    np.asarray(expected_tile),
+                ):
+                    mismatches += 1
+                    print(f"{mode} {output_path} differs from the reference")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        for _ in range(tile_count):
+            tile = _synthetic_tile(rand, mode, True).convert("RGBA")
+            # offsets from none to almost the whole tile, as a bbox edge can fall anywhere
+            offsets = [rand.choice((0, rand.randrange(TILE_SIZE))) for _ in range(4)]
+            if not np.array_equal(
+                clear_outside(np.array(tile), *offsets),
+                np.asarray(reference_clip(tile.copy(), *offsets)),
+            ):
+                mismatches += 1
+                print(f"{mode} clip by {offsets} differs from the reference")
+    print(f"{mismatches} of {tile_count * len(MODES) * 2} tile(s) differ")
+    return mismatches
+
+
+def reference_clip(
+    tile: Image.Image,
+    left_pixels: int,
+    bottom_pixels: int,
+    right_pixels: int,
+    top_pixels: int,
+) -> Image.Image:
+    """The per-pixel clearing transparent_clip_to_bbox used before it was vectorized"""
+    for i in range(TILE_SIZE):
+        for j in range(TILE_SIZE):
+            coord = (i, j)
+            if (
+                i < left_pixels
+                or i >= (TILE_SIZE - right_pixels)
+                or j < top_pixels
+                or j >= (TILE_SIZE - bottom_pixels)
+            ):
+                new_values = (0, 0, 0, 0)
+                tile.putpixel(coord, new_values)
+    return tile
+
+
+def reference_merge(base_image: Image.Image, overlay_image: Image.Image) -> Image.Image:
+    """The per-pixel compositing merge_tiles used before it was vectorized"""
+    overlay_image = overlay_image.convert("RGBA")
+    base_image = base_image.convert("RGBA")
+    for i in range(TILE_SIZE):
+        for j in range(TILE_SIZE):
+            coord = (i, j)
+            overlay_values = overlay_image.getpixel(coord)
+            if len(overlay_values) == 3:
+                overlay_values += (255,)
+            if overlay_values[3] > 0:
+                base_image.putpixel(
+                    coord,
+                    _reference_combine_pixels(
+                        base_image.getpixel(coord) + (255,), overlay_values
+                    ),
+                )
+    return base_image
+
+
+def _reference_combine_pixels(base_rgba, overlay_rgba):
+    alpha = 255 - ((255 - base_rgba[3]) * (255 - overlay_rgba[3]) / 255)
+    red = (
+        base_rgba[0] * (255 - overlay_rgba[3]) + overlay_rgba[0] * overlay_rgba[3]
+    ) / 255
+    green = (
+        base_rgba[1] * (255 - overlay_rgba[3]) + overlay_rgba[1] * overlay_rgba[3]
+    ) / 255
+    blue = (
+        base_rgba[2] * (255 - overlay_rgba[3]) + overlay_rgba[2] * overlay_rgba[3]
+    ) / 255
+    return (int(red), int(green), int(blue), int(alpha))
+
+
+def _noise_tile(rand: random.Random) -> Image.Image:
+    # every alpha value, including 0 and 255, appears somewhere
+    return Image.frombytes(
+        "RGBA",
+        (TILE_SIZE, TILE_SIZE),
+        bytes([rand.randrange(256) for _ in range(TILE_SIZE * TILE_SIZE * 4)]),
+    )
+
+
+def _run_isolated(arg: Dict[str, object]) -> Dict[str, object]:
+    # each measurement runs in its own interpreter so peak memory belongs to that measurement alone
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.compositing", "--worker", json.dumps(arg)],
+        cwd=os.path.join(os.path.dirname(__file__), ".."),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return json.loads(output.decode("UTF-8").strip().split(os.linesep)[-1])
+
+
+def _worker(arg: Dict[str, object]) -> None:
+    tree = TileTree(arg["zoom"], arg["width"], arg["height"], arg["mode"], arg["seed"])
+    work_dir = tempfile.mkdtemp(prefix="bvsar-bench-")
+    try:
+        seconds, output_bytes = run_case(
+            arg["case"],
+            tree,
+            arg["pool_size"],
+            arg["quantize"],
+            work_dir,
+            arg["quantize_method"],
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    from app.common.util import close_process_pool
+
+    # workers only count towards RUSAGE_CHILDREN once they have exited
+    close_process_pool()
+    print(
+        json.dumps(
+            {
+                "seconds": seconds,
+                "output_bytes": output_bytes,
+                "peak_rss_kb": max(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                ),
+            }
+        )
+    )
+
+
+def benchmark(args: argparse.Namespace) -> Dict[str, object]:
+    results = list()
+    tile_count = args.width * args.height
+    for case in args.cases:
+        for mode in args.modes:
+            # get_edge_tiles neither saves tiles nor uses the pool
+            pool_sizes, quantize_options = (
+                (args.pool_sizes[:1], [False])
+                if case == "get_edge_tiles"
+                else (args.pool_sizes, args.quantize)
+            )
+            settings = [
+                (quantize, quantize_method)
+                for quantize in quantize_options
+                for quantize_method in (args.quantize_methods if quantize else [None])
+            ]
+            for pool_size in pool_sizes:
+                for quantize, quantize_method in settings:
+                    arg = {
+                        "case": case,
+                        "mode": mode,
+                        "pool_size": pool_size,
+                        "quantize": quantize,
+                        "quantize_method": quantize_method,
+                        "zoom": args.zoom,
+                        "width": args.width,
+                        "height": args.height,
+                        "seed": args.seed,
+                    }
+                    samples = [_run_isolated(arg) for _ in range(args.repeat)]
+                    seconds = statistics.median(
+                        [sample["seconds"] for sample in samples]
+                    )
+                    result = {
+                        **arg,
+                        "tiles": tile_count,
+                        "seconds": seconds,
+                        "seconds_min": min(sample["seconds"] for sample in samples),
+                        "tiles_per_sec": tile_count / seconds if seconds else None,
+                        "peak_rss_mb": max(sample["peak_rss_kb"] for sample in samples)
+                        / 1024,
+                        "output_mb": samples[0]["output_bytes"] / 1024 / 1024,
+                    }
+                    print(_format_result(result))
+                    results.append(result)
+    return {
+        "created_at": time.time(),
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": pillow_version,
+            "cpu_count": multiprocessing.cpu_count(),
+            "platform": platform.platform(),
+            "commit": _get_commit(),
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, object], baseline: Dict[str, object]) -> None:
+    baseline_results = {_result_key(result): result for result in baseline["results"]}
+    for result in current["results"]:
+        previous = baseline_results.get(_result_key(result))
+        if previous is None or not previous["seconds"]:
+            continue
+        print(
+            f"{_format_result(result)}  {previous['seconds'] / result['seconds']:.2f}x vs baseline"
+        )
+
+
+def _result_key(result: Dict[str, object]) -> Tuple:
+    # outputs from before quantize methods were configurable used octree
+    return tuple(
+        result[key]
+        for key in ("case", "mode", "pool_size", "quantize", "zoom", "width", "height")
+    ) + (
+        result.get("quantize_method", "octree" if result["quantize"] else None),
+    )
+
+
+def _format_result(result: Dict[str, object]) -> str:
+    return "{:<26} {:<4} pool={:<3} quantize={:<13} {:>6} tiles {:>8.2f}s {:>9.1f} tiles/s {:>8.1f}MB peak {:>7.2f}MB out".format(
+        result["case"],
+        result["mode"],
+        result["pool_size"],
+        result.get("quantize_method") or str(result["quantize"]),
+        result["tiles"],
+        result["seconds"],
+        result["tiles_per_sec"] or 0,
+        result["peak_rss_mb"],
+        result.get("output_mb", 0),
+    )
+
+
+def _get_commit() -> str:
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(__file__),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            .stdout.decode("UTF-8")
+            .strip()
+        )
+    except OSError:
+        return None
+
+
+def _get_default_output_path() -> str:
+    return os.path.join(
+        os.environ.get("DATA_LOCATION", tempfile.gettempdir()),
+        "benchmark",
+        f"compositing-{time.strftime('%Y%m%dT%H%M%S')}.json",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark tile compositing on synthetic tile trees"
+    )
+    parser.add_argument("--worker", type=str, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--verify",
+        type=int,
+        default=None,
+        metavar="TILES",
+        help="check merge_tiles matches the per-pixel reference on this many tiles per mode, then exit",
+    )
+    parser.add_argument("--cases", type=str, nargs="+", choices=CASES, default=CASES)
+    parser.add_argument("--modes", type=str, nargs="+", choices=MODES, default=MODES)
+    parser.add_argument(
+        "--pool-sizes",
+        type=int,
+        nargs="+",
+        default=sorted(set([1, max(1, multiprocessing.cpu_count() - 1)])),
+    )
+    parser.add_argument(
+        "--quantize",
+        type=lambda value: value.lower() in ("1", "true", "yes"),
+        nargs="+",
+        default=[True, False],
+    )
+    parser.add_argument(
+        "--quantize-methods",
+        type=str,
+        nargs="+",
+        choices=QUANTIZE_METHODS,
+        default=["octree"],
+        help="BVSAR_QUANTIZE_METHOD values to time when quantizing",
+    )
+    parser.add_argument("--zoom", type=int, default=14)
+    parser.add_argument("--width", type=int, default=16, help="tiles per row")
+    parser.add_argument("--height", type=int, default=16, help="tiles per column")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument(
+        "--compare", type=str, default=None, help="earlier output to compare with"
+    )
+    args = parser.parse_args()
+    if args.worker:
+        _worker(json.loads(args.worker))
+        sys.exit(0)
+    if args.verify is not None:
+        sys.exit(1 if verify(args.verify, args.seed) else 0)
+    report = benchmark(args)
+    output_path = args.output or _get_default_output_path()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output_path}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(report, json.load(f))
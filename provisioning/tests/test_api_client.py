@@ -0,0 +1,72 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("osgeo")
+pytest.importorskip("pyproj")
+
+from app.common.bbox import BBOX  # noqa: E402
+from app.tilemill import api_client  # noqa: E402
+from app.tilemill.ProjectProperties import ProjectProperties  # noqa: E402
+
+
+class _FakeTileMill:
+    """Records exports as TileMill does, a PUT to an id already exported replaces that export"""
+
+    def __init__(self, concurrency: int):
+        self.exports = dict()
+        self.urls = list()
+        self.lock = threading.Lock()
+        # both PUTs are held until the other arrives so they land in the same instant
+        self.barrier = threading.Barrier(concurrency, timeout=10)
+
+    def put(self, url, data, **kwargs):
+        self.barrier.wait()
+        export = json.loads(data)
+        with self.lock:
+            self.urls.append(url)
+            self.exports[export["id"]] = export
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            statuses = [
+                {**export, "progress": 1, "remaining": 0}
+                for export in self.exports.values()
+            ]
+
+        class _Response:
+            def json(self):
+                return statuses
+
+        return _Response()
+
+
+def test_concurrent_exports_have_distinct_ids(monkeypatch):
+    tilemill = _FakeTileMill(2)
+    monkeypatch.setattr(api_client.requests, "put", tilemill.put)
+    monkeypatch.setattr(api_client.requests, "get", tilemill.get)
+    monkeypatch.setattr(api_client, "EXPORT_POLL_INTERVAL", 0)
+    bbox = BBOX(min_x=-125, min_y=49, max_x=-124, max_y=50)
+    filenames = dict()
+
+    def export(name: str):
+        filenames[name] = api_client.request_export(
+            "http://tilemill",
+            ProjectProperties(bbox=bbox, zoom_min=5, zoom_max=12, name=name),
+        )
+
+    threads = [
+        threading.Thread(target=export, args=(name,), daemon=True)
+        for name in ("hillshade", "terrain")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive(), "export never completed"
+    assert len(tilemill.exports) == 2
+    assert len(set(tilemill.urls)) == 2
+    assert sorted(filenames.values()) == sorted(
+        export["filename"] for export in tilemill.exports.values()
+    )
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from app.common.bbox import BBOX
+from app.common.util import get_run_data_path
+from app.sources.common import clip_cache
+
+
+def _clip(bbox: BBOX, name: str = "trails") -> str:
+    def provisioner(bbox: BBOX, run_id: str):
+        path = get_run_data_path(run_id, (f"{name}.gpkg",))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(name)
+        return [path]
+
+    return clip_cache.provision_cached(provisioner, name, "1", bbox, "run")[0]
+
+
+def _cell(min_x: float, min_y: float) -> BBOX:
+    return BBOX(min_x=min_x, min_y=min_y, max_x=min_x + 1, max_y=min_y + 1)
+
+
+@pytest.fixture(autouse=True)
+def data_location(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_LOCATION", str(tmp_path))
+    monkeypatch.setenv("BVSAR_CLIP_CACHE", "1")
+    yield tmp_path
+    clip_cache.clear_clip_cache()
+
+
+def test_evict_removes_only_the_bbox_entries():
+    cell, neighbour = _cell(-125, 49), _cell(-124, 49)
+    cell_paths = [_clip(cell, "trails"), _clip(cell, "shelters")]
+    neighbour_path = _clip(neighbour)
+    assert clip_cache.evict_clip_cache(cell) == 2
+    assert not any(os.path.exists(path) for path in cell_paths)
+    assert os.path.exists(neighbour_path)
+    # clipped again when needed after eviction
+    assert os.path.exists(_clip(cell))
+
+
+def test_evict_keeps_entries_within_a_retained_bbox():
+    envelope, cell = BBOX(min_x=-126, min_y=48, max_x=-123, max_y=51), _cell(-125, 49)
+    envelope_path, cell_path = _clip(envelope), _clip(cell)
+    # the envelope finished first but the cell within it is still to be provisioned
+    assert clip_cache.evict_clip_cache(envelope, [cell]) == 1
+    assert not os.path.exists(envelope_path)
+    assert os.path.exists(cell_path)
@@ -0,0 +1,118 @@
+import json
+import os
+
+from app.common.util import (
+    GENERATIONS_DIR_NAME,
+    MERGE_JOURNAL_NAME,
+    complete_interrupted_merges,
+    merge_dirs,
+)
+
+
+def _write_tiles(root, tiles):
+    for tile_path, content in tiles.items():
+        path = os.path.join(root, tile_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+
+def _read_tiles(root):
+    tiles = dict()
+    for dirpath, _, filenames in os.walk(root, followlinks=True):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path) as f:
+                tiles[os.path.relpath(path, root)] = f.read()
+    return tiles
+
+
+def _generations(tmp_path):
+    return sorted(
+        name
+        for name in os.listdir(tmp_path / GENERATIONS_DIR_NAME / "profile")
+        if name.isdigit()
+    )
+
+
+def test_merge_publishes_a_new_generation(tmp_path):
+    dest = tmp_path / "profile"
+    _write_tiles(tmp_path / "run-1", {"5/1/1.png": "a", "5/2/1.png": "b"})
+    merge_dirs(str(tmp_path / "run-1"), str(dest))
+    assert os.path.islink(dest)
+    first = os.path.realpath(dest)
+
+    _write_tiles(tmp_path / "run-2", {"5/1/1.png": "c", "5/1/2.png": "d"})
+    merge_dirs(str(tmp_path / "run-2"), str(dest))
+    assert _read_tiles(dest) == {
+        os.path.join("5", "1", "1.png"): "c",
+        os.path.join("5", "1", "2.png"): "d",
+        os.path.join("5", "2", "1.png"): "b",
+    }
+    # a reader that resolved the link before the merge still sees the whole previous generation
+    assert _read_tiles(first) == {
+        os.path.join("5", "1", "1.png"): "a",
+        os.path.join("5", "2", "1.png"): "b",
+    }
+    # the column the merge did not touch is shared rather than relinked
+    assert os.path.islink(dest / "5" / "2")
+    assert not os.path.exists(tmp_path / "run-1")
+    assert not os.path.exists(tmp_path / "run-2")
+
+
+def test_merge_removes_unused_generations(tmp_path):
+    dest = tmp_path / "profile"
+    for i in range(4):
+        _write_tiles(tmp_path / f"run-{i}", {"5/1/1.png": str(i)})
+        merge_dirs(str(tmp_path / f"run-{i}"), str(dest))
+    # the current generation and the one before it
+    assert _generations(tmp_path) == ["3", "4"]
+
+
+def test_merge_keeps_linked_columns_of_removed_generations(tmp_path):
+    dest = tmp_path / "profile"
+    for i in range(4):
+        _write_tiles(tmp_path / f"run-{i}", {f"5/{i}/1.png": str(i)})
+        merge_dirs(str(tmp_path / f"run-{i}"), str(dest))
+    assert _read_tiles(dest) == {
+        os.path.join("5", str(i), "1.png"): str(i) for i in range(4)
+    }
+    # only the column a live generation links to is left of generation 1
+    assert _read_tiles(tmp_path / GENERATIONS_DIR_NAME / "profile" / "1") == {
+        os.path.join("5", "0", "1.png"): "0"
+    }
+
+
+def test_merge_moves_a_plain_directory_into_generations(tmp_path):
+    dest = tmp_path / "profile"
+    _write_tiles(dest, {"5/1/1.png": "a", "coverage.geojson": "{}"})
+    _write_tiles(tmp_path / "run-1", {"5/2/1.png": "b"})
+    merge_dirs(str(tmp_path / "run-1"), str(dest))
+    assert os.path.islink(dest)
+    assert _read_tiles(dest) == {
+        os.path.join("5", "1", "1.png"): "a",
+        os.path.join("5", "2", "1.png"): "b",
+        "coverage.geojson": "{}",
+    }
+
+
+def test_interrupted_merge_is_published_again(tmp_path):
+    dest = tmp_path / "profile"
+    _write_tiles(tmp_path / "run-1", {"5/1/1.png": "a"})
+    merge_dirs(str(tmp_path / "run-1"), str(dest))
+    # as a crash while building generation 2 leaves it
+    _write_tiles(tmp_path / "run-2", {"5/1/1.png": "b", "5/1/2.png": "c"})
+    generations_root = tmp_path / GENERATIONS_DIR_NAME / "profile"
+    _write_tiles(generations_root / "2", {"5/1/1.png": "b"})
+    with open(generations_root / MERGE_JOURNAL_NAME, "w") as f:
+        json.dump({"source": str(tmp_path / "run-2"), "generation": "2"}, f)
+    assert _read_tiles(dest) == {os.path.join("5", "1", "1.png"): "a"}
+
+    complete_interrupted_merges(str(tmp_path))
+    assert _read_tiles(dest) == {
+        os.path.join("5", "1", "1.png"): "b",
+        os.path.join("5", "1", "2.png"): "c",
+    }
+    assert not os.path.exists(generations_root / MERGE_JOURNAL_NAME)
+    assert not os.path.exists(tmp_path / "run-2")
+    assert "2" not in _generations(tmp_path)
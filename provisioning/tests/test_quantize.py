@@ -0,0 +1,62 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.common.quantize import (
+    PALETTE_SIZE,
+    _exact_palette,
+    get_quantize_method,
+    quantize_tile,
+)
+from app.common.xyz import TILE_SIZE
+
+
+def _tile_with_colours(count: int) -> np.ndarray:
+    rand = np.random.default_rng(16)
+    # distinct opaque colours, each a different 24 bit value
+    values = rand.choice(1 << 24, size=count, replace=False)
+    colours = np.stack(
+        [values >> 16, (values >> 8) & 0xFF, values & 0xFF, np.full(count, 255)],
+        axis=-1,
+    ).astype(np.uint8)
+    pixels = colours[np.arange(TILE_SIZE * TILE_SIZE) % count]
+    return rand.permutation(pixels).reshape((TILE_SIZE, TILE_SIZE, 4))
+
+
+def _decode(image: Image.Image) -> np.ndarray:
+    # through PNG, as tiles are stored, so the palette's alpha must survive saving
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    buffer.seek(0)
+    return np.asarray(Image.open(buffer).convert("RGBA"))
+
+
+def test_exact_palette_is_lossless():
+    tile = _tile_with_colours(PALETTE_SIZE - 2)
+    # translucent pixels keep their colour, fully transparent ones of any colour become one entry
+    # or these 8 would take the tile past the palette size
+    tile[0, :8] = [10, 20, 30, 128]
+    tile[1, :8] = np.random.default_rng(0).integers(0, 256, (8, 4))
+    tile[1, :8, 3] = 0
+    image = _exact_palette(tile)
+    assert image.mode == "P"
+    assert len(image.getcolors()) == PALETTE_SIZE
+    np.testing.assert_array_equal(_decode(image), np.where(tile[..., 3:] == 0, 0, tile))
+
+
+def test_exact_falls_back_to_octree_above_palette_size():
+    tile = _tile_with_colours(PALETTE_SIZE + 1)
+    assert _exact_palette(tile) is None
+    image = quantize_tile(tile, "exact")
+    assert image.mode == "P"
+    assert image.tobytes() == quantize_tile(tile, "octree").tobytes()
+
+
+def test_invalid_quantize_method_raises(monkeypatch):
+    monkeypatch.setenv("BVSAR_QUANTIZE_METHOD", "median")
+    with pytest.raises(ValueError):
+        get_quantize_method()
+    with pytest.raises(ValueError):
+        quantize_tile(_tile_with_colours(2))
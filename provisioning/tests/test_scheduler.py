@@ -0,0 +1,61 @@
+import os
+import threading
+
+import pytest
+
+from app.common.bbox import BBOX
+from app.common.util import get_run_data_path
+from app.sources.common import clip_cache
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATA_LOCATION", str(tmp_path))
+    monkeypatch.setenv("BVSAR_CLIP_CACHE", "1")
+    monkeypatch.setenv("REMOVE_INTERMEDIARIES", "1")
+    # settings are read from the environment on import
+    yield pytest.importorskip("app.scheduler")
+    clip_cache.clear_clip_cache()
+
+
+@pytest.mark.parametrize("concurrency", [1, 2])
+def test_clipped_sources_are_evicted_after_the_last_profile(
+    scheduler, monkeypatch, concurrency
+):
+    ProvisionArg, ProvisionResult = scheduler.ProvisionArg, scheduler.ProvisionResult
+    clipped, seen, lock = dict(), list(), threading.Lock()
+
+    def provisioner(bbox: BBOX, run_id: str):
+        path = get_run_data_path(run_id, ("trails.gpkg",))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+        return [path]
+
+    def provision(arg):
+        path = clip_cache.provision_cached(provisioner, "trails", "1", arg.bbox, "run")[
+            0
+        ]
+        with lock:
+            clipped[arg.profile_name, arg.bbox.min_x] = path
+            # every clip seen so far that is still on disk
+            seen.append({key for key, path in clipped.items() if os.path.exists(path)})
+        return ProvisionResult.SUCCESS
+
+    monkeypatch.setattr(scheduler, "provision", provision)
+    cells = [
+        BBOX(min_x=min_x, min_y=49, max_x=min_x + 1, max_y=50) for min_x in (-125, -124)
+    ]
+    jobs = scheduler.jobs_from_args(
+        [
+            ProvisionArg(bbox=cell, profile_name=profile_name, skippable=False)
+            for cell in cells
+            for profile_name in ("xyzsummer", "xyzwinter")
+        ]
+    )
+    assert scheduler.schedule(jobs, concurrency) == 4
+    # both profiles of a cell share one clip
+    assert clipped["xyzsummer", -125] == clipped["xyzwinter", -125]
+    assert not any(os.path.exists(path) for path in clipped.values())
+    if concurrency == 1:
+        # the first cell's clip is gone before the second cell is provisioned
+        assert seen[2] == {("xyzsummer", -124)}
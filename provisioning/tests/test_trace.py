@@ -0,0 +1,56 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from app.common.trace import (
+    RSS_SAMPLE_INTERVAL,
+    get_trace_file_path,
+    span,
+    trace_run,
+)
+
+ALLOCATION_KB = 64 * 1024
+
+pytestmark = pytest.mark.skipif(
+    not os.path.exists("/proc/self/statm"), reason="memory is read from /proc"
+)
+
+
+def _allocate(allocated, release) -> None:
+    # written rather than zeroed so the pages are resident
+    data = b"\x01" * (ALLOCATION_KB * 1024)
+    allocated.set()
+    release.wait(10)
+    del data
+
+
+def _read_spans(run_id: str):
+    with open(get_trace_file_path(run_id), "r") as f:
+        return {record["name"]: record for record in map(json.loads, f)}
+
+
+def test_span_peak_includes_workers_and_is_not_the_process_lifetime_peak(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setenv("DATA_LOCATION", str(tmp_path))
+    monkeypatch.setenv("BVSAR_TRACE", "1")
+    context = multiprocessing.get_context("fork")
+    allocated, release = context.Event(), context.Event()
+    with trace_run("run"):
+        with span("allocate"):
+            worker = context.Process(target=_allocate, args=(allocated, release))
+            worker.start()
+            assert allocated.wait(10)
+            time.sleep(RSS_SAMPLE_INTERVAL * 3)
+            release.set()
+            worker.join()
+        with span("after"):
+            pass
+    spans = _read_spans("run")
+    allocate, after = spans["allocate"], spans["after"]
+    # freed by the worker before the span closed, so only seen by sampling
+    assert allocate["peak_rss_kb"] - allocate["start_rss_kb"] > ALLOCATION_KB * 0.75
+    assert allocate["peak_rss_kb"] - after["peak_rss_kb"] > ALLOCATION_KB * 0.75
@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+from PIL import Image
+
+from app.common.xyz import TILE_SIZE, _merge_batch, composite_over
+
+
+# https://stackoverflow.com/a/52993128/519575
+# the per-pixel formula merge_tiles used before it was vectorized, kept as the reference
+def _combine_pixels(base_rgba, overlay_rgba):
+    alpha = 255 - ((255 - base_rgba[3]) * (255 - overlay_rgba[3]) / 255)
+    red = (
+        base_rgba[0] * (255 - overlay_rgba[3]) + overlay_rgba[0] * overlay_rgba[3]
+    ) / 255
+    green = (
+        base_rgba[1] * (255 - overlay_rgba[3]) + overlay_rgba[1] * overlay_rgba[3]
+    ) / 255
+    blue = (
+        base_rgba[2] * (255 - overlay_rgba[3]) + overlay_rgba[2] * overlay_rgba[3]
+    ) / 255
+    return (int(red), int(green), int(blue), int(alpha))
+
+
+def _reference_merge(base: np.ndarray, overlay: np.ndarray) -> np.ndarray:
+    merged = base.copy()
+    for i in range(base.shape[0]):
+        for j in range(base.shape[1]):
+            # pixels with a transparent overlay were left as they were
+            if overlay[i, j, 3] > 0:
+                merged[i, j] = _combine_pixels(
+                    tuple(base[i, j].tolist()), tuple(overlay[i, j].tolist())
+                )
+    return merged
+
+
+def _random_tile(rand: random.Random) -> np.ndarray:
+    return np.frombuffer(
+        bytes([rand.randrange(256) for _ in range(TILE_SIZE * TILE_SIZE * 4)]),
+        np.uint8,
+    ).reshape((TILE_SIZE, TILE_SIZE, 4))
+
+
+def test_composite_over_every_alpha_pair():
+    rand = random.Random(11)
+    base, overlay = _random_tile(rand).copy(), _random_tile(rand).copy()
+    # row is the base alpha and column the overlay alpha, so one tile covers every pair
+    alphas = np.arange(256, dtype=np.uint8)
+    base[..., 3] = alphas[:, np.newaxis]
+    overlay[..., 3] = alphas[np.newaxis, :]
+    np.testing.assert_array_equal(
+        composite_over(base, overlay), _reference_merge(base, overlay)
+    )
+
+
+def test_merge_batch_matches_reference(tmp_path):
+    rand = random.Random(25)
+    tiles = [(_random_tile(rand), _random_tile(rand)) for _ in range(3)]
+    # a fully transparent overlay takes the pass-through path
+    tiles.append((_random_tile(rand), np.zeros((TILE_SIZE, TILE_SIZE, 4), np.uint8)))
+    batch = list()
+    for i, (base, overlay) in enumerate(tiles):
+        base_path, overlay_path = (
+            tmp_path / f"base-{i}.png",
+            tmp_path / f"overlay-{i}.png",
+        )
+        Image.fromarray(base, "RGBA").save(base_path)
+        Image.fromarray(overlay, "RGBA").save(overlay_path)
+        batch.append((str(base_path), str(overlay_path), str(tmp_path / f"{i}.png")))
+    _merge_batch((batch, False))
+    for (base, overlay), (_, _, output_path) in zip(tiles, batch):
+        np.testing.assert_array_equal(
+            np.asarray(Image.open(output_path).convert("RGBA")),
+            _reference_merge(base, overlay),
+        )
@@ -18,7 +18,8 @@ def cache_connections():
     with cache_lock:
         for dirname in os.listdir(TILES_DIR):
             dirpath = os.path.join(TILES_DIR, dirname)
-            if os.path.isdir(dirpath):
+            # hidden directories such as the provisioner's .blobs store are not tilesets
+            if os.path.isdir(dirpath) and not dirname.startswith("."):
                 try:
                     if dirname not in connections:
                         mbtiles_path = os.path.join(
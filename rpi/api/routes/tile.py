@@ -5,6 +5,7 @@ import io
 import json
 import math
 import os
+from sqlite3 import Connection, OperationalError
 from threading import Lock
 from typing import Optional
 from fastapi.routing import APIRouter
@@ -29,16 +30,21 @@ async def tile_info():
         if len(tilesets) == 0:
             for dirname in os.listdir(TILES_DIR):
                 profile_path = os.path.join(TILES_DIR, dirname)
-                geojson_path = os.path.join(profile_path, "coverage.geojson")
+                # the dissolved coverage is far smaller than the record of every provisioned bbox
+                geojson_path = os.path.join(profile_path, "coverage-dissolved.geojson")
+                if not os.path.exists(geojson_path):
+                    geojson_path = os.path.join(profile_path, "coverage.geojson")
                 attribution_path = os.path.join(profile_path, "attribution.json")
                 if os.path.isdir(profile_path) and os.path.exists(geojson_path):
                     mbtiles_connection = get_connection(dirname)
                     if mbtiles_connection:
                         zoom_min = 0
                         zoom_max_start = time()
-                        zoom_max = mbtiles_connection.execute(
-                            "select max(zoom_level) from tiles"
-                        ).fetchone()[0]
+                        zoom_max = get_metadata_zoom_max(mbtiles_connection)
+                        if zoom_max is None:
+                            zoom_max = mbtiles_connection.execute(
+                                "select max(zoom_level) from tiles"
+                            ).fetchone()[0]
                         logging.info(
                             f"{dirname} zoom limits from mbtiles in {time() - zoom_max_start}s"
                         )
@@ -50,7 +56,8 @@ async def tile_info():
                             [
                                 int(zoomdir)
                                 for zoomdir in os.listdir(profile_path)
-                                if os.path.isdir(os.path.join(profile_path, zoomdir))
+                                if zoomdir.isdigit()
+                                and os.path.isdir(os.path.join(profile_path, zoomdir))
                             ]
                         )
                         zoom_min = 0
@@ -78,6 +85,17 @@ async def tile_info():
     return tilesets
 
 
+def get_metadata_zoom_max(mbtiles_connection: Connection) -> Optional[int]:
+    # kept current by the provisioner, packaged mbtiles may not have it
+    try:
+        row = mbtiles_connection.execute(
+            "select value from metadata where name = 'maxzoom'"
+        ).fetchone()
+    except OperationalError:
+        return None
+    return int(row[0]) if row else None
+
+
 @router.get("/file/{profile_name}/{z}/{x}/{y}.png")
 async def tile(
     profile_name: str, z: int, x: int, y: int, supertile: Optional[int] = 0